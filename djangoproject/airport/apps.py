@@ -1,7 +1,19 @@
 from django.apps import AppConfig
+from django.contrib.auth.signals import user_logged_out
+from django.db.backends.signals import connection_created
 
 
 class AirportAppConfig(AppConfig):
     label = 'airport'
     name = 'airport'
     verbose_name = 'Airport'
+
+    def ready(self):
+        from . import lib, sqlite
+
+        connection_created.connect(
+            sqlite.apply_profile, dispatch_uid='airport.sqlite.apply_profile'
+        )
+        user_logged_out.connect(
+            lib.forget_session, dispatch_uid='airport.lib.forget_session'
+        )
@@ -0,0 +1,238 @@
+"""
+Benchmarks for the game's hot paths.
+
+Each benchmark is a function, registered with the @benchmark decorator, that
+is given a Fixture (players and games to work with), does whatever setup it
+needs and returns a callable that does the operation being measured.  run()
+measures each benchmark a number of times and records the best wall time and
+the most queries.  compare() checks the
+results against a baseline (as saved by the "benchmark" management command)
+and returns the regressions.
+"""
+import json
+import random
+import time
+from collections import OrderedDict
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.db import connection, reset_queries
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from . import lib, models, monkeywrench, views
+
+BENCHMARKS = OrderedDict()
+
+# differences in wall time smaller than this (in seconds) are noise
+SECONDS_SLACK = 0.002
+
+
+def benchmark(name):
+    """Register the decorated function as the benchmark *name*"""
+
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+
+    return decorator
+
+
+class Fixture(object):
+    """The players and games the benchmarks work with (built on demand)"""
+
+    password = 'benchmark'
+
+    def __init__(self):
+        self._players = {}
+        self._game = None
+        self._finished_game = None
+        self._client = None
+
+    def player(self, name):
+        """Return the player *name*, creating it if need be"""
+        if name not in self._players:
+            username = 'benchmark-{0}'.format(name)
+            user = User.objects.create_user(username=username, password=self.password)
+            self._players[name] = models.Player.objects.create(user=user)
+        return self._players[name]
+
+    def new_game(self, name):
+        """Return a new 15 airport game in progress, with its flights
+        scheduled, hosted by the player *name* (whose last game is ended)"""
+        host = self.player(name)
+        game = host.current_game
+        if game is not None:
+            game.end()
+        game = models.Game.objects.create_game(host=host, goals=3, airports=15)
+        game.begin()
+        lib.take_turn(game)
+        return game
+
+    @property
+    def game(self):
+        """A 15 airport game in progress with its flights scheduled"""
+        if self._game is None:
+            self._game = self.new_game('player')
+        return self._game
+
+    @property
+    def finished_game(self):
+        """A 15 airport game that is over"""
+        if self._finished_game is None:
+            game = models.Game.objects.create_game(
+                host=self.player('finisher'), goals=3, airports=15
+            )
+            game.begin()
+            lib.take_turn(game)
+            game.end()
+            self._finished_game = game
+        return self._finished_game
+
+    @property
+    def client(self):
+        """A test client logged in as the player of the finished game"""
+        if self._client is None:
+            player = self.player('finisher')
+            self._client = Client()
+            self._client.login(username=player.username, password=self.password)
+        return self._client
+
+
+def create_game(airports):
+    def prepare(fixture):
+        host = fixture.player('host')
+        game = host.current_game
+        if game is not None:
+            game.end()
+        return lambda: models.Game.objects.create_game(
+            host=host, goals=3, airports=airports
+        )
+
+    return prepare
+
+
+for count in (15, 50, 150):
+    benchmark('create_game.{0}'.format(count))(create_game(count))
+
+
+@benchmark('take_turn')
+def take_turn(fixture):
+    game = fixture.game
+    return lambda: lib.take_turn(game)
+
+
+@benchmark('player_info')
+def player_info(fixture):
+    game = fixture.game
+    player = fixture.player('player')
+    return lambda: player.info(game)
+
+
+@benchmark('games_info')
+def games_info(fixture):
+    fixture.game
+    models.lobby.invalidate()
+    return models.Game.games_info
+
+
+@benchmark('games_stats')
+def games_stats(fixture):
+    client = fixture.client
+    url = reverse('airport.views.games_stats')
+    return lambda: client.get(url)
+
+
+@benchmark('game_summary')
+def game_summary(fixture):
+    game = fixture.finished_game
+    player = fixture.player('finisher')
+    client = fixture.client
+    # the summary of a finished game is cached.  Measure the real thing.
+    cache.delete(views.game_summary_cache_key(game, player, player.user))
+    return lambda: client.get(reverse('game_summary'), {'id': game.pk})
+
+
+@benchmark('broadcast')
+def broadcast(fixture):
+    game = fixture.game
+    return lambda: models.Message.objects.broadcast('Benchmark', game=game)
+
+
+def throw(wrench):
+    def prepare(fixture):
+        # a wrench can leave nothing for the next one to do (e.g. cancelled
+        # flights) so each throw gets a game of its own
+        return wrench(fixture.new_game('wrench')).throw
+
+    return prepare
+
+
+for name, wrench in sorted(monkeywrench.registry().items()):
+    if wrench is not monkeywrench.MonkeyWrench:
+        benchmark('wrench.{0}'.format(name))(throw(wrench))
+
+
+def run(names=None, repeat=5, fixture=None, seed=0):
+    """Run the benchmarks *names* (all of them by default) *repeat* times.
+
+    Each benchmark is run once more beforehand, unmeasured, so that the
+    fixtures it needs are built and the caches are warm.  The random number
+    generator is seeded with *seed* so that the worlds built are the same
+    from run to run.
+
+    Return an OrderedDict of name -> {'seconds': best time, 'queries': most
+    queries}.
+    """
+    random.seed(seed)
+    fixture = fixture or Fixture()
+    results = OrderedDict()
+
+    # there is no game server to send IPC messages to
+    with lib.held_messages() as sent:
+        for name in names or BENCHMARKS:
+            prepare = BENCHMARKS[name]
+            prepare(fixture)()
+            times = []
+            queries = []
+            for i in range(repeat):
+                func = prepare(fixture)
+                reset_queries()
+                with CaptureQueriesContext(connection) as context:
+                    start = time.perf_counter()
+                    func()
+                    times.append(time.perf_counter() - start)
+                queries.append(len(context))
+            results[name] = {'seconds': min(times), 'queries': max(queries)}
+            del sent[:]
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Return a list of (name, measure, baseline value, value) for the
+    *results* that are more than *threshold* (a fraction) worse than the
+    *baseline*.  Benchmarks that aren't in the baseline are skipped."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for measure, slack in (('seconds', SECONDS_SLACK), ('queries', 0)):
+            before = baseline[name][measure]
+            limit = max(before * (1 + threshold), before + slack)
+            if result[measure] > limit:
+                regressions.append((name, measure, before, result[measure]))
+    return regressions
+
+
+def load(filename):
+    """Return the baseline saved in *filename*"""
+    with open(filename) as fp:
+        return json.load(fp)
+
+
+def save(results, filename):
+    """Save *results* as the baseline in *filename*"""
+    with open(filename, 'w') as fp:
+        json.dump(results, fp, indent=2)
+        fp.write('\n')
@@ -0,0 +1,174 @@
+"""
+Query budgets.
+
+A query budget declares the most database queries a block of code (a view,
+a phase of the game loop) should make.  query_budget() is a context manager
+and a decorator:
+
+    @query_budget('take_turn', per_game(15, airports=10, players=16))
+    def take_turn(game, ...):
+        ...
+
+    with query_budget('games_info', 10):
+        ...
+
+When used as a decorator the limit can be a function of the decorated
+function's arguments, so that budgets can grow with the size of the game.
+It is only called once the block has run and its queries are not counted,
+not even by an enclosing budget.
+
+Budgets should sit just above what the block really makes (say 10-20%
+more) so that an N+1 query creeping back in goes over.
+
+Budgets are checked according to the QUERY_BUDGETS setting: None (the
+default) doesn't count queries at all, "log" logs the blocks that go over
+budget along with their SQL and "enforce" also raises QueryBudgetExceeded.
+"""
+import functools
+import re
+from collections import Counter
+
+from django.db import connection
+
+from . import logger, metrics
+from .conf import settings
+
+LOG = 'log'
+ENFORCE = 'enforce'
+
+# number of distinct statements to include in the report
+REPORT_STATEMENTS = 10
+
+
+class QueryBudgetExceeded(Exception):
+    """A block made more queries than its budget"""
+
+    def __init__(self, name, limit, queries):
+        self.name = name
+        self.limit = limit
+        self.queries = queries
+        super(QueryBudgetExceeded, self).__init__(report(name, limit, queries))
+
+
+class query_budget(object):
+    """Context manager/decorator declaring that the block *name* makes at most
+    *limit* queries.
+
+    *limit* is a number or, for decorators, a function taking the decorated
+    function's arguments and returning one.
+    """
+
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = limit
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            limit = self.limit
+            if callable(limit):
+                limit = functools.partial(limit, *args, **kwargs)
+            with query_budget(self.name, limit):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    def __enter__(self):
+        self.mode = settings.QUERY_BUDGETS
+        if not self.mode:
+            return self
+
+        self.force_debug_cursor = connection.force_debug_cursor
+        connection.force_debug_cursor = True
+        log = connection.queries_log
+        self.marker = log[-1] if log else None
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self.mode:
+            return
+        connection.force_debug_cursor = self.force_debug_cursor
+        if exc_type is not None:
+            return
+
+        queries = self.queries()
+        limit = self.get_limit()
+        if len(queries) <= limit:
+            return
+
+        metrics.incr('query_budget.exceeded')
+        if self.mode == ENFORCE:
+            raise QueryBudgetExceeded(self.name, limit, queries)
+        logger.warning(report(self.name, limit, queries))
+
+    def get_limit(self):
+        """Return the limit.
+
+        The queries made to work it out are taken back out of the log so that
+        they don't count against an enclosing budget either.
+        """
+        if not callable(self.limit):
+            return self.limit
+
+        log = connection.queries_log
+        last = log[-1] if log else None
+        limit = self.limit()
+        while log and log[-1] is not last:
+            log.pop()
+        return limit
+
+    def queries(self):
+        """Return the queries (dicts of sql and time) made in the block"""
+        queries = []
+        # the log is a bounded deque so we walk back to where we started
+        for query in reversed(connection.queries_log):
+            if query is self.marker:
+                break
+            queries.append(query)
+        queries.reverse()
+        return queries
+
+
+def per_game(base, airports=0, players=0, flights=0, game=None):
+    """Return a limit of *base* queries plus so many per airport, per player
+    and per flight (that hasn't arrived yet) in a game.
+
+    The game is the first argument of the decorated function, or what the
+    function *game* returns when called with its arguments (see
+    request_game()).  With no game the limit is *base*.
+    """
+
+    def limit(*args, **kwargs):
+        current = game(*args, **kwargs) if game else args[0]
+        total = base
+        if current is None:
+            return total
+        if airports:
+            total = total + airports * current.airports.count()
+        if players:
+            total = total + players * current.players.distinct().count()
+        if flights:
+            count = current.flights.exclude(state='Arrived').count()
+            total = total + flights * count
+        return int(total)
+
+    return limit
+
+
+def request_game(request, *args, **kwargs):
+    """Return the current game of the player making *request*, for per_game()
+    budgets of views"""
+    return request.user.player.current_game
+
+
+def report(name, limit, queries):
+    """Return text reporting the *queries* of *name* that went over *limit*.
+
+    The statements are grouped by their shape (numbers taken out) so that N+1
+    patterns stand out.
+    """
+    shapes = Counter(re.sub(r'\b\d+\b', 'N', i['sql']) for i in queries)
+    lines = ['Query budget of {0} exceeded: {1} > {2}'.format(name, len(queries), limit)]
+    for sql, count in shapes.most_common(REPORT_STATEMENTS):
+        lines.append('{0:5d} x {1}'.format(count, sql))
+    return '\n'.join(lines)
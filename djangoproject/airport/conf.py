@@ -15,6 +15,18 @@ DEFAULTS = {
     'AI_USERNAMES': 'Guy Miles',
     'GAME_HISTORY_COUNT': 15,
     'MAX_TIME_BETWEEN_WRENCHES': 45,  # seconds
+    # games with more (fewer) airports than this get wrenches more (less)
+    # often.  None to not scale by game size.
+    'WRENCH_SCALE_AIRPORTS': 15,
+    # seed the wrench schedule for reproducible runs
+    'WRENCH_SEED': None,
+    # a game gets at most one wrench in this many seconds, however many
+    # are requested
+    'WRENCH_COALESCE_WINDOW': 10,
+    # Names of the monkey wrenches to throw (None for all) and their relative
+    # weights (default 1, 0 disables)
+    'MONKEYWRENCH_ENABLED': None,
+    'MONKEYWRENCH_WEIGHTS': {},
     'AIRPORT_REPO_URL': 'https://bitbucket.org/marduk/airport',
     'MAP_INITIAL_LATITUDE': 39.83,
     'MAP_INITIAL_LONGITUDE': -98.58,
@@ -23,6 +35,53 @@ DEFAULTS = {
     'GAMESERVER_LOOP_DELAY': 4,
     'GAMESERVER_MULTIPROCESSING': False,
     'GAMESERVER_HOST': 'localhost',
+    'GAMESERVER_WORKERS': 2,
+    # times to retry a game's turn when the database is locked
+    'TURN_RETRIES': 3,
+    'TURN_RETRY_DELAY': 0.2,  # seconds, times the attempt number
+    # Apply airport.sqlite.PRODUCTION_PRAGMAS to SQLite connections.
+    # SQLITE_PRAGMAS overrides/adds to them.
+    'SQLITE_PROFILE': False,
+    'SQLITE_PRAGMAS': {},
+    # Check the query budgets of views and game loop phases (see
+    # airport.budget): None, "log" or "enforce"
+    'QUERY_BUDGETS': None,
+    # (airports, goals) presets to keep pre-built worlds for.  Goals are
+    # assigned when a world is claimed so only the airports are pooled.
+    'GAME_POOL_PRESETS': ((15, 3),),
+    'GAME_POOL_SIZE': 2,  # per preset
+    'LEADERBOARD_SIZE': 10,
+    # Seconds the websocket server caches a session's user id in Django's
+    # cache (0 disables).  Use a shared cache backend to share it with the
+    # web tier.
+    'SESSION_USER_CACHE_TTL': 60,
+    # Keep the lobby snapshot in Django's cache instead of per process
+    'LOBBY_SHARED_CACHE': False,
+    'LOBBY_SNAPSHOT_TTL': 5,  # seconds
+    # Seconds the rendered summary page of a finished game is cached
+    'GAME_SUMMARY_CACHE_TTL': 24 * 60 * 60,
+    # Abandoned games are ended by the game server.  Thresholds are in
+    # minutes, None disables the check.
+    'REAPER_INTERVAL': 60,  # seconds
+    'REAP_CREATING_AFTER': 30,
+    'REAP_NOT_STARTED_AFTER': 6 * 60,
+    'REAP_PAUSED_AFTER': 12 * 60,
+    # Games with no human players (like AI-only soak games) and games in
+    # progress are reaped this long after a human last started them or
+    # bought a ticket in them
+    'REAP_NO_HUMANS_AFTER': 60,
+    'REAP_IDLE_AFTER': 3 * 60,
+    # minutes after a game ends to move its flights, purchases and messages
+    # to the archive tables.  None disables archiving.
+    'ARCHIVE_AFTER': 60,
+    # Flights that landed this many game minutes ago are pruned every
+    # FLIGHT_PRUNE_INTERVAL turns, unless someone bought a ticket for them
+    'FLIGHT_PRUNE_HORIZON': 6 * 60,
+    'FLIGHT_PRUNE_INTERVAL': 15,
+    # Read messages kept per player and minutes to keep the messages of
+    # ended games.  None keeps everything.
+    'MESSAGE_RETENTION_COUNT': 200,
+    'MESSAGE_GAME_TTL': 7 * 24 * 60,
     'TIMEFACTOR': 60,
     'EXTERNALS': {
         'jquery': 'https://ajax.googleapis.com/ajax/libs/jquery/1.7.2/jquery.min.js',
@@ -1,4 +1,7 @@
+import datetime
 import functools
+import heapq
+import itertools
 import json
 import multiprocessing
 import os
@@ -6,23 +9,33 @@ import random
 import signal
 import sys
 import threading
+import time
+from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from importlib import import_module
 
 import tornado
 from django.conf import settings as django_settings
 from django.contrib.auth.models import User
-from django.contrib.sessions.models import Session
+from django.contrib.auth import SESSION_KEY
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
-from django.db import connection
-from tornado import websocket
+from django.db import OperationalError, connection, transaction
+from tornado import gen, websocket
+from tornado.concurrent import is_future
 from tornado.ioloop import IOLoop
 from tornado.web import Application
 
-from . import logger, models
+from . import logger, metrics, models, routing
+from .budget import per_game, query_budget
+from .monkeywrench import MonkeyWrenchFactory
 from .conf import settings
 
 LOOP_DELAY = settings.GAMESERVER_LOOP_DELAY
 
+_outbox = threading.local()
+
 if settings.GAMESERVER_MULTIPROCESSING:
     GameThreadClass = multiprocessing.Process
 else:
@@ -35,7 +48,75 @@ def start_game(game):
     send_message('start_game', game.pk)
 
 
-def take_turn(game, now=None, throw_wrench=True):
+def build_game(data):
+    """Build the world for a pending game.
+
+    This is run by the game server (off of the IOLoop) in response to a
+    "create_game" IPC message.  *data* is the message's payload.  Progress is
+    sent to the host's websocket connections and when the game is ready the
+    lobby is sent a "game_created" message.  If it can't be built the host is
+    sent a "game_failed" message instead.
+    """
+    ioloop = IOLoop.instance()
+    game = None
+    host_id = data.get('host')
+    host_user = None
+
+    def progress(stage, percent):
+        info = {'game': game.pk, 'stage': stage, 'percent': percent}
+        ioloop.add_callback(SocketHandler.message, host_user, 'game_progress', info)
+
+    try:
+        # the pending game may have been reaped (or deleted) in the meantime
+        game = models.Game.objects.get(pk=data['game'])
+        host_id = game.host_id
+        host_user = game.host.user
+        start = data.get('start')
+        if start is not None:
+            start = models.AirportMaster.objects.get(pk=start)
+        game = models.Game.objects.build_game(
+            game,
+            goals=data['goals'],
+            airports=data['airports'],
+            ai_player=data['ai_player'],
+            start=start,
+            progress=progress,
+        )
+    except Exception:
+        logger.exception('Game {0}: could not be created'.format(data['game']))
+        if game is not None and game.pk is not None:
+            game.delete()
+        host = models.Player.objects.select_related('user')
+        host = host.filter(pk=host_id).first() if host_id else None
+        if host is not None:
+            msg = 'Error creating game.'
+            models.Message.objects.send(host, msg, message_type='ERROR')
+            info = {'game': data['game']}
+            ioloop.add_callback(SocketHandler.message, host.user, 'game_failed', info)
+        ioloop.add_callback(SocketHandler.games_info)
+        return None
+
+    ioloop.add_callback(SocketHandler.broadcast, 'game_created', game.info())
+    ioloop.add_callback(SocketHandler.games_info)
+    return game
+
+
+def throw_monkey_wrench(game_id, rng=None):
+    """Create and throw a monkey wrench in the game with *game_id*.
+
+    This is run by the game loop for the games whose wrench requests have
+    come due (see WrenchRequests).  The wrench, and what it hits, are picked
+    with the random.Random *rng* (the random module's by default).
+    """
+    game = models.Game.objects.get(pk=game_id)
+    monkey_wrench = MonkeyWrenchFactory(rng).create(game)
+    logger.info('Game {0}: throwing {1}.'.format(game, monkey_wrench))
+    monkey_wrench.throw()
+    return monkey_wrench
+
+
+@query_budget('take_turn', per_game(15, airports=10, players=16))
+def take_turn(game, now=None, throw_wrench=False, rng=None):
     now = now or game.time
     if game.state in (game.GAME_OVER, game.NOT_STARTED, game.PAUSED):
         return now
@@ -43,11 +124,12 @@ def take_turn(game, now=None, throw_wrench=True):
     winners_before = models.Player.objects.winners(game).exists()
     arrivals = {}
 
-    game_airports = list(game.airports.distinct())
+    game_airports = list(game.airports.distinct().select_related('master__city'))
+    game.share(*game_airports)
     random.shuffle(game_airports)
 
     if throw_wrench:
-        send_message('throw_wrench', game.pk)
+        throw_monkey_wrench(game.pk, rng)
 
     for airport in game_airports:
         players_arrived = handle_flights(game, airport, now)
@@ -67,55 +149,79 @@ def handle_flights(game, airport, now=None):
     flights = list(airport.next_flights(now, auto_create=False))
     random.shuffle(flights)
 
+    flights = [flight for flight in flights if flight.in_flight(now)]
+    passengers = get_passengers(flights, airport__isnull=False)
+
     for flight in flights:
-        if not flight.in_flight(now):
+        ticket_holders = passengers[flight.pk]
+        if not ticket_holders:
             continue
 
-        ticket_holders = flight.passengers.filter(airport__isnull=False)
         game.record_ticket_purchase(ticket_holders, flight)
         for player in ticket_holders:
             # player has taken off
             msg = '{0} has departed {1}.'
             msg = msg.format(player.user.username, airport)
             announce(player, msg, game, message_type='PLAYERACTION')
-        ticket_holders.update(airport=None)
+    models.Player.objects.filter(ticket__in=flights, airport__isnull=False).update(
+        airport=None
+    )
 
     # Arriving flights
     flights = models.Flight.objects.arrived_but_not_flagged(game, now)
-    flights = flights.filter(destination=airport)  # for this airport
+    flights = list(flights.filter(destination=airport))  # for this airport
+    passengers = get_passengers(flights)
 
     for flight in flights:
-        ticket_holders = flight.passengers.distinct()
-        destination = flight.destination
-
-        for player in ticket_holders:
+        for player in passengers[flight.pk]:
             # player has landed
             msg = '{0} has arrived at {1}.'
-            msg = msg.format(player.user.username, destination)
+            msg = msg.format(player.user.username, airport)
             announce(player, msg, game, message_type='PLAYERACTION')
             players_arrived.append(player)
 
             ach = player.next_goal(game)
-            if ach and ach.goal.city == player.ticket.destination.city:
-                ach.fulfill(player.ticket.arrival_time)
+            if ach and ach.goal.city == airport.city:
+                ach.fulfill(flight.arrival_time)
 
-            player.airport = destination
+            player.airport = airport
             player.ticket = None
-            player.save()
 
-        flight.state = 'Arrived'
-        flight.save()
+    models.Player.objects.filter(ticket__in=flights).update(
+        airport=airport, ticket=None
+    )
+
+    models.Flight.objects.filter(pk__in=[i.pk for i in flights]).update(
+        state='Arrived'
+    )
 
     airport.next_flights(now, auto_create=True)
     return players_arrived
 
 
+def get_passengers(flights, **filters):
+    """Return a dict of flight id -> list of the Players holding tickets for
+    the *flights*, looked up in one query"""
+    passengers = defaultdict(list)
+    players = models.Player.objects.filter(ticket__in=flights, **filters)
+    for player in players.select_related('user'):
+        passengers[player.ticket_id].append(player)
+    return passengers
+
+
+@query_budget('handle_players', per_game(20, players=6))
 def handle_players(game, now, winners_before, arrivals):
     """Update each player in game."""
     # re-fetch the game in case it's paused
     game = models.Game.objects.get(pk=game.pk)
     broadcast = models.Message.objects.broadcast
-    players = game.players.distinct()
+    players = game.players.distinct().select_related(
+        'user',
+        'airport__master__city',
+        'ticket__origin__master__city',
+        'ticket__destination__master__city',
+    )
+    counts = game.achievement_counts()
 
     # FIXME: If the data previously sent hasn't changed, we shouldn't
     # re-send the data.  Actually, the data will almost always be the same
@@ -126,10 +232,10 @@ def handle_players(game, now, winners_before, arrivals):
     for player in players:
         # if player is in another game, don't send any info. Doing so confuses
         # the client.
-        current_game = player.current_game
-        if current_game and current_game != game:
+        last_game = player.games.order_by('-id').first()
+        if last_game != game and not player.finished(last_game):
             continue
-        player_info = player.info(game, now)
+        player_info = player.info(game, now, counts=counts)
         if player.pk in arrivals:
             notify = 'You have arrived at {0}.'.format(arrivals[player.pk])
             player_info['notify'] = notify
@@ -157,11 +263,55 @@ def handle_players(game, now, winners_before, arrivals):
                 broadcast(msg, game, message_type='WINNER', finishers=True)
 
     # if all players have achieved all goals, end the game
-    if game.is_over():
+    if game.is_over(counts):
         game.end()
+        routing.forget(game)
         send_message('game_ended', game.pk)
 
 
+def reap_games(now=None):
+    """End (or delete) games that have been abandoned.
+
+    See GameManager.stale_games().  Return the list of games reaped.
+    """
+    reaped = []
+    for game, reason in models.Game.objects.stale_games(now):
+        logger.info('{0}: reaping ({1}).'.format(game, reason))
+        if game.state == game.CREATING:
+            game.delete()
+        else:
+            msg = '{0} has been closed ({1}).'.format(game, reason)
+            models.Message.objects.broadcast(
+                msg, game=game, finishers=True, message_type='ERROR'
+            )
+            game.end()
+            routing.forget(game)
+            send_message('game_ended', game.pk)
+        reaped.append(game)
+
+    metrics.incr('games.reaped', len(reaped))
+    metrics.gauge('games.open', models.Game.open_games().count())
+    return reaped
+
+
+def archive_games(now=None):
+    """Archive games that ended more than ARCHIVE_AFTER minutes ago.
+
+    Return the list of games archived.
+    """
+    if settings.ARCHIVE_AFTER is None:
+        return []
+
+    now = now or datetime.datetime.now()
+    ended_before = now - datetime.timedelta(minutes=settings.ARCHIVE_AFTER)
+    games = models.Game.objects.filter(
+        state=models.Game.GAME_OVER, archived=False, timestamp__lt=ended_before
+    )
+    archived = [models.Game.objects.archive(i) for i in games]
+    metrics.incr('games.archived', len(archived))
+    return archived
+
+
 def game_pause(game):
     if game.state == game.PAUSED:
         return game.host.info(game)
@@ -193,47 +343,149 @@ def game_resume(game):
 
 
 def send_message(message_type, data):
+    held = getattr(_outbox, 'messages', None)
+    if held is not None:
+        held.append((message_type, data))
+        return None
     return IPCHandler.send_message(message_type, data)
 
 
+@contextmanager
+def held_messages():
+    """Hold the messages sent by send_message() in this thread until the
+    block exits.  If the block raises they are dropped.
+
+    Blocks can be nested, in which case the inner block's messages are
+    passed on to the outer one.
+    """
+    outer = getattr(_outbox, 'messages', None)
+    _outbox.messages = held = []
+    try:
+        yield held
+    finally:
+        _outbox.messages = outer
+
+    for message_type, data in held:
+        send_message(message_type, data)
+
+
+def play_turn(game_id, throw_wrench=False, rng=None):
+    """Make the AI players' moves and take a turn for the game.
+
+    The turn is done in one transaction and the IPC messages it sends are
+    held until it commits.  If the database is locked, the turn is retried
+    up to TURN_RETRIES times.  Return (game, now).
+    """
+    for attempt in itertools.count():
+        game = models.Game.objects.get(pk=game_id)
+        try:
+            with held_messages(), transaction.atomic():
+                models.Player.objects.make_moves(game, None)
+                now = take_turn(game, throw_wrench=throw_wrench, rng=rng)
+            return game, now
+        except OperationalError as error:
+            if 'locked' not in str(error) or attempt >= settings.TURN_RETRIES:
+                raise
+            logger.warning('{0}: database locked, retrying turn.'.format(game))
+            metrics.incr('turns.retried')
+            time.sleep(settings.TURN_RETRY_DELAY * (attempt + 1))
+
+
 def get_user_from_session_id(session_id):
     """Given the session_id, return the user associated with it.
 
     Raise User.DoesNotExist if session_id does not associate with a user.
+
+    The session is read through Django's SESSION_ENGINE (so cache and
+    cached_db sessions stay out of the database) and the user id it resolves
+    to is kept in Django's cache for SESSION_USER_CACHE_TTL seconds.
     """
-    try:
-        session = Session.objects.get(session_key=session_id)
-    except Session.DoesNotExist:
-        raise User.DoesNotExist
+    key = session_cache_key(session_id)
+    ttl = settings.SESSION_USER_CACHE_TTL
+    user_id = cache.get(key) if ttl else None
+
+    if user_id is None:
+        engine = import_module(django_settings.SESSION_ENGINE)
+        session = engine.SessionStore(session_id)
+        user_id = session.get(SESSION_KEY)
+        if user_id is None:
+            raise User.DoesNotExist
+        if ttl:
+            cache.set(key, user_id, ttl)
+
+    return User.objects.get(pk=user_id)
+
 
+def session_cache_key(session_id):
+    return 'airport.session_user.{0}'.format(session_id)
+
+
+def forget_session(sender, request, **kwargs):
+    """user_logged_out receiver to drop the session's cached user"""
+    session_id = request.session.session_key
+    if session_id:
+        cache.delete(session_cache_key(session_id))
+
+
+@contextmanager
+def ioloop_blocked():
+    """Record the time the block holds up the IOLoop in the "ioloop.blocked"
+    metrics"""
+    start = time.time()
     try:
-        user_id = session.get_decoded().get('_auth_user_id')
-        user = User.objects.get(pk=user_id)
-    except User.DoesNotExist:
-        raise
-    return user
+        yield
+    finally:
+        metrics.timing('ioloop.blocked', time.time() - start)
 
 
 class WebSocketConnection(websocket.WebSocketHandler):
+    # Database work of the handlers is done here, one job at a time so that
+    # messages are handled in the order they came in.
+    executor = ThreadPoolExecutor(max_workers=1)
+
     def on_message(self, message):
         """Handle message"""
         message = json.loads(message)
-        message_type = message['type']
-        data = message['data']
+        self.dispatch(message['type'], message['data'])
+
+    def dispatch(self, message_type, data):
+        """Call the handler for *message_type*, if any.
+
+        The time the handler holds up the IOLoop is recorded in the
+        "ioloop.blocked" metrics.  Handlers that hit the database should do
+        so in the executor and time what they do after it (with
+        ioloop_blocked()) so that it is only the socket writes that count.
+        """
         handler_name = 'handle_%s' % message_type
         logger.debug('Message received: %s' % message_type)
 
         if hasattr(self, handler_name):
             handler = getattr(self, handler_name)
-            handler(data)
+            with ioloop_blocked():
+                result = handler(data)
+            if is_future(result):
+                # make sure errors of coroutines get logged
+                IOLoop.current().add_future(result, lambda f: f.result())
 
 
 class SocketHandler(WebSocketConnection):
     clients = []
     lock = threading.Lock()
+    user_id = None
+    username = None
+    player_id = None
 
     def open(self):
         logger.debug('WebSocket connection opened')
+        user = self.user
+        if user is not None:
+            self.user_id = user.pk
+            self.username = user.username
+            self.player_id = (
+                models.Player.objects.filter(user_id=user.pk)
+                .values_list('id', flat=True)
+                .first()
+            )
         with self.lock:
             self.clients.append(self)
         self.broadcast('new_connection', self.user.username, exclude=[self])
@@ -265,8 +517,12 @@ class SocketHandler(WebSocketConnection):
 
     @classmethod
     def message(cls, user, message_type, data):
-        """Send a message to all connections associated with user"""
-        clients = [i for i in cls.clients if i.user == user]
+        """Send a message to all connections associated with user (a User or
+        a username)"""
+        if isinstance(user, str):
+            clients = [i for i in cls.clients if i.username == user]
+        else:
+            clients = [i for i in cls.clients if i.user_id == user.pk]
         for client in clients:
             if message_type == 'info' and client.page != 'home':
                 continue
@@ -283,15 +539,37 @@ class SocketHandler(WebSocketConnection):
 
     @classmethod
     def games_info(cls):
-        games = models.Game.games_info()
-        for client in cls.clients:
-            data = {}
-            data['games'] = games
+        """Send the lobby to all connections.
 
-            if client.user and client.user.player.current_game:
-                data.update(client.user.player.game_info())
+        The lobby is put together in the executor and sent once it's ready.
+        """
+        player_ids = [i.player_id for i in cls.clients if i.player_id]
+        future = cls.executor.submit(cls.get_games_info, player_ids)
+        IOLoop.current().add_future(future, cls.send_games_info)
 
-            client.write_message(json.dumps({'type': 'games_info', 'data': data,}))
+    @classmethod
+    def send_games_info(cls, future):
+        games, game_infos = future.result()
+        with ioloop_blocked():
+            for client in cls.clients:
+                data = {}
+                data['games'] = games
+                data.update(game_infos.get(client.player_id, {}))
+
+                client.write_message(
+                    json.dumps({'type': 'games_info', 'data': data,})
+                )
+
+    @staticmethod
+    def get_games_info(player_ids):
+        """Return the lobby and a dict of player id -> game_info() of the
+        players with *player_ids* that are in a game"""
+        games = models.Game.games_info()
+        game_infos = {}
+        for player in models.Player.objects.filter(pk__in=player_ids):
+            if player.current_game:
+                game_infos[player.pk] = player.game_info()
+        return games, game_infos
 
     def handle_page(self, page):
         self.page = page
@@ -303,6 +581,8 @@ class IPCHandler(WebSocketConnection):
     """
 
     conn = None
+    # worlds are built in their own pool so they don't hold up the handlers
+    builder = ThreadPoolExecutor(max_workers=settings.GAMESERVER_WORKERS)
 
     def open(self):
         logger.debug('IPC connection opened')
@@ -318,14 +598,7 @@ class IPCHandler(WebSocketConnection):
         if message.get('key') != django_settings.SECRET_KEY:
             logger.critical('Someone is trying to hack me!', extra=message)
             return
-        message_type = message['type']
-        data = message['data']
-        handler_name = 'handle_%s' % message_type
-        logger.debug('Message received: %s' % message_type)
-
-        if hasattr(self, handler_name):
-            handler = getattr(self, handler_name)
-            handler(data)
+        self.dispatch(message['type'], message['data'])
 
     @staticmethod
     def get_conn():
@@ -351,52 +624,88 @@ class IPCHandler(WebSocketConnection):
     # - Message Handlers ----------------------------------------------------------
     def handle_info(self, info):
         """Handler for "info" data"""
-        user = User.objects.get(username=info['player'])
-        SocketHandler.message(user, 'info', info)
+        SocketHandler.message(info['player'], 'info', info)
 
+    @gen.coroutine
     def handle_start_game(self, game_id):
         """Handler to start a Game."""
-        if settings.GAMESERVER_MULTIPROCESSING:
-            connection.close()
-
-        game = models.Game.objects.get(pk=game_id)
-        for player in game.players.filter(ai_player=False).distinct():
-            SocketHandler.message(player.user, 'join_game', {})
+        models.lobby.invalidate()
+
+        def get_users():
+            if settings.GAMESERVER_MULTIPROCESSING:
+                connection.close()
+            game = models.Game.objects.get(pk=game_id)
+            players = game.players.filter(ai_player=False).distinct()
+            return [i.user for i in players.select_related('user')]
+
+        users = yield self.executor.submit(get_users)
+        with ioloop_blocked():
+            for user in users:
+                SocketHandler.message(user, 'join_game', {})
         SocketHandler.games_info()
 
+    def handle_create_game(self, data):
+        """Handler to build a pending game in the background."""
+        self.builder.submit(build_game, data)
+
     def handle_game_created(self, game_id):
         """Handler to for creating a game."""
+        models.lobby.invalidate()
         SocketHandler.games_info()
 
     def handle_game_ended(self, game_id):
         """Handler to for creating a game."""
+        models.lobby.invalidate()
         SocketHandler.games_info()
 
+    @gen.coroutine
     def handle_game_paused(self, game_id):
-        game = models.Game.objects.get(pk=game_id)
-        for player in game.players.distinct():
-            SocketHandler.message(player, 'info', player.info(game))
+        models.lobby.invalidate()
+
+        def get_info():
+            game = models.Game.objects.get(pk=game_id)
+            players = game.players.distinct().select_related('user')
+            return [(i.user, i.info(game)) for i in players]
+
+        info = yield self.executor.submit(get_info)
+        with ioloop_blocked():
+            for user, data in info:
+                SocketHandler.message(user, 'info', data)
         SocketHandler.games_info()
 
+    @gen.coroutine
     def handle_throw_wrench(self, game_id):
-        game = models.Game.objects.get(pk=game_id)
-        monkey_wrench = game.mwf.create(game)
-        logger.info('Game {0}: throwing {1}.'.format(game, monkey_wrench))
-        monkey_wrench.throw()
+        """Handler for wrench requests (e.g. after a ticket purchase).
+
+        The request is left for the game loop.  When the game loop runs in
+        another process it can't see them, so due requests are thrown here.
+        """
+        wrench_requests.add(game_id)
+        if settings.GAMESERVER_MULTIPROCESSING:
+            for game_id in wrench_requests.take():
+                yield self.executor.submit(throw_monkey_wrench, game_id)
 
     def handle_player_joined_game(self, data):
+        models.lobby.invalidate()
         SocketHandler.games_info()
 
+    @gen.coroutine
     def handle_player_left_game(self, data):
+        models.lobby.invalidate()
         player_id, game_id = data
-        player = models.Player.objects.get(pk=player_id)
-        data = {
-            'games': models.Game.games_info(),
-            'current_game': None,
-            'current_state': 'open',
-        }
-
-        SocketHandler.message(player.user, 'info', data)
+
+        def get_info():
+            player = models.Player.objects.select_related('user').get(pk=player_id)
+            info = {
+                'games': models.Game.games_info(),
+                'current_game': None,
+                'current_state': 'open',
+            }
+            return player.user, info
+
+        user, info = yield self.executor.submit(get_info)
+        with ioloop_blocked():
+            SocketHandler.message(user, 'info', info)
         SocketHandler.games_info()
 
     def handle_wall(self, message):
@@ -412,10 +721,7 @@ class IPCHandler(WebSocketConnection):
         sys.exit(0)
 
     def handle_player_message(self, data):
-        username = data['player']
-        user = User.objects.get(username=username)
-        message = data['message']
-        SocketHandler.message(user, 'message', message)
+        SocketHandler.message(data['player'], 'message', data['message'])
 
 
 # -----------------------------------------------------------------------------
@@ -449,8 +755,11 @@ class GameThread(GameThreadClass):
     daemon = False
 
     def run(self):
-        self.mw_gen = MonkeyWrenchGenerator()
+        self.wrenches = WrenchScheduler()
         self.executor = ThreadPoolExecutor(max_workers=4)
+        self.pool_future = None
+        self.last_reap = 0
+        self.turns = 0
 
         for game in models.Game.open_games():
             game_id = game.pk
@@ -459,35 +768,71 @@ class GameThread(GameThreadClass):
         while True:
             timer = threading.Timer(LOOP_DELAY, lambda: None)
             timer.start()
+            self.turns = self.turns + 1
 
-            for game in models.Game.open_games():
-                self.run_game(game.pk)
+            games = list(models.Game.open_games())
+            for game_id in self.wrenches.tick(games):
+                wrench_requests.add(game_id)
+            wrenches = wrench_requests.take()
+            for game in games:
+                self.run_game(game.pk, throw_wrench=game.pk in wrenches)
 
-            timer.join()
+            if time.time() - self.last_reap >= settings.REAPER_INTERVAL:
+                self.housekeeping()
 
-    def run_game(self, game_id):
+            # if we have time left over, top off the pool of worlds
+            if timer.is_alive() and not self.filling_pool():
+                self.pool_future = self.executor.submit(self.fill_pool)
 
-        now = None
+            timer.join()
 
+    def run_game(self, game_id, throw_wrench=False):
         game = models.Game.objects.get(pk=game_id)
-        ai_player = None
 
         if game.state == game.GAME_OVER:
             logger.info('Game %s ended.', game.pk)
             return
 
-        for ai_player in game.players.distinct().filter(ai_player=True):
-            ai_player.make_move(game, now)
+        game, now = play_turn(
+            game.pk, throw_wrench=throw_wrench, rng=self.wrenches.random
+        )
 
-        now = take_turn(game, throw_wrench=next(self.mw_gen))
+        if self.turns % settings.FLIGHT_PRUNE_INTERVAL == 0:
+            pruned = models.Flight.objects.prune(game, now)
+            metrics.incr('flights.pruned', pruned)
 
         # send all messages for this cycle
         self.executor.submit(self.send_messages)
 
+    def housekeeping(self):
+        """Reap abandoned games, archive finished ones, compact messages and
+        log the metrics"""
+        self.last_reap = time.time()
+        reap_games()
+        archive_games()
+        metrics.incr('messages.compacted', models.Message.objects.compact())
+        logger.info('Metrics: {0}'.format(metrics.snapshot()))
+
+    def filling_pool(self):
+        """Return True if the pool is currently being filled"""
+        return self.pool_future is not None and not self.pool_future.done()
+
+    @staticmethod
+    def fill_pool():
+        """Build a pooled world for the first preset that is short one.
+
+        Return the pooled game or None if the pool is full.
+        """
+        for airports, goals in settings.GAME_POOL_PRESETS:
+            pooled_games = models.Game.objects.pooled_games(airports)
+            if pooled_games.count() < settings.GAME_POOL_SIZE:
+                return models.Game.objects.create_pooled_game(airports)
+        return None
+
     def send_messages(self):
         # send all player messages (via IPC)
         msgs_to_send = models.Message.objects.filter(read=False).order_by(
-            'player', 'creation_time'
+            'player', 'id'
         )
         for message in msgs_to_send:
             user = message.player.user
@@ -527,24 +872,96 @@ class GameThread(GameThreadClass):
         return fixed_players
 
 
-class MonkeyWrenchGenerator(object):
-    max_wait = settings.MAX_TIME_BETWEEN_WRENCHES
+class WrenchScheduler(object):
+    """Decide which games get a monkey wrench thrown on a tick of the game
+    loop.
 
-    def __init__(self):
-        self._set_throw()
-        self.throw_wrench = False
+    Each game has its own (random) time for the next wrench.  These are kept
+    on a heap so a tick only looks at the games that are due.  The wait
+    between wrenches is up to MAX_TIME_BETWEEN_WRENCHES seconds for a game of
+    WRENCH_SCALE_AIRPORTS airports, and shorter (or longer) for bigger (or
+    smaller) games.  Pass a *seed* (WRENCH_SEED by default) for a
+    reproducible schedule.  The game loop throws the wrenches with the
+    scheduler's random too, so the seed also picks the wrenches.
+    """
 
-    def __iter__(self):
-        return self
+    def __init__(self, seed=None, clock=time.time):
+        if seed is None:
+            seed = settings.WRENCH_SEED
+        self.random = random.Random(seed)
+        self.clock = clock
+        self.heap = []
+        self.next_throw = {}
+
+    def wait(self, game):
+        """Return the (random) number of seconds until *game*'s next wrench"""
+        max_wait = settings.MAX_TIME_BETWEEN_WRENCHES
+        if settings.WRENCH_SCALE_AIRPORTS:
+            airports = max(game.airports.count(), 1)
+            max_wait = max_wait * settings.WRENCH_SCALE_AIRPORTS / airports
+        return self.random.uniform(1, max(max_wait, 1))
+
+    def schedule(self, game, now):
+        when = now + self.wait(game)
+        self.next_throw[game.pk] = when
+        heapq.heappush(self.heap, (when, game.pk))
+
+    def tick(self, games, now=None):
+        """Return the set of ids of *games* that get a wrench this tick.
+
+        Games are scheduled the first time they are seen.  Games that are no
+        longer passed in drop off the schedule.
+        """
+        now = self.clock() if now is None else now
+        games = {i.pk: i for i in games}
+        for game_id, game in games.items():
+            if game_id not in self.next_throw:
+                self.schedule(game, now)
+
+        due = set()
+        while self.heap and self.heap[0][0] <= now:
+            when, game_id = heapq.heappop(self.heap)
+            del self.next_throw[game_id]
+            if game_id in games:
+                due.add(game_id)
+                self.schedule(games[game_id], now)
+        return due
+
+
+class WrenchRequests(object):
+    """Requests to throw a monkey wrench, coalesced per game.
+
+    Any number of requests for a game are merged until the game loop takes
+    them, and a game gets at most one wrench every WRENCH_COALESCE_WINDOW
+    seconds.  Requests inside the window wait for it to pass.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.last_throw = {}
+
+    def add(self, game_id):
+        with self.lock:
+            self.pending.add(game_id)
+
+    def take(self, now=None):
+        """Return the set of game ids whose wrench is due"""
+        now = self.clock() if now is None else now
+        window = settings.WRENCH_COALESCE_WINDOW
 
-    def __next__(self):
-        val = self.throw_wrench
-        self.throw_wrench = False
-        return val
+        with self.lock:
+            self.last_throw = {
+                i: t for i, t in self.last_throw.items() if now - t < window
+            }
+            due = self.pending.difference(self.last_throw)
+            self.pending = self.pending - due
+            for game_id in due:
+                self.last_throw[game_id] = now
+        return due
 
-    def _set_throw(self):
-        self.throw_wrench = True
-        threading.Timer(random.randint(1, self.max_wait), self._set_throw).start()
 
+wrench_requests = WrenchRequests()
 
 TEXAS_AIRPORTS = ('DFW', 'IAH', 'AUS', 'HOU', 'SAT', 'DAL', 'ELP')
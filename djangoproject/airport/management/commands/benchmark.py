@@ -0,0 +1,127 @@
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from airport import benchmark
+
+
+class Command(BaseCommand):
+
+    """Run the benchmarks and compare them to the baseline"""
+
+    help = 'Benchmark the hot paths and check for regressions'
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--baseline',
+            default='benchmarks.json',
+            help='Baseline file (default: benchmarks.json).',
+            metavar='FILE',
+        ),
+        make_option(
+            '--save',
+            action='store_true',
+            default=False,
+            help='Save the results as the new baseline.',
+        ),
+        make_option(
+            '--threshold',
+            type='float',
+            default=0.25,
+            help='Allowed regression as a fraction of the baseline (0.25).',
+        ),
+        make_option(
+            '--repeat', type='int', default=5, help='Runs of each benchmark.'
+        ),
+        make_option(
+            '--db',
+            choices=('memory', 'file'),
+            default='memory',
+            help='Run against an in-memory or a file SQLite database.',
+        ),
+        make_option(
+            '--only',
+            help='Comma-separated benchmark name prefixes to run.',
+            metavar='NAMES',
+        ),
+    )
+
+    def handle(self, *args, **options):
+        names = list(benchmark.BENCHMARKS)
+        if options['only']:
+            prefixes = tuple(options['only'].split(','))
+            names = [i for i in names if i.startswith(prefixes)]
+        if not names:
+            raise CommandError('No benchmarks match {0}'.format(options['only']))
+
+        filename = options['baseline']
+        baseline = {}
+        if not options['save']:
+            if not os.path.exists(filename):
+                raise CommandError(
+                    'No baseline in {0}. Create one with --save.'.format(filename)
+                )
+            baseline = benchmark.load(filename)
+
+        with test_database(options['db']):
+            results = benchmark.run(names, repeat=options['repeat'])
+
+        for name, result in results.items():
+            line = '{0:40} {1:10.2f} ms {2:6d} queries'.format(
+                name, result['seconds'] * 1000, result['queries']
+            )
+            if name in baseline:
+                line = line + '  (baseline {0:.2f} ms, {1} queries)'.format(
+                    baseline[name]['seconds'] * 1000, baseline[name]['queries']
+                )
+            self.stdout.write(line)
+
+        if options['save']:
+            benchmark.save(results, filename)
+            self.stdout.write('Saved the baseline to {0}.'.format(filename))
+            return
+
+        regressions = benchmark.compare(results, baseline, options['threshold'])
+        for name, measure, before, after in regressions:
+            self.stderr.write(
+                '{0}: {1} regressed from {2} to {3}'.format(
+                    name, measure, before, after
+                )
+            )
+        if regressions:
+            raise CommandError('{0} regression(s)'.format(len(regressions)))
+
+
+@contextmanager
+def test_database(kind):
+    """Run the block against a throw-away database like the test runner's.
+
+    *kind* is "memory" or "file" (SQLite only).
+    """
+    if kind == 'file' and connection.vendor != 'sqlite':
+        raise CommandError('--db=file is for SQLite databases')
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    old_test_name = test_settings.get('NAME')
+    directory = None
+    if kind == 'file':
+        directory = tempfile.mkdtemp()
+        test_settings['NAME'] = os.path.join(directory, 'benchmark.sqlite3')
+
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        test_settings['NAME'] = old_test_name
+        teardown_test_environment()
+        if directory:
+            shutil.rmtree(directory)
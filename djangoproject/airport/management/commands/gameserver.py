@@ -50,6 +50,24 @@ class Command(BaseCommand):
             help='Delete a game.  Use with caution!',
             metavar='GAMEID',
         ),
+        make_option(
+            '--reap',
+            action='store_true',
+            default=False,
+            help='End abandoned games and exit.',
+        ),
+        make_option(
+            '--archive',
+            action='store_true',
+            default=False,
+            help='Archive finished games and exit.',
+        ),
+        make_option(
+            '--compact',
+            action='store_true',
+            default=False,
+            help='Delete old messages and exit.',
+        ),
     )
 
     def handle(self, *args, **options):
@@ -82,6 +100,21 @@ class Command(BaseCommand):
             delete_game(options['deletegame'])
             return
 
+        if options['reap']:
+            for game in lib.reap_games():
+                self.stdout.write('Reaped {0}.'.format(game))
+            return
+
+        if options['archive']:
+            for game in lib.archive_games():
+                self.stdout.write('Archived {0}.'.format(game))
+            return
+
+        if options['compact']:
+            deleted = models.Message.objects.compact()
+            self.stdout.write('Deleted {0} messages.'.format(deleted))
+            return
+
         logger.info('Game Server Started')
         socket_server = start_thread(lib.SocketServer, name='Socket Server')
 
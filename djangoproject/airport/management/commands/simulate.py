@@ -0,0 +1,96 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from airport.management.commands.benchmark import test_database
+from airport.simulation import Simulation
+
+
+class Command(BaseCommand):
+
+    """Run games on a virtual clock and report how the game loop performs.
+
+    The games are played in a throw-away database so the simulated players,
+    their messages and their stats never reach the real one.
+    """
+
+    help = 'Simulate games on a virtual clock as fast as possible'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--games', type='int', default=1, help='Number of games.'),
+        make_option(
+            '--airports', type='int', default=15, help='Airports per game.'
+        ),
+        make_option('--goals', type='int', default=3, help='Goals per game.'),
+        make_option(
+            '--players', type='int', default=1, help='Players per game.'
+        ),
+        make_option(
+            '--ai',
+            action='store_true',
+            default=False,
+            help='Make the players AI players.',
+        ),
+        make_option(
+            '--hours', type='float', default=4, help='Game hours to simulate.'
+        ),
+        make_option(
+            '--step',
+            type='float',
+            help='Game minutes per tick (default: a game server tick).',
+        ),
+        make_option(
+            '--wrenches',
+            action='store_true',
+            default=False,
+            help='Throw monkey wrenches.',
+        ),
+        make_option('--seed', type='int', help='Seed the random numbers.'),
+        make_option(
+            '--db',
+            choices=('memory', 'file'),
+            default='file',
+            help='Run against an in-memory or a file SQLite database.',
+        ),
+    )
+
+    def handle(self, *args, **options):
+        simulation = Simulation(
+            games=options['games'],
+            airports=options['airports'],
+            goals=options['goals'],
+            players=options['players'],
+            ai=options['ai'],
+            step=options['step'],
+            wrenches=options['wrenches'],
+            seed=options['seed'],
+        )
+        with test_database(options['db']):
+            stats = simulation.run(options['hours'])
+
+        self.stdout.write(report(stats))
+
+
+def report(stats):
+    """Return the simulation *stats* as text"""
+    lines = [
+        'Simulated {games} game(s) for {hours} game hours: {ticks} ticks in '
+        '{seconds:.2f} seconds'.format(**stats),
+        'Ticks/second: {ticks_per_second:.2f}'.format(**stats),
+        'Queries/tick: {queries_per_tick:.1f} (max {max_queries_per_tick})'.format(
+            **stats
+        ),
+        'Games finished: {finished}'.format(**stats),
+        'IPC messages: {messages}'.format(**stats),
+        'Rows added: {0}'.format(
+            ', '.join(
+                '{0} {1}'.format(name, stats['rows'][name])
+                for name in sorted(stats['rows'])
+            )
+        ),
+    ]
+    if stats['db_size']:
+        lines.append(
+            'Database size: {db_size} bytes ({db_growth:+d})'.format(**stats)
+        )
+    return '\n'.join(lines)
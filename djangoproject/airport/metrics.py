@@ -0,0 +1,49 @@
+"""
+Simple in-process metrics for the game server.
+
+Gauges hold the last value set and counters are incremented.  Timings keep a
+count, total and maximum (in seconds).  The game server logs them
+periodically.
+"""
+import threading
+
+_lock = threading.Lock()
+_metrics = {}
+
+
+def gauge(name, value):
+    """Set the gauge *name* to *value*"""
+    with _lock:
+        _metrics[name] = value
+
+
+def incr(name, amount=1):
+    """Increment the counter *name* by *amount*"""
+    with _lock:
+        _metrics[name] = _metrics.get(name, 0) + amount
+
+
+def timing(name, seconds):
+    """Record a timing of *seconds* for *name*"""
+    with _lock:
+        _metrics[name + '.count'] = _metrics.get(name + '.count', 0) + 1
+        _metrics[name + '.total'] = _metrics.get(name + '.total', 0) + seconds
+        _metrics[name + '.max'] = max(_metrics.get(name + '.max', 0), seconds)
+
+
+def get(name, default=None):
+    """Return the current value of metric *name*"""
+    with _lock:
+        return _metrics.get(name, default)
+
+
+def snapshot():
+    """Return a dict of all the metrics"""
+    with _lock:
+        return dict(_metrics)
+
+
+def reset():
+    """Clear all the metrics"""
+    with _lock:
+        _metrics.clear()
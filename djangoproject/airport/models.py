@@ -1,10 +1,13 @@
 """Models for the airport django app"""
+import json
+from collections import Counter
 from datetime import datetime, timedelta
 from math import asin, cos, radians, sin, sqrt
-from random import randint, sample, shuffle
+from random import choice, randint, sample, shuffle
 
 from django.contrib.auth.models import User
 from django.contrib.humanize.templatetags.humanize import naturaltime
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.core.urlresolvers import reverse
 from django.db import models, transaction
@@ -14,17 +17,92 @@ from . import logger
 from .conf import settings
 
 BOARDING = timedelta(minutes=settings.MINUTES_BEFORE_BOARDING)
+DENSITY = 5  # default number of destinations per airport
 
 
 class AirportModel(models.Model):
 
-    """Base class for airport models"""
+    """Base class for airport models
+
+    Models keep track of the field values they were loaded (or last saved)
+    with.  save() on a saved model only UPDATEs the fields that have changed
+    and does nothing at all if none have.
+    """
 
     creation_time = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         abstract = True
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(AirportModel, cls).from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def loaded_value(self, attname, default=None):
+        """Return the value of *attname* when the model was loaded/saved"""
+        return getattr(self, '_loaded_values', {}).get(attname, default)
+
+    def dirty_fields(self):
+        """Return the list of (att)names of fields changed since the model
+        was loaded/saved, or None if that is not known"""
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return None
+
+        dirty = []
+        for field in self._meta.concrete_fields:
+            attname = field.attname
+            if attname in loaded:
+                if getattr(self, attname) != loaded[attname]:
+                    dirty.append(attname)
+            elif attname in self.__dict__:
+                # a deferred field that has been set
+                dirty.append(attname)
+        return dirty
+
+    def save(self, *args, **kwargs):
+        """Overridden save() that only saves changed fields"""
+        if (
+            self.pk is not None
+            and not args
+            and not kwargs.get('force_insert')
+            and kwargs.get('update_fields') is None
+        ):
+            dirty = self.dirty_fields()
+            if dirty is not None:
+                if not dirty:
+                    return
+                kwargs['update_fields'] = dirty
+
+        super(AirportModel, self).save(*args, **kwargs)
+        self.reset_loaded_values(kwargs.get('update_fields'))
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super(AirportModel, self).refresh_from_db(using, fields, **kwargs)
+        self.reset_loaded_values(fields)
+
+    def reset_loaded_values(self, fields=None):
+        """Mark the (names of) *fields* as clean, or all of them if *fields*
+        is None"""
+        concrete = self._meta.concrete_fields
+        if fields is not None:
+            fields = set(fields)
+            concrete = [
+                i for i in concrete if i.name in fields or i.attname in fields
+            ]
+            loaded = getattr(self, '_loaded_values', {})
+        else:
+            loaded = {}
+
+        loaded.update(
+            (i.attname, getattr(self, i.attname))
+            for i in concrete
+            if i.attname in self.__dict__
+        )
+        self._loaded_values = loaded
+
 
 class City(AirportModel):
 
@@ -127,13 +205,22 @@ class Airport(AirportModel):
         return self.master.name
 
     def __str__(self):
-        aiports_per_city = Airport.objects.filter(
-            game=self.game, master__city=self.city
-        ).count()
+        aiports_per_city = self.game.city_airport_counts()[self.master.city_id]
         if aiports_per_city > 1:
             return '{city} {code}'.format(city=self.city, code=self.code)
         return self.city.name
 
+    def destination_ids(self):
+        """Return the set of ids of the airports *self* has flights to.
+
+        They are only looked up once per Airport object.
+        """
+        ids = getattr(self, '_destination_ids', None)
+        if ids is None:
+            ids = set(self.destinations.values_list('id', flat=True))
+            self._destination_ids = ids
+        return ids
+
     def next_flights(self, now, future_only=False, auto_create=True):
         """Return next Flights out from *self*, creating new flights if
         necessary.  Return a list of flights ordered by destination city
@@ -155,8 +242,15 @@ class Airport(AirportModel):
         flights = game.flights.filter(origin=self)
         if future_only:
             flights = flights.filter(depart_time__gt=now)
+        flights = flights.select_related('destination__master__city')
         flights = list(flights.order_by('-depart_time')[:14])
 
+        # share our objects with the flights so the game, our destinations
+        # and our city are only looked up once
+        for flight in flights:
+            flight.origin = self
+            game.share(flight, flight.destination)
+
         flights.sort(key=lambda x: (x.destination.city.name, x.number))
         return flights
 
@@ -189,12 +283,18 @@ class Airport(AirportModel):
         next_hour = now + timedelta(seconds=3600)
         next_hour = next_hour.replace(minute=0, second=0, microsecond=0)
 
+        # the destinations that already have a flight scheduled and the last
+        # departure to each are looked up for all destinations at once
+        departures = Flight.objects.filter(game=game, origin=self)
+        scheduled = departures.filter(depart_time__gt=now)
+        scheduled = set(scheduled.values_list('destination', flat=True))
+        last_departures = departures.order_by().values_list('destination')
+        last_departures = dict(last_departures.annotate(models.Max('depart_time')))
+
         flights = []
-        for destination in self.destinations.distinct():
-            filters = dict(
-                game=game, origin=self, destination=destination, depart_time__gt=now
-            )
-            if Flight.objects.filter(**filters).exists():
+        destinations = self.destinations.distinct().select_related('master__city')
+        for destination in destinations:
+            if destination.pk in scheduled:
                 continue
 
             flight_time = City.get_flight_time(
@@ -211,13 +311,9 @@ class Airport(AirportModel):
 
             # Don't allow the next flight to go for at least 20 mins past the
             # previous
-            qs = Flight.objects.filter(game=game, origin=self, destination=destination)
-            qs = qs.order_by('-depart_time')
-
-            if qs.exists():
-                previous_flight = qs[0]
-                if next_hour - previous_flight.depart_time < cushion:
-                    next_hour = previous_flight.depart_time + cushion
+            previous = last_departures.get(destination.pk)
+            if previous is not None and next_hour - previous < cushion:
+                next_hour = previous + cushion
 
             depart_time = random_time(next_hour, 59)
             arrival_time = depart_time + timedelta(minutes=flight_time)
@@ -286,6 +382,50 @@ class FlightManager(models.Manager):
             .exclude(state='Cancelled')
         )
 
+    def prune(self, game, now=None):
+        """Delete *game*'s flights that landed (or would have) more than
+        FLIGHT_PRUNE_HORIZON game minutes before *now*.
+
+        Flights that were purchased or are a player's ticket are kept.
+        Return the number of flights deleted.
+        """
+        now = now or game.time
+        horizon = now - timedelta(minutes=settings.FLIGHT_PRUNE_HORIZON)
+
+        purchased = Purchase.objects.filter(game=game).values('flight')
+        tickets = Player.objects.filter(ticket__game=game).values('ticket')
+        flights = self.filter(game=game, arrival_time__lt=horizon)
+        flights = flights.exclude(pk__in=purchased).exclude(pk__in=tickets)
+        pruned = flights.count()
+        if pruned:
+            flights.delete()
+        return pruned
+
+    def departures(self, airport, now):
+        """Return a queryset of *airport*'s (uncancelled) flights that have
+        yet to depart"""
+        flights = self.filter(origin=airport, depart_time__gt=now)
+        return flights.exclude(state='Cancelled')
+
+    def delay_departures(self, airport, timedelta, now):
+        """Delay all of *airport*'s departures by *timedelta* with a single
+        UPDATE.  Return the number of flights delayed."""
+        return self.departures(airport, now).update(
+            depart_time=models.F('depart_time') + timedelta,
+            arrival_time=models.F('arrival_time') + timedelta,
+            state='Delayed',
+        )
+
+    def cancel_departures(self, airport, now):
+        """Cancel all of *airport*'s departures and revoke the tickets on
+        them.  Return the number of flights cancelled and tickets revoked."""
+        flights = self.departures(airport, now)
+
+        with transaction.atomic():
+            revoked = Player.objects.filter(ticket__in=flights).update(ticket=None)
+            cancelled = flights.update(state='Cancelled')
+        return cancelled, revoked
+
 
 class Flight(AirportModel):
 
@@ -338,9 +478,7 @@ class Flight(AirportModel):
 
             # if any players have tickets on this flight, they need to be
             # revoked
-            for passenger in self.passengers.all():
-                passenger.ticket = None
-                passenger.save()
+            self.passengers.update(ticket=None)
 
         else:
             raise self.AlreadyDeparted('In-progress flight cannot be cancelled')
@@ -375,7 +513,7 @@ class Flight(AirportModel):
         origin = self.origin
         destination = self.destination
 
-        if not origin.destinations.filter(id=destination.id).exists():
+        if destination.id not in origin.destination_ids():
             suffix = '*'
 
         state = self.state
@@ -573,6 +711,60 @@ class PlayerManager(models.Manager):
         finishers = [i for i in stats if stats[i] is not None]
         return self.filter(id__in=[i.id for i in finishers])
 
+    def make_moves(self, game, now=None):
+        """Make a move for every AI player in *game*.
+
+        This is the batch version of Player.make_move().  All AI players are
+        planned against one snapshot of the game's flight schedule and the
+        tickets are purchased with a single UPDATE.  Return a dict of player
+        id -> Flight purchased.
+        """
+        from airport import routing
+
+        if game.state != game.IN_PROGRESS:
+            return {}
+
+        now = now or game.time
+        ai_players = self.filter(game=game, ai_player=True).distinct()
+        ai_players = list(ai_players.filter(ticket=None, airport__isnull=False))
+        if not ai_players:
+            return {}
+
+        # the next goal of each player is its unachieved goal of lowest order
+        next_goals = {}
+        achievements = Achievement.objects.filter(
+            game=game, player__in=ai_players, timestamp=None
+        )
+        achievements = achievements.order_by('-goal__order')
+        for player_id, city_id in achievements.values_list(
+            'player_id', 'goal__city_id'
+        ):
+            next_goals[player_id] = city_id
+
+        flights = game.flights.filter(depart_time__gt=now)
+        flights = list(flights.exclude(state='Cancelled'))
+        table = routing.routing_table(game)
+
+        purchases = {}
+        for player in ai_players:
+            if player.pk not in next_goals:
+                # finished
+                continue
+            flight = routing.plan_move(
+                table, flights, player.airport_id, next_goals[player.pk], now
+            )
+            if flight is not None:
+                purchases[player.pk] = flight
+
+        if purchases:
+            tickets = [
+                models.When(pk=player_id, then=models.Value(flight.pk))
+                for player_id, flight in purchases.items()
+            ]
+            tickets = models.Case(*tickets, output_field=models.IntegerField())
+            self.filter(pk__in=purchases, ticket=None).update(ticket=tickets)
+        return purchases
+
     @transaction.atomic
     def get_or_create_ai_player(self, game):
         """Create an AI player and attach to game."""
@@ -674,7 +866,7 @@ class Player(AirportModel):
         """
         query = Achievement.objects
         achievements = query.filter(player=self, game=game, timestamp=None)
-        achievements = achievements.order_by('goal__order')
+        achievements = achievements.order_by('goal__order').select_related('goal')
         if achievements.exists():
             return achievements[0]
         return None
@@ -703,7 +895,6 @@ class Player(AirportModel):
                     self.save()
                     return (self.airport, None)
 
-        self.save()
         return (self.airport, self.ticket)
 
     def purchase_flight(self, flight, now):
@@ -764,7 +955,7 @@ class Player(AirportModel):
 
         return False
 
-    def info(self, game=None, now=None, redirect=None):
+    def info(self, game=None, now=None, redirect=None, counts=None):
         """Return a json-able dict about the current info of the player.
 
         This should be equivalent to what the views.info view used to do, but
@@ -773,12 +964,19 @@ class Player(AirportModel):
 
         "redirect", if passed, should be a URL string informing the player's
         browser to redirect to said URL.
+
+        "counts", if passed, should be the game's achievement_counts().
         """
         states = ['New', 'Finished', 'Started', 'Paused']
         game = game or self.current_game
         now = now or game.time
-        finished = self.finished(game)
-        stats = game.stats()
+        if counts is None:
+            counts = game.achievement_counts()
+        if self.pk in counts:
+            finished = counts[self.pk]['achieved'] == counts[self.pk]['goals']
+        else:
+            finished = self.finished(game)
+        stats = game.stats(counts)
         goal_list = []
         nf_list = []
         in_flight = self.ticket.in_flight(now) if self.ticket else False
@@ -793,6 +991,13 @@ class Player(AirportModel):
             )
         )
 
+        ticket = self.ticket
+        game.share(
+            self.airport,
+            ticket,
+            ticket and ticket.origin,
+            ticket and ticket.destination,
+        )
         airport = self.airport if self.airport else self.ticket.destination
         next_flights = airport.next_flights(now, auto_create=False)
 
@@ -802,11 +1007,12 @@ class Player(AirportModel):
             nf_dict['buyable'] = buyable
             nf_list.append(nf_dict)
 
-        for goal in Goal.objects.filter(game=game):
-            achieved = goal.achievers.filter(
-                id=self.id, achievement__timestamp__isnull=False
-            ).exists()
-            goal_list.append([goal.city.name, achieved])
+        achieved = Achievement.objects.filter(
+            game=game, player=self, timestamp__isnull=False
+        )
+        achieved = set(achieved.values_list('goal_id', flat=True))
+        for goal in Goal.objects.filter(game=game).select_related('city'):
+            goal_list.append([goal.city.name, goal.pk in achieved])
 
         # city name
         if self.airport:
@@ -862,68 +1068,49 @@ class Player(AirportModel):
         }
         return data
 
-    def make_move(self, game=None, now=None):
-        """AI make a move.  Assume we are in a game."""
+    def make_move(self, game=None, now=None, flights=None):
+        """AI make a move.  Assume we are in a game.
+
+        The AI buys the first flight of the earliest route to its next goal
+        given the current flight schedule, or failing that, the flight that
+        gets it closest to its goal.  *flights*, if given, is the game's
+        current flight schedule (else it is fetched).
+        """
+        from airport import routing
+
         assert self.ai_player
         game = game or self.current_game
         assert game
 
         # First, determine if we even need to/can make a move
-        # Thank goodness for short-circuiting
-        no_move = game is None
-        no_move = no_move or self.current_state != 'playing'
-        no_move = no_move or self.ticket is not None
-        no_move = no_move or game.state == game.GAME_OVER
-        no_move = no_move or self.finished(game)
-
-        if no_move:
+        if game.state != game.IN_PROGRESS or self.ticket_id is not None:
             return
 
-        now = now or game.time
-        airport = self.airport
-        assert airport
-
         ach = self.next_goal(game)
-        goal = ach.goal
-
-        # If our next goal is at this airport and the ticket is buyable, buy it
-        next_flight = airport.next_flight_to(goal.city, now)
-        if next_flight and next_flight.buyable(self, now):
-            self.purchase_flight(next_flight, now)
+        if ach is None:
+            # finished
             return
 
-        # Else figure out the next flights.
-        next_flights = airport.next_flights(now, future_only=True, auto_create=False)
-
-        # If there is only one flight. Take it
-        if len(next_flights) == 1 and next_flights[0].buyable(self, now):
-            self.purchase_flight(next_flights[0], now)
-            return
-
-        # Exclude the airport we just came from
-        last_purchases = Purchase.objects.filter(player=self, game=game)
-        try:
-            last_purchase = last_purchases.order_by('-flight__arrival_time')[0]
-        except IndexError:
-            pass
-        else:
-            origin = last_purchase.flight.origin
-            next_flights = [i for i in next_flights if i.destination != origin]
+        now = now or game.time
+        assert self.airport_id
 
-        if not next_flights:
-            return
+        if flights is None:
+            flights = game.flights.filter(depart_time__gt=now)
+            flights = flights.exclude(state='Cancelled')
 
-        next_flights.sort(key=lambda x: x.arrival_time)
-        for next_flight in next_flights:
-            if next_flight.buyable(self, now):
-                self.purchase_flight(next_flight, now)
-                return
+        table = routing.routing_table(game)
+        flight = routing.plan_move(
+            table, flights, self.airport_id, ach.goal.city_id, now
+        )
+        if flight is not None:
+            self.purchase_flight(flight, now)
 
     def save(self, *args, **kwargs):
         new_player = not self.id
 
         super(Player, self).save(*args, **kwargs)
         if new_player:
+            PlayerStats.objects.create(player=self)
             msg = 'Welcome to {}!'.format(settings.GAME_NAME)
             Message.objects.send(self, msg)
 
@@ -953,7 +1140,7 @@ class MessageManager(models.Manager):
 
         for player in players:
             messages.append(
-                Message(player=player, text=text, message_type=message_type)
+                Message(player=player, text=text, message_type=message_type, game=game)
             )
 
         return self.bulk_create(messages)
@@ -982,7 +1169,7 @@ class MessageManager(models.Manager):
 
         for player in players.exclude(id=announcer.id).distinct():
             messages.append(
-                Message(player=player, text=text, message_type=message_type)
+                Message(player=player, text=text, message_type=message_type, game=game)
             )
 
         return self.bulk_create(messages)
@@ -1040,7 +1227,43 @@ class MessageManager(models.Manager):
 
         return message
 
-    pass
+    def compact(self, now=None):
+        """Delete old (read) messages.
+
+        Messages of games that ended more than MESSAGE_GAME_TTL minutes ago
+        are deleted (from the archive as well) and only the last
+        MESSAGE_RETENTION_COUNT messages are kept for each player.  Either
+        can be None to keep everything.  Return the number of messages
+        deleted.
+        """
+        now = now or datetime.now()
+        deleted = 0
+
+        if settings.MESSAGE_GAME_TTL is not None:
+            ended = now - timedelta(minutes=settings.MESSAGE_GAME_TTL)
+            ended = Game.objects.filter(state=Game.GAME_OVER, timestamp__lt=ended)
+            for model in (Message, ArchivedMessage):
+                messages = model.objects.filter(game__in=ended, read=True)
+                deleted = deleted + messages.count()
+                messages.delete()
+
+        keep = settings.MESSAGE_RETENTION_COUNT
+        if keep == 0:
+            messages = self.filter(read=True)
+            deleted = deleted + messages.count()
+            messages.delete()
+        elif keep is not None:
+            counts = self.values('player').annotate(count=models.Count('id'))
+            for row in counts.filter(count__gt=keep):
+                messages = self.filter(player=row['player']).order_by('-id')
+                oldest_kept = messages.values_list('id', flat=True)[keep - 1]
+                messages = self.filter(
+                    player=row['player'], id__lt=oldest_kept, read=True
+                )
+                deleted = deleted + messages.count()
+                messages.delete()
+
+        return deleted
 
 
 class Message(AirportModel):
@@ -1051,8 +1274,12 @@ class Message(AirportModel):
     player = models.ForeignKey(Player, related_name='messages', db_index=True)
     read = models.BooleanField(default=False, db_index=True)
     message_type = models.CharField(max_length=32, default='DEFAULT')
+    game = models.ForeignKey('Game', null=True, blank=True, related_name='+')
     objects = MessageManager()
 
+    class Meta:
+        index_together = [['player', 'read', 'id']]
+
     def __str__(self):
         return self.text
 
@@ -1079,38 +1306,97 @@ class GameManager(models.Manager):
 
     """We manage Games"""
 
-    def create_game(self, host, goals, airports, density=5, ai_player=True, start=None):
+    def create_game(
+        self, host, goals, airports, density=DENSITY, ai_player=True, start=None
+    ):
         """Create a new *Game*"""
-        master_airports = list(AirportMaster.objects.distinct())
-        shuffle(master_airports)
+        game = self.create_pending_game(host)
+        return self.build_game(
+            game, goals, airports, density=density, ai_player=ai_player, start=start
+        )
 
-        game = Game()
+    def create_pending_game(self, host):
+        """Create and return a placeholder *Game* for *host*.
 
+        The game is in the CREATING state and has no world yet.  Call
+        build_game() (normally done by the game server) to finish it.
+        """
         if isinstance(host, User):
             host = host.player
-        game.host = host
-        game.state = Game.NOT_STARTED
+
+        game = Game(host=host, state=Game.CREATING)
         game.save()
+        return game
 
-        # start airport
-        if start is None:
-            master = master_airports.pop(0)
-        else:
-            master = start
-        start_airport = Airport.objects.create(game=game, master=master)
-        start_airport.game = game
-        start_airport.save()
+    def create_pooled_game(self, airports, density=DENSITY):
+        """Create and return a hostless *Game* with a pre-built world.
 
-        game.start_airport = start_airport
+        Pooled games are claimed by build_game() so that creating a game
+        doesn't have to wait for the world to be built.
+        """
+        # the world is built while the game is CREATING so that it can't be
+        # claimed half built
+        game = Game(state=Game.CREATING)
         game.save()
+        self.build_world(game, airports, density)
+        self.filter(pk=game.pk).update(state=Game.POOLED)
+        game.state = Game.POOLED
+        logger.info('{0}: added to the pool'.format(game))
+        return game
+
+    def pooled_games(self, airports):
+        """Return qs of pooled games having *airports* airports"""
+        games = self.filter(state=Game.POOLED)
+        games = games.annotate(num_airports=models.Count('airports'))
+        return games.filter(num_airports=airports)
 
-        # add other airports
+    def claim_pooled_world(self, game, airports, start=None):
+        """Move the world of a pooled game with *airports* airports into
+        *game*.
+
+        If *start* (an AirportMaster) is given, the pooled world must contain
+        it.  Return True if a world was claimed, else False.
+        """
+        pooled_games = self.pooled_games(airports)
+        if start is not None:
+            pooled_games = pooled_games.filter(airports__master=start)
+
+        for pooled in pooled_games.order_by('pk'):
+            with transaction.atomic():
+                # whoever changes the state first owns it
+                claimed = self.filter(pk=pooled.pk, state=Game.POOLED)
+                if not claimed.update(state=Game.CREATING):
+                    continue
+                Airport.objects.filter(game=pooled).update(game=game)
+                game.min_distance = pooled.min_distance
+                game.max_distance = pooled.max_distance
+                game.save()
+                pooled.delete()
+            logger.info('{0}: claimed world of {1}'.format(game, pooled))
+            return True
+        return False
+
+    def build_world(self, game, airports, density=DENSITY, start=None, progress=None):
+        """Create the airports of *game* and populate their destinations.
+
+        If *start* (an AirportMaster) is given, it will be one of the
+        airports.
+        """
+        progress = progress or (lambda stage, percent: None)
+        master_airports = list(AirportMaster.objects.distinct())
+        shuffle(master_airports)
+        if start is not None:
+            master_airports = [i for i in master_airports if i != start]
+            master_airports.insert(0, start)
+
+        progress('airports', 0)
         airport_lst = []
-        for master in master_airports[: airports - 1]:
+        for master in master_airports[:airports]:
             airport_lst.append(Airport(game=game, master=master))
         Airport.objects.bulk_create(airport_lst)
 
         # populate the airports with destinations
+        progress('destinations', 20)
         for airport in game.airports.distinct():
             new_destinations = airport.get_destinations(density)
             for destination in new_destinations:
@@ -1122,7 +1408,39 @@ class GameManager(models.Manager):
         game.min_distance, game.max_distance = game.get_extremes()
         game.save()
 
+    def build_game(
+        self,
+        game,
+        goals,
+        airports,
+        density=DENSITY,
+        ai_player=True,
+        start=None,
+        progress=None,
+    ):
+        """Build the world (airports, destinations and goals) for *game*.
+
+        *game* should be a game created by create_pending_game().  The world
+        is taken from the pool if one is available.  If *progress* is given,
+        it is called as progress(stage, percent) as the world is being built.
+        When finished the game is put in the NOT_STARTED state and returned.
+        """
+        progress = progress or (lambda stage, percent: None)
+        host = game.host
+
+        if density != DENSITY or not self.claim_pooled_world(game, airports, start):
+            self.build_world(game, airports, density, start, progress)
+
+        # start airport
+        if start is None:
+            start_airport = random_choice(game.airports.all())
+        else:
+            start_airport = game.airports.get(master=start)
+        game.start_airport = start_airport
+        game.save()
+
         # add goals
+        progress('goals', 70)
         current_airport = game.start_airport
         goal_airports = []
         for i in range(1, goals + 1):
@@ -1142,6 +1460,9 @@ class GameManager(models.Manager):
 
             current_airport = dest
 
+        progress('players', 90)
+        game.state = Game.NOT_STARTED
+        game.save()
         game.add_player(host)
 
         msg = '{0} has created {1}.'
@@ -1151,6 +1472,7 @@ class GameManager(models.Manager):
         if ai_player:
             Player.objects.get_or_create_ai_player(game)
 
+        progress('done', 100)
         return game
 
     def finished_by(self, player):
@@ -1162,6 +1484,103 @@ class GameManager(models.Manager):
                 finished.append(game.pk)
         return self.filter(pk__in=finished)
 
+    def stale_games(self, now=None):
+        """Return a list of (game, reason) for games that have been abandoned.
+
+        These are games still being created after REAP_CREATING_AFTER
+        minutes, games that were never started within REAP_NOT_STARTED_AFTER
+        minutes or whose host has left, games paused for longer than
+        REAP_PAUSED_AFTER minutes, games with no human players left for
+        REAP_NO_HUMANS_AFTER minutes and games in progress whose humans have
+        been idle for REAP_IDLE_AFTER minutes.  A threshold of None disables
+        that check.
+        """
+        now = now or datetime.now()
+        stale = []
+
+        def older_than(threshold):
+            return now - timedelta(minutes=threshold)
+
+        if settings.REAP_CREATING_AFTER is not None:
+            games = self.filter(state=Game.CREATING)
+            games = games.filter(
+                creation_time__lt=older_than(settings.REAP_CREATING_AFTER)
+            )
+            stale.extend((i, 'never built') for i in games)
+
+        games = list(
+            self.filter(state__in=(Game.NOT_STARTED, Game.IN_PROGRESS, Game.PAUSED))
+        )
+        achievements = Achievement.objects.filter(game__in=games)
+        humans = achievements.filter(player__ai_player=False)
+        humans = set(humans.values_list('game_id', flat=True))
+        hosts = achievements.filter(player=models.F('game__host'))
+        hosts = set(hosts.values_list('game_id', flat=True))
+
+        # the last time a human did something: started the game or bought a
+        # ticket
+        purchases = Purchase.objects.filter(game__in=games, player__ai_player=False)
+        purchases = purchases.values('game').annotate(
+            last=models.Max('creation_time')
+        )
+        last_purchase = {i['game']: i['last'] for i in purchases}
+
+        def idle_since(game, threshold):
+            if threshold is None:
+                return False
+            last = max(game.timestamp, last_purchase.get(game.pk, game.timestamp))
+            return last < older_than(threshold)
+
+        not_started_after = settings.REAP_NOT_STARTED_AFTER
+        paused_after = settings.REAP_PAUSED_AFTER
+        for game in games:
+            if game.pk not in humans:
+                if idle_since(game, settings.REAP_NO_HUMANS_AFTER):
+                    stale.append((game, 'no human players'))
+            elif game.state == Game.NOT_STARTED and game.pk not in hosts:
+                stale.append((game, 'host left'))
+            elif (
+                game.state == Game.NOT_STARTED
+                and not_started_after is not None
+                and game.creation_time < older_than(not_started_after)
+            ):
+                stale.append((game, 'never started'))
+            elif (
+                game.state == Game.PAUSED
+                and paused_after is not None
+                and game.pausestamp < older_than(paused_after)
+            ):
+                stale.append((game, 'paused too long'))
+            elif game.state == Game.IN_PROGRESS and idle_since(
+                game, settings.REAP_IDLE_AFTER
+            ):
+                stale.append((game, 'idle'))
+
+        return stale
+
+    def archive(self, game):
+        """Move the flights, purchases and (read) messages of the finished
+        *game* to the archive tables"""
+        assert game.state == Game.GAME_OVER, 'Game is not over'
+        flights = Flight.objects.filter(game=game)
+        purchases = Purchase.objects.filter(game=game)
+        messages = Message.objects.filter(game=game, read=True)
+
+        with transaction.atomic():
+            # Player.ticket would cascade
+            Player.objects.filter(ticket__in=flights).update(ticket=None)
+            ArchivedFlight.objects.copy(flights)
+            ArchivedPurchase.objects.copy(purchases)
+            ArchivedMessage.objects.copy(messages)
+            messages.delete()
+            purchases.delete()
+            flights.delete()
+            game.archived = True
+            game.save(update_fields=['archived'])
+
+        logger.info('{0}: archived'.format(game))
+        return game
+
     def won_by(self, player):
         """Return qs of games won"""
         # TODO: There has got to be a better way to do this
@@ -1193,12 +1612,19 @@ class Game(AirportModel):
 
     The Game is the God of Airport"""
 
-    NOT_STARTED, GAME_OVER, IN_PROGRESS, PAUSED = -1, 0, 1, 2
-    STATE_CHOICES = ((-1, NOT_STARTED), (0, GAME_OVER), (1, IN_PROGRESS), (2, PAUSED))
+    POOLED, CREATING, NOT_STARTED, GAME_OVER, IN_PROGRESS, PAUSED = -3, -2, -1, 0, 1, 2
+    STATE_CHOICES = (
+        (-3, POOLED),
+        (-2, CREATING),
+        (-1, NOT_STARTED),
+        (0, GAME_OVER),
+        (1, IN_PROGRESS),
+        (2, PAUSED),
+    )
 
     TIMEFACTOR = settings.TIMEFACTOR
 
-    host = models.ForeignKey(Player, related_name='+')
+    host = models.ForeignKey(Player, null=True, blank=True, related_name='+')
     players = models.ManyToManyField(Player, blank=True, through='Achievement')
     state = models.SmallIntegerField(choices=STATE_CHOICES, default=-1)
     goals = models.ManyToManyField(City, through='Goal')
@@ -1209,21 +1635,21 @@ class Game(AirportModel):
     pause_time = models.IntegerField(default=0)
     min_distance = models.IntegerField(null=True)
     max_distance = models.IntegerField(null=True)
+    archived = models.BooleanField(default=False)
     objects = GameManager()
 
-    def __init__(self, *args, **kwargs):
-        from airport.monkeywrench import MonkeyWrenchFactory
-
-        super(Game, self).__init__(*args, **kwargs)
-        self.mwf = MonkeyWrenchFactory()
-
     def __str__(self):
         return 'Game {}'.format(self.pk)
 
     @classmethod
     def open_games(cls):
-        """Return the set of non-closed games."""
-        return cls.objects.exclude(state=cls.GAME_OVER)
+        """Return the set of non-closed games.
+
+        Games still being created and pooled games are not considered open.
+        """
+        return cls.objects.exclude(
+            state__in=(cls.GAME_OVER, cls.CREATING, cls.POOLED)
+        )
 
     def begin(self):
         """start the game"""
@@ -1243,6 +1669,10 @@ class Game(AirportModel):
             # We've already ended this game(?)
             return
 
+        if self.state in (self.IN_PROGRESS, self.PAUSED):
+            winners = Player.objects.winners(self)
+            PlayerStats.objects.bump(winners, won_count=1)
+
         self.state = self.GAME_OVER
         self.timestamp = datetime.now()
         self.save()
@@ -1250,6 +1680,8 @@ class Game(AirportModel):
             player.game = None
             player.save()
 
+        GameSummary.objects.build(self)
+
         msg = '{0} has ended!'.format(self)
         broadcast(msg, finishers=True)
 
@@ -1277,8 +1709,12 @@ class Game(AirportModel):
 
         # This is a pain in the ass to do, basically we need to create an
         # Achievement model for each goal
-        for goal in Goal.objects.filter(game=self):
+        goals = list(Goal.objects.filter(game=self))
+        for goal in goals:
             Achievement.objects.create(player=player, goal=goal, game=self)
+        if goals:
+            PlayerStats.objects.bump([player], game_count=1)
+        lobby.invalidate()
 
         # put the player at the starting airport and take away their
         # tickets
@@ -1307,8 +1743,12 @@ class Game(AirportModel):
             player = player.player
         achievements = Achievement.objects.select_for_update()
         achievements = achievements.filter(player=player, game=self)
+        if achievements.exists():
+            achieved = achievements.exclude(timestamp=None).count()
+            PlayerStats.objects.bump([player], game_count=-1, goal_count=-achieved)
         # bye!
         achievements.delete()
+        lobby.invalidate()
 
     @property
     def time(self):
@@ -1340,9 +1780,14 @@ class Game(AirportModel):
             self.timestamp = datetime.now()
 
         super(Game, self).save(*args, **kwargs)
+        lobby.invalidate()
 
         # make sure host is a player
-        if new_game and not self.players.filter(id=self.host.id).exists():
+        if (
+            new_game
+            and self.host
+            and not self.players.filter(id=self.host.id).exists()
+        ):
             self.add_player(self.host)
 
     def pause(self):
@@ -1363,33 +1808,84 @@ class Game(AirportModel):
             self.pausestamp = None
             self.save()
 
-    def is_over(self):
+    def is_over(self, counts=None):
         """Return true iff game is over
 
-        Game Over means all players have acheieve all goals"""
-        players = self.players.distinct()
-
-        # if there are no players, it's over
-        if players.count() == 0:
-            return True
+        Game Over means all players have acheieve all goals.  *counts*, if
+        given, is the return value of achievement_counts().
+        """
+        if counts is None:
+            counts = self.achievement_counts()
 
-        goals = Goal.objects.filter(game=self)
-        for goal in goals:
-            for player in players:
-                if not goal.was_achieved_by(player):
-                    return False
-        return True
+        # if there are no players, it's over.
+        return all(i['achieved'] == i['goals'] for i in counts.values())
 
-    def stats(self):
+    def stats(self, counts=None):
         """Return a list of 2-tuples of:
             (username, goals_achieved)
 
-        for each player of the game"""
-        stats = []
-        for player in self.players.distinct().order_by('user__username'):
-            stats.append([player.user.username, self.goals_achieved_for(player)])
+        for each player of the game.  *counts*, if given, is the return value
+        of achievement_counts().
+        """
+        if counts is None:
+            counts = self.achievement_counts()
+
+        stats = [[i['username'], i['achieved']] for i in counts.values()]
+        stats.sort()
         return stats
 
+    def share(self, *objects):
+        """Make those *objects* (Airports, Flights...) that belong to the
+        game use this Game object, so that the game and what is kept on it
+        (e.g. city_airport_counts()) are only looked up once.  None objects
+        are skipped.
+        """
+        for obj in objects:
+            if obj is not None and obj.game_id == self.pk:
+                obj.game = self
+
+    def city_airport_counts(self):
+        """Return a dict of city id -> the number of the game's airports in
+        that city.
+
+        The game's airports don't change once it's built so this is only
+        looked up once per Game object.
+        """
+        counts = getattr(self, '_city_airport_counts', None)
+        if counts is None:
+            counts = self.airports.values('master__city').annotate(
+                count=models.Count('id')
+            )
+            counts = {i['master__city']: i['count'] for i in counts}
+            self._city_airport_counts = counts
+        return counts
+
+    def achievement_counts(self):
+        """Return a dict of the goals achieved for each player of the game.
+
+        The dict is keyed on player id and the values are dicts of:
+            username: the player's username
+            achieved: the number of goals the player has achieved
+            goals: the number of goals in the game
+
+        This is computed in a single query so that it can be done once per
+        turn and passed around.
+        """
+        counts = Achievement.objects.filter(game=self)
+        counts = counts.values('player_id', 'player__user__username')
+        counts = counts.annotate(
+            achieved=models.Count('timestamp'), goals=models.Count('id')
+        )
+
+        return {
+            i['player_id']: {
+                'username': i['player__user__username'],
+                'achieved': i['achieved'],
+                'goals': i['goals'],
+            }
+            for i in counts
+        }
+
     def goals_achieved_for(self, player):
         """Return the number of goals achieved for *player*"""
         return Achievement.objects.filter(
@@ -1456,6 +1952,11 @@ class Game(AirportModel):
         for player in players:
             purchase = Purchase(player=player, game=self, flight=flight)
             purchases.append(purchase)
+        PlayerStats.objects.bump(
+            [i.player for i in purchases],
+            ticket_count=1,
+            flight_time=flight.flight_time,
+        )
         return Purchase.objects.bulk_create(purchases)
 
     def info(self):
@@ -1481,10 +1982,11 @@ class Game(AirportModel):
 
     @classmethod
     def games_info(cls):
-        """Return a list of .info()s for open games."""
-        games = cls.objects.exclude(state=0)
-        games = games.order_by('creation_time')
-        return [i.info() for i in games]
+        """Return a list of .info()s for open games.
+
+        This comes from the lobby snapshot.
+        """
+        return lobby.games_info()
 
     class BaseException(Exception):
 
@@ -1514,6 +2016,118 @@ class Game(AirportModel):
         pass
 
 
+class Lobby(object):
+
+    """Versioned snapshot of the open games, as shown in the lobby.
+
+    The snapshot is built with one query and kept until it is invalidated
+    (whenever a game is saved or players join or leave).  When
+    LOBBY_SHARED_CACHE is set the version and snapshot are kept in Django's
+    cache so that all processes share them.  Otherwise each process has its
+    own, which is rebuilt after LOBBY_SNAPSHOT_TTL seconds at the latest.
+    """
+
+    version_key = 'airport.lobby.version'
+
+    def __init__(self):
+        self.version = 0
+        self.snapshot = None
+        self.snapshot_version = None
+        self.snapshot_time = None
+
+    def get_version(self):
+        """Return the current version of the lobby"""
+        if settings.LOBBY_SHARED_CACHE:
+            cache.add(self.version_key, 0, None)
+            return cache.get(self.version_key, 0)
+        return self.version
+
+    def invalidate(self):
+        """Mark the current snapshot as out of date"""
+        self.version = self.version + 1
+        if settings.LOBBY_SHARED_CACHE:
+            try:
+                cache.incr(self.version_key)
+            except ValueError:
+                cache.set(self.version_key, 1, None)
+
+    def rows(self):
+        """Return the (cached) snapshot of open games"""
+        version = self.get_version()
+        now = datetime.now()
+        if (
+            self.snapshot is not None
+            and self.snapshot_version == version
+            and (now - self.snapshot_time).total_seconds()
+            < settings.LOBBY_SNAPSHOT_TTL
+        ):
+            return self.snapshot
+
+        rows = None
+        key = '{0}.{1}'.format(self.version_key, version)
+        if settings.LOBBY_SHARED_CACHE:
+            rows = cache.get(key)
+        if rows is None:
+            rows = self.build()
+            if settings.LOBBY_SHARED_CACHE:
+                cache.set(key, rows, settings.LOBBY_SNAPSHOT_TTL)
+
+        self.snapshot, self.snapshot_version, self.snapshot_time = rows, version, now
+        return rows
+
+    @staticmethod
+    def build():
+        """Build the snapshot of open games"""
+        # Counted with correlated subqueries.  Joining the achievements,
+        # goals and airports would multiply them together for every game.
+        count = 'SELECT COUNT({0}) FROM {1} WHERE {1}.game_id = {2}.id'
+        game_table = Game._meta.db_table
+        games = Game.open_games().order_by('creation_time')
+        games = games.extra(
+            select={
+                'num_players': count.format(
+                    'DISTINCT player_id', Achievement._meta.db_table, game_table
+                ),
+                'num_goals': count.format('*', Goal._meta.db_table, game_table),
+                'num_airports': count.format(
+                    '*', Airport._meta.db_table, game_table
+                ),
+            }
+        )
+        games = games.values(
+            'id',
+            'state',
+            'creation_time',
+            'host__user__username',
+            'num_players',
+            'num_goals',
+            'num_airports',
+        )
+        return list(games)
+
+    def games_info(self):
+        """Return the lobby as a list of Game.info()s"""
+        states = ['New', 'Finished', 'Started', 'Paused']
+        url = reverse('airport.views.games_join')
+        return [
+            {
+                'id': i['id'],
+                'players': i['num_players'],
+                'host': escape(i['host__user__username']),
+                'goals': i['num_goals'],
+                'airports': i['num_airports'],
+                'status': states[i['state'] + 1],
+                # relative to now, so not part of the snapshot
+                'created': naturaltime(i['creation_time']),
+                'url': '{0}?id={1}'.format(url, i['id']),
+            }
+            for i in self.rows()
+        ]
+
+
+lobby = Lobby()
+
+
 class Goal(AirportModel):
 
     """Goal cities for a game"""
@@ -1547,12 +2161,12 @@ class Goal(AirportModel):
         """
         data = {}
 
-        achievements = Achievement.objects.filter(goal=self, game=self.game).values(
-            'player_id', 'timestamp'
-        )
+        achievements = Achievement.objects.filter(goal=self, game_id=self.game_id)
+        achievements = list(achievements.values('player_id', 'timestamp'))
+        players = Player.objects.in_bulk([i['player_id'] for i in achievements])
 
         for achievement in achievements:
-            player = Player.objects.get(id=achievement['player_id'])
+            player = players[achievement['player_id']]
             data[player] = achievement['timestamp']
 
         return data
@@ -1577,8 +2191,17 @@ class Achievement(AirportModel):
         index_together = [['goal', 'game']]
 
     def fulfill(self, timestamp):
+        first_time = self.timestamp is None
         self.timestamp = timestamp
         self.save()
+
+        if first_time:
+            increments = {'goal_count': 1}
+            if self.goal == self.game.last_goal():
+                finish_time = timestamp - self.game.creation_time
+                increments['total_time'] = finish_time.total_seconds()
+                increments['finished_count'] = 1
+            PlayerStats.objects.bump([self.player], **increments)
         return self
 
     def save(self, *args, **kwargs):
@@ -1586,9 +2209,12 @@ class Achievement(AirportModel):
         if self.goal:
             self.game = self.goal.game
 
-        if self.id is not None:
-            old_ach = Achievement.objects.get(id=self.id)
-            if old_ach.timestamp is None:
+        if self.id is not None and self.timestamp is not None:
+            if getattr(self, '_loaded_values', None) is None:
+                old_timestamp = Achievement.objects.get(id=self.id).timestamp
+            else:
+                old_timestamp = self.loaded_value('timestamp')
+            if old_timestamp is None:
                 # send out a message
                 msg = '{0} has achieved a goal: {1}'
                 msg = msg.format(self.player.user.username, self.goal.stars())
@@ -1619,16 +2245,331 @@ class Purchase(AirportModel):
         )
 
 
-def random_choice(queryset):
+class ArchiveManager(models.Manager):
+    def copy(self, queryset):
+        """Copy the rows of *queryset* into the archive table (keeping their
+        ids)"""
+        fields = [i.attname for i in self.model._meta.concrete_fields]
+        return self.bulk_create(
+            [self.model(**{i: getattr(row, i) for i in fields}) for row in queryset]
+        )
+
+
+class ArchiveModel(models.Model):
+
+    """Base class for the archive tables.
+
+    Rows keep the id and creation_time of the row they were archived from.
+    """
+
+    creation_time = models.DateTimeField()
+    objects = ArchiveManager()
+
+    class Meta:
+        abstract = True
+
+
+class ArchivedFlight(ArchiveModel):
+
+    """A Flight of an archived game"""
+
+    game = models.ForeignKey(Game, related_name='+', db_index=True)
+    number = models.IntegerField()
+    origin = models.ForeignKey(Airport, related_name='+')
+    destination = models.ForeignKey(Airport, related_name='+')
+    depart_time = models.DateTimeField()
+    flight_time = models.IntegerField()
+    arrival_time = models.DateTimeField()
+    state = models.CharField(max_length=20)
+
+    elapsed = Flight.elapsed
+
+
+class ArchivedPurchase(ArchiveModel):
+
+    """A Purchase of an archived game"""
+
+    player = models.ForeignKey(Player, related_name='archived_tickets')
+    game = models.ForeignKey(Game, related_name='+')
+    flight = models.ForeignKey(ArchivedFlight, related_name='+')
+
+    class Meta:
+        index_together = [['player', 'game']]
+
+
+class ArchivedMessage(ArchiveModel):
+
+    """A (read) Message of an archived game"""
+
+    text = models.TextField()
+    player = models.ForeignKey(Player, related_name='+', db_index=True)
+    read = models.BooleanField(default=True)
+    message_type = models.CharField(max_length=32)
+    game = models.ForeignKey(Game, related_name='+', db_index=True)
+
+
+class PlayerStatsManager(models.Manager):
+    def for_player(self, player):
+        """Return the PlayerStats for *player*.
+
+        Players that pre-date PlayerStats get theirs built from their game
+        history the first time.
+        """
+        try:
+            return self.get(player=player)
+        except PlayerStats.DoesNotExist:
+            return self.rebuild(player)
+
+    def rebuild(self, player):
+        """(Re)build and return *player*'s PlayerStats from their game
+        history"""
+        stats = self.get_or_create(player=player)[0]
+        games = player.games
+        stats.game_count = games.count()
+        stats.won_count = Game.objects.won_by(player)
+        stats.won_count = stats.won_count.filter(state=Game.GAME_OVER).count()
+        stats.goal_count = player.goals.count()
+        stats.ticket_count = 0
+        stats.flight_time = 0
+        for tickets in (player.tickets, player.archived_tickets):
+            stats.ticket_count = stats.ticket_count + tickets.count()
+            flight_time = tickets.aggregate(models.Sum('flight__flight_time'))
+            flight_time = flight_time['flight__flight_time__sum'] or 0
+            stats.flight_time = stats.flight_time + flight_time
+
+        stats.total_time = 0.0
+        stats.finished_count = 0
+        for game in games:
+            last_goal = game.last_goal()
+            my_time = Achievement.objects.get(
+                game=game, goal=last_goal, player=player
+            ).timestamp
+            if my_time:
+                my_time = my_time - game.creation_time
+                stats.total_time = stats.total_time + my_time.total_seconds()
+                stats.finished_count = stats.finished_count + 1
+
+        stats.save()
+        return stats
+
+    def bump(self, players, **increments):
+        """Add *increments* to the stats of *players*"""
+        increments = {i: models.F(i) + increments[i] for i in increments}
+        return self.filter(player__in=players).update(**increments)
+
+    def ranked(self):
+        """Return qs of (human) players' stats in leaderboard order.
+
+        Players are ranked by games won, ties are broken by goals achieved.
+        """
+        stats = self.filter(player__ai_player=False)
+        return stats.order_by('-won_count', '-goal_count', 'player')
+
+    def leaderboard(self, count=None):
+        """Return a list of .info()s for the top *count* players"""
+        count = count or settings.LEADERBOARD_SIZE
+        stats = self.ranked().select_related('player__user')[:count]
+        return [dict(i.info(), rank=n) for n, i in enumerate(stats, 1)]
+
+    def rank(self, player):
+        """Return *player*'s position on the leaderboard"""
+        stats = self.for_player(player)
+        won, goals = stats.won_count, stats.goal_count
+        ahead = self.ranked().filter(
+            models.Q(won_count__gt=won)
+            | models.Q(won_count=won, goal_count__gt=goals)
+            | models.Q(won_count=won, goal_count=goals, player__lt=player)
+        )
+        return ahead.count() + 1
+
+
+class PlayerStats(AirportModel):
+
+    """Career statistics for a player.
+
+    These are kept up to date as goals are achieved, tickets used and games
+    ended so that they don't have to be computed from the player's history.
+    """
+
+    player = models.OneToOneField(Player, related_name='stats')
+    game_count = models.IntegerField(default=0)
+    won_count = models.IntegerField(default=0)
+    goal_count = models.IntegerField(default=0)
+    ticket_count = models.IntegerField(default=0)
+    flight_time = models.IntegerField(default=0)  # minutes
+    total_time = models.FloatField(default=0.0)  # seconds to finish games
+    finished_count = models.IntegerField(default=0)
+    objects = PlayerStatsManager()
+
+    class Meta:
+        index_together = [['won_count', 'goal_count']]
+        verbose_name_plural = 'player stats'
+
+    def __str__(self):
+        return 'Stats for {0}'.format(self.player)
+
+    @property
+    def average_time(self):
+        """Average time (seconds) it took to finish a game or None"""
+        if not self.finished_count:
+            return None
+        return self.total_time / self.finished_count
+
+    @property
+    def goals_per_game(self):
+        if not self.game_count:
+            return 0.0
+        return self.goal_count / self.game_count
+
+    def info(self):
+        """Return a json-able dict of the stats for the leaderboard"""
+        average_time = self.average_time
+        if average_time is not None:
+            average_time = str(timedelta(seconds=int(average_time)))
+        return {
+            'username': escape(self.player.user.username),
+            'wins': self.won_count,
+            'average_time': average_time,
+            'goals_per_game': round(self.goals_per_game, 1),
+        }
+
+
+class GameSummaryManager(models.Manager):
+    def for_game(self, game, player):
+        """Return the summary dict of *game* for *player*.
+
+        Finished games never change, so their summaries are built once and
+        stored.  Summaries of games still being played are computed.
+        """
+        if game.state != Game.GAME_OVER:
+            return self.summarize(game, player)
+
+        try:
+            summary = self.get(game=game, player=player)
+        except GameSummary.DoesNotExist:
+            # games that ended before there were summaries
+            self.build(game)
+            summary = self.get(game=game, player=player)
+
+        return json.loads(summary.data)
+
+    def build(self, game):
+        """Build and store the summaries for all the players of *game*"""
+        players = list(game.players.distinct())
+        self.filter(game=game, player__in=players).delete()
+        self.bulk_create(
+            [
+                GameSummary(
+                    game=game, player=i, data=json.dumps(self.summarize(game, i))
+                )
+                for i in players
+            ]
+        )
+
+    def summarize(self, game, player):
+        """Compute the summary dict of *game* for *player*"""
+        # label airports the way Airport.__str__ does, without the query per
+        # airport
+        airports = list(game.airports.select_related('master__city'))
+        cities = {i.pk: i.master.city_id for i in airports}
+        per_city = Counter(cities.values())
+        labels = {}
+        places = {}
+        for airport in airports:
+            city = airport.city
+            if per_city[city.pk] > 1:
+                labels[airport.pk] = '{0} {1}'.format(city, airport.code)
+            else:
+                labels[airport.pk] = city.name
+            places[airport.pk] = {
+                'name': city.name,
+                'latitude': str(city.latitude),
+                'longitude': str(city.longitude),
+            }
+
+        goals = list(
+            Goal.objects.filter(game=game)
+            .order_by('order')
+            .values_list('city_id', flat=True)
+        )
+        purchase_model = ArchivedPurchase if game.archived else Purchase
+        purchases = purchase_model.objects.filter(player=player, game=game)
+        purchases = purchases.select_related('flight__game')
+        purchases = purchases.order_by('creation_time')
+
+        tickets = []
+        current_goal = 0
+        for purchase in purchases:
+            flight = purchase.flight
+            goal = (
+                current_goal < len(goals)
+                and cities[flight.destination_id] == goals[current_goal]
+            )
+            if goal:
+                current_goal = current_goal + 1
+            tickets.append(
+                {
+                    'id': purchase.pk,
+                    'origin': labels[flight.origin_id],
+                    'destination': labels[flight.destination_id],
+                    'origin_city': places[flight.origin_id],
+                    'destination_city': places[flight.destination_id],
+                    'number': flight.number,
+                    'depart_time': date(flight.depart_time, 'P'),
+                    'arrival_time': date(flight.arrival_time, 'P'),
+                    'elapsed': str(flight.elapsed()),
+                    'goal': goal,
+                }
+            )
+
+        players = game.players.exclude(id=player.id).distinct()
+        return {
+            'tickets': tickets,
+            'placed': game.place(player) if goals else 0,
+            'goals': len(goals),
+            'num_airports': len(cities),
+            'players': list(players.values_list('user__username', flat=True)),
+        }
+
+
+class GameSummary(AirportModel):
+
+    """The (json-encoded) summary of a finished game for a player"""
+
+    game = models.ForeignKey(Game, related_name='summaries')
+    player = models.ForeignKey(Player, related_name='+')
+    data = models.TextField()
+    objects = GameSummaryManager()
+
+    class Meta:
+        unique_together = ('game', 'player')
+        verbose_name_plural = 'game summaries'
+
+    def __str__(self):
+        return 'Summary of {0} for {1}'.format(self.game, self.player)
+
+
+def random_choice(queryset, rng=None):
     """Return an random item from *queryset*
 
-    return None if queryset is empty.
+    return None if queryset is empty.  *queryset* may also be a list of
+    items already in memory.  *rng* is the random.Random to use (the random
+    module's by default).
 
-    This is an alternative (better) method than order_by('?')[0]
+    Rather than a COUNT and an OFFSET (which has to scan past all the rows
+    before it) we pick a random id between the queryset's smallest and
+    largest and take the first row at or after it.  Rows that follow a gap in
+    the ids are a little more likely to be picked, which is random enough for
+    our purposes.
     """
-    count = queryset.count()
-    if count == 0:
+    if isinstance(queryset, (list, tuple)):
+        if not queryset:
+            return None
+        return rng.choice(queryset) if rng else choice(queryset)
+
+    bounds = queryset.aggregate(low=models.Min('pk'), high=models.Max('pk'))
+    if bounds['low'] is None:
         return None
 
-    index = randint(0, count - 1)
-    return queryset[index]
+    pivot = (rng.randint if rng else randint)(bounds['low'], bounds['high'])
+    return queryset.filter(pk__gte=pivot).order_by('pk').first()
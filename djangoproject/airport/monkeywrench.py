@@ -12,21 +12,24 @@ The MonkeyWrenchFactory collects all the various MonkeyWrench classes, and
 when it's create() method is called, picks one at random, instantiates it
 and returns it to the caller
 """
+import bisect
 import datetime
-import os
+import itertools
 import random
 
 from django.db.models import Count, F
 
 from airport import logger, models
+from airport.conf import settings
 
 
 class MonkeyWrench(object):
     """A monkey wrench """
 
-    def __init__(self, game, now=None):
+    def __init__(self, game, now=None, rng=None):
         self.game = game
         self._now = now
+        self.random = rng or random
         self.thrown = False
 
     def __str__(self):
@@ -51,7 +54,7 @@ class CancelledFlight(MonkeyWrench):
     def throw(self):
         now = self.now
         flights = self.game.flights.filter(depart_time__gt=now)
-        flight = models.random_choice(flights)
+        flight = models.random_choice(flights, self.random)
         if not flight:
             return
         flight.cancel(now)
@@ -73,10 +76,10 @@ class DelayedFlight(MonkeyWrench):
     def throw(self):
         now = self.now
         flights = self.game.flights.filter(depart_time__gt=now)
-        flight = models.random_choice(flights)
+        flight = models.random_choice(flights, self.random)
         if not flight:
             return
-        minutes = random.randint(20, 60)
+        minutes = self.random.randint(20, 60)
         timedelta = datetime.timedelta(minutes=minutes)
         try:
             flight.delay(timedelta, now)
@@ -106,19 +109,16 @@ class AllFlightsFromAirportDelayed(MonkeyWrench):
     def throw(self):
         now = self.now
         airports = self.game.airports.all()
-        airport = models.random_choice(airports)
-        flights = self.game.flights.filter(origin=airport, depart_time__gt=now)
-        minutes = random.randint(20, 60)
+        airport = models.random_choice(airports, self.random)
+        minutes = self.random.randint(20, 60)
         timedelta = datetime.timedelta(minutes=minutes)
-        for flight in flights:
-            try:
-                flight.delay(timedelta, now)
-            except flight.Finished:
-                continue
+        delayed = models.Flight.objects.delay_departures(airport, timedelta, now)
+        if not delayed:
+            return
         broadcast(
             (
-                'Due to weather, all flights from {airport} are delayed'
-                ' {min} minutes'.format(airport=airport.code, min=minutes)
+                'Due to weather, all {count} flights from {airport} are delayed'
+                ' {min} minutes'.format(count=delayed, airport=airport.code, min=minutes)
             ),
             self.game,
         )
@@ -131,14 +131,14 @@ class AllFlightsFromAirportCancelled(MonkeyWrench):
     def throw(self):
         now = self.now
         airports = self.game.airports.all()
-        airport = models.random_choice(airports)
-        flights = self.game.flights.filter(origin=airport, depart_time__gt=now)
-        for flight in flights:
-            flight.cancel(now)
+        airport = models.random_choice(airports, self.random)
+        cancelled, revoked = models.Flight.objects.cancel_departures(airport, now)
+        if not cancelled:
+            return
         broadcast(
             (
-                'Due to weather, all flights from {airport} are'
-                ' cancelled'.format(airport=airport)
+                'Due to weather, all {count} flights from {airport} are'
+                ' cancelled'.format(count=cancelled, airport=airport)
             ),
             self.game,
         )
@@ -157,18 +157,18 @@ class DivertedFlight(MonkeyWrench):
 
     def throw(self):
         flights = models.Flight.objects.in_flight(self.game, self.now)
-        flight = models.random_choice(flights)
+        flight = models.random_choice(flights, self.random)
         if not flight:
             return
         diverted_to = models.Airport.objects.filter(game=self.game)
         diverted_to = diverted_to.exclude(pk=flight.destination.pk)
-        diverted_to = models.random_choice(diverted_to)
+        diverted_to = models.random_choice(diverted_to, self.random)
         flight.destination = diverted_to
         flight.flight_time = models.City.get_flight_time(
             flight.origin, flight.destination, models.Flight.cruise_speed
         )
         flight.save()
-        reason = random.choice(self.reasons)
+        reason = self.random.choice(self.reasons)
         broadcast(reason.format(num=flight.number, dest=diverted_to), self.game)
         self.thrown = True
 
@@ -183,7 +183,7 @@ class MechanicalProblem(MonkeyWrench):
     def throw(self):
         flights = models.Flight.objects.in_flight(self.game, self.now)
         flights = flights.exclude(destination=F('origin'))
-        flight = models.random_choice(flights)
+        flight = models.random_choice(flights, self.random)
         if not flight:
             return
         flight.destination = flight.origin
@@ -212,14 +212,14 @@ class LateFlight(MonkeyWrench):
 
     def throw(self):
         flights = models.Flight.objects.in_flight(self.game, self.now)
-        flight = models.random_choice(flights)
+        flight = models.random_choice(flights, self.random)
         if not flight:
             return
-        minutes = random.randint(self.MIN_LATENESS, self.MAX_LATENESS)
+        minutes = self.random.randint(self.MIN_LATENESS, self.MAX_LATENESS)
         flight.flight_time = flight.flight_time + minutes
         flight.state = 'Delayed'
         flight.save()
-        message = random.choice(self.RANDOM_MESSAGES)
+        message = self.random.choice(self.RANDOM_MESSAGES)
         text = message.format(
             flight_number=flight.number, minutes=minutes, destination=flight.destination
         )
@@ -235,7 +235,7 @@ class Hint(MonkeyWrench):
 
     def throw(self):
         players = self.game.players.all()
-        player = models.random_choice(players)
+        player = models.random_choice(players, self.random)
         if not player:
             return
 
@@ -246,7 +246,7 @@ class Hint(MonkeyWrench):
             return
 
         airports = self.game.airports.filter(destinations__master__city=current_goal)
-        airport = models.random_choice(airports)
+        airport = models.random_choice(airports, self.random)
 
         if airport.city == current_goal:
             return
@@ -275,8 +275,8 @@ class TSA(MonkeyWrench):
         flights = list(flights.filter(num_passengers__gt=0))
         if not flights:
             return
-        flight = random.choice(flights)
-        passenger = random.choice(list(flight.passengers.all()))
+        flight = self.random.choice(flights)
+        passenger = self.random.choice(list(flight.passengers.all()))
 
         # kick him off!
         msg = (
@@ -296,7 +296,7 @@ class FullFlight(MonkeyWrench):
         now = self.now
         flights = self.game.flights.filter(depart_time__gt=now).filter(full=False)
 
-        flight = models.random_choice(flights)
+        flight = models.random_choice(flights, self.random)
         if not flight:
             return
 
@@ -318,12 +318,12 @@ class TailWind(MonkeyWrench):
         min_arrival_time = now + datetime.timedelta(minutes=self.minimum_minutes)
         flights = models.Flight.objects.in_flight(self.game, now)
         flights = flights.filter(arrival_time__gt=min_arrival_time)
-        flight = models.random_choice(flights)
+        flight = models.random_choice(flights, self.random)
         if not flight:
             return
 
         orig_arrival_time = int((flight.arrival_time - now).total_seconds())
-        secs_to_shave = random.randint(
+        secs_to_shave = self.random.randint(
             self.minimum_minutes * 60, min(orig_arrival_time, self.maximum_minutes * 60)
         )
         mins_to_shave = secs_to_shave // 60
@@ -338,30 +338,68 @@ class TailWind(MonkeyWrench):
         self.thrown = True
 
 
+_registry = None
+
+
+def registry():
+    """Return a dict of name -> MonkeyWrench class for all the wrenches in
+    this module.  It is built on first use."""
+    global _registry
+
+    if _registry is None:
+        _registry = {
+            name: obj
+            for name, obj in globals().items()
+            if type(obj) is type and issubclass(obj, MonkeyWrench)
+        }
+    return _registry
+
+
+def enabled_wrenches():
+    """Return a dict of MonkeyWrench class -> weight for the wrenches that
+    can be thrown.
+
+    MONKEYWRENCH_ENABLED lists the names of the wrenches to throw (None for
+    all of them) and MONKEYWRENCH_WEIGHTS gives the relative weights of the
+    named wrenches (the default is 1; 0 disables the wrench).
+    """
+    wrenches = registry()
+    names = settings.MONKEYWRENCH_ENABLED
+    if names is None:
+        names = wrenches.keys()
+    weights = settings.MONKEYWRENCH_WEIGHTS
+
+    return {
+        wrenches[name]: weights.get(name, 1)
+        for name in names
+        if weights.get(name, 1) > 0
+    }
+
+
 class MonkeyWrenchFactory(object):
     """This factory is responsible for returning a new randomly chosen
     MonkeyWrench for a given game
 
     Usage:
-    mwf = MonkeyWrenchFactory(game)
-    mw = mwf.create()
+    mwf = MonkeyWrenchFactory()
+    mw = mwf.create(game)
     mw.throw()
+
+    Pass a random.Random to pick the wrenches, and what they hit, with it
+    instead of the random module.
     """
 
-    def __init__(self):
-        mw_test = os.environ.get('MONKEYWRENCH_TEST', None)
-        if mw_test:
-            self.wrenches = [globals()[mw_test]]
-        else:
-            self.wrenches = [
-                i
-                for i in globals().values()
-                if type(i) is type and issubclass(i, MonkeyWrench)
-            ]
+    def __init__(self, rng=None):
+        self.wrenches = enabled_wrenches()
+        self.random = rng or random
 
     def create(self, game):
         """Create and return a new MonkeyWrench object"""
-        wrench = random.choice(self.wrenches)(game)
+        classes = list(self.wrenches)
+        # random.choices() is Python 3.6+
+        totals = list(itertools.accumulate(self.wrenches[i] for i in classes))
+        index = bisect.bisect(totals, self.random.random() * totals[-1])
+        wrench = classes[index](game, rng=self.random)
         logger.debug('Throwing wrench: %s' % wrench)
         return wrench
 
@@ -371,11 +409,11 @@ class MonkeyWrenchFactory(object):
         *wrench* is a MonkeyWrench (sub)class or a string representing one"""
         try:
             if issubclass(wrench, MonkeyWrench):
-                self.wrenches = [wrench]
+                self.wrenches = {wrench: 1}
                 return
         except TypeError:
             pass
-        self.wrenches = [globals()[wrench]]
+        self.wrenches = {registry()[wrench]: 1}
 
 
 def broadcast(text, game):
@@ -0,0 +1,144 @@
+"""
+Route planning for AI players.
+
+The world of a game (its airports and their destinations) doesn't change once
+the game has been created, so the RoutingTable for a game is built once and
+cached for the life of the game.  It knows how many hops it takes to get from
+any airport to any city.
+
+The flight schedule on the other hand changes every turn, so
+earliest_arrivals() does a time-dependent search over whatever flights it is
+given.  plan_move() combines the two to pick the next flight for an AI player.
+"""
+from collections import deque
+
+from airport import models
+
+_tables = {}
+
+
+def routing_table(game):
+    """Return the (cached) RoutingTable for *game*"""
+    key = _key(game)
+    try:
+        return _tables[key]
+    except KeyError:
+        pass
+
+    table = _tables[key] = RoutingTable(game)
+    return table
+
+
+def forget(game):
+    """Remove *game*'s RoutingTable from the cache"""
+    _tables.pop(_key(game), None)
+
+
+def _key(game):
+    # The creation time guards against game ids being re-used (e.g. when the
+    # database is re-created)
+    return (game.pk, game.creation_time)
+
+
+class RoutingTable(object):
+    """Static routing information for a game"""
+
+    def __init__(self, game):
+        airports = models.Airport.objects.filter(game=game)
+        self.cities = dict(airports.values_list('id', 'master__city_id'))
+        self.destinations = {i: set() for i in self.cities}
+
+        through = models.Airport.destinations.through
+        routes = through.objects.filter(from_airport__game=game)
+        for source, destination in routes.values_list(
+            'from_airport_id', 'to_airport_id'
+        ):
+            self.destinations[source].add(destination)
+
+        self._hops = {}
+
+    def airports_in(self, city_id):
+        """Return the list of airport ids in *city_id*"""
+        return [i for i in self.cities if self.cities[i] == city_id]
+
+    def hops_to(self, city_id):
+        """Return a dict of airport id -> minimum number of flights it takes
+        to get to *city_id*.
+
+        Airports that can't get to the city are not in the dict.
+        """
+        try:
+            return self._hops[city_id]
+        except KeyError:
+            pass
+
+        # breadth-first search out from the city's airports.  Destinations
+        # are symmetrical so we can follow them backwards.
+        hops = {i: 0 for i in self.airports_in(city_id)}
+        queue = deque(hops)
+        while queue:
+            airport_id = queue.popleft()
+            for neighbor in self.destinations[airport_id]:
+                if neighbor not in hops:
+                    hops[neighbor] = hops[airport_id] + 1
+                    queue.append(neighbor)
+
+        self._hops[city_id] = hops
+        return hops
+
+
+def earliest_arrivals(flights, origin_id, now):
+    """Return the earliest arrival times from *origin_id* using *flights*.
+
+    The return value is a dict of airport id -> (arrival_time, first_flight)
+    where *first_flight* is the flight to take out of *origin_id* to get there
+    (None for *origin_id* itself).  Cancelled and full flights are skipped.
+    """
+    arrivals = {origin_id: (now, None)}
+
+    for flight in sorted(flights, key=lambda i: i.depart_time):
+        if flight.cancelled or flight.full:
+            continue
+
+        reached = arrivals.get(flight.origin_id)
+        if reached is None or reached[0] >= flight.depart_time:
+            continue
+
+        best = arrivals.get(flight.destination_id)
+        if best is None or flight.arrival_time < best[0]:
+            first_flight = reached[1] or flight
+            arrivals[flight.destination_id] = (flight.arrival_time, first_flight)
+
+    return arrivals
+
+
+def plan_move(table, flights, airport_id, city_id, now):
+    """Return the flight to take from *airport_id* to get to *city_id*.
+
+    *table* is the game's RoutingTable and *flights* the current flight
+    schedule.  If the schedule can get us to the city, return the first flight
+    of the earliest arriving route.  Otherwise return the outbound flight that
+    gets us the closest (in hops) to the city.  Return None if there are no
+    flights to take.
+    """
+    flights = [i for i in flights if i.depart_time > now]
+    arrivals = earliest_arrivals(flights, airport_id, now)
+    routes = [arrivals[i] for i in table.airports_in(city_id) if i in arrivals]
+    routes = [i for i in routes if i[1] is not None]
+    if routes:
+        return min(routes, key=lambda i: i[0])[1]
+
+    hops = table.hops_to(city_id)
+    outbound = [
+        i
+        for i in flights
+        if i.origin_id == airport_id and not i.cancelled and not i.full
+    ]
+    if not outbound:
+        return None
+
+    unreachable = len(table.cities)
+    return min(
+        outbound,
+        key=lambda i: (hops.get(i.destination_id, unreachable), i.arrival_time),
+    )
@@ -0,0 +1,211 @@
+"""
+Headless, accelerated-time simulation of the game loop.
+
+A Simulation creates a number of games, starts them and then runs their
+turns the way the GameThread does, except that game time comes from a
+virtual clock that is advanced one tick at a time as fast as the turns can be
+played.  Nothing is sent over IPC; the messages are counted and dropped.
+
+The result is a dict of statistics: ticks per second, queries per tick and
+how much the database grew.  This is what the "simulate" management command
+reports.
+"""
+import os
+import random
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from django.contrib.auth.models import User
+from django.db import connection, reset_queries
+from django.db.models import Q
+from django.test.utils import CaptureQueriesContext
+
+from . import lib, models
+from .conf import settings
+
+# the tables whose growth is reported
+TABLES = (
+    ('flights', models.Flight),
+    ('purchases', models.Purchase),
+    ('messages', models.Message),
+    ('achievements', models.Achievement),
+)
+
+
+class Simulation(object):
+    """Simulate *games* games of *airports* airports and *goals* goals, each
+    with *players* players (AI players if *ai* is True).
+
+    Each tick advances game time by *step* minutes (by default what a tick of
+    the game server is worth).  Monkey wrenches are thrown if *wrenches* is
+    True.  *seed* seeds the random number generators.
+    """
+
+    username = 'simulator{0}'
+
+    def __init__(
+        self,
+        games=1,
+        airports=15,
+        goals=3,
+        players=1,
+        ai=False,
+        step=None,
+        wrenches=False,
+        seed=None,
+    ):
+        self.num_games = games
+        self.num_airports = airports
+        self.num_goals = goals
+        self.num_players = players
+        self.ai = ai
+        if step is None:
+            step = settings.GAMESERVER_LOOP_DELAY * settings.TIMEFACTOR / 60
+        self.step = timedelta(minutes=step)
+        self.wrenches = wrenches
+        self.seed = seed
+
+        self.games = []
+        self.now = None
+        self.start = None
+
+    def setup(self):
+        """Create and start the games"""
+        if self.seed is not None:
+            random.seed(self.seed)
+
+        count = 0
+        for i in range(self.num_games):
+            players = []
+            for j in range(self.num_players):
+                count = count + 1
+                players.append(self.get_player(count))
+
+            game = models.Game.objects.create_game(
+                host=players[0],
+                goals=self.num_goals,
+                airports=self.num_airports,
+                ai_player=False,
+            )
+            for player in players[1:]:
+                game.add_player(player)
+            game.begin()
+            self.games.append(game)
+
+        self.now = self.start = datetime.now()
+
+    def get_player(self, number):
+        """Return the simulator player *number*, creating it if need be"""
+        user, created = User.objects.get_or_create(
+            username=self.username.format(number)
+        )
+        player, created = models.Player.objects.get_or_create(user=user)
+        if player.ai_player != self.ai:
+            player.ai_player = self.ai
+            player.save()
+        return player
+
+    def gettime(self):
+        return self.now
+
+    @contextmanager
+    def virtual_clock(self):
+        """Make all games get their time from the simulation"""
+        models.Game.gettime = self.gettime
+        try:
+            yield
+        finally:
+            del models.Game.gettime
+
+    def wrench_clock(self):
+        # the WrenchScheduler works in wall-clock seconds
+        elapsed = (self.now - self.start).total_seconds()
+        return elapsed / settings.TIMEFACTOR
+
+    def run(self, hours):
+        """Run the games for *hours* game hours (or until they are all over).
+
+        Return a dict of statistics.
+        """
+        if not self.games:
+            self.setup()
+
+        game_ids = [i.pk for i in self.games]
+        end = self.start + timedelta(hours=hours)
+        scheduler = lib.WrenchScheduler(seed=self.seed, clock=self.wrench_clock)
+        rows_before = self.rows()
+        size_before = self.database_size()
+        queries = []
+        ticks = messages = 0
+
+        started = time.time()
+        with self.virtual_clock(), lib.held_messages() as sent:
+            while self.now < end:
+                self.now = self.now + self.step
+                ticks = ticks + 1
+                reset_queries()
+                with CaptureQueriesContext(connection) as context:
+                    games = list(models.Game.open_games().filter(pk__in=game_ids))
+                    if not games:
+                        break
+                    due = scheduler.tick(games) if self.wrenches else ()
+                    for game in games:
+                        self.play(game, ticks, game.pk in due, scheduler.random)
+                queries.append(len(context))
+                messages = messages + len(sent)
+                del sent[:]
+        elapsed = time.time() - started
+
+        rows_after = self.rows()
+        size_after = self.database_size()
+        return {
+            'games': len(game_ids),
+            'hours': hours,
+            'ticks': ticks,
+            'seconds': elapsed,
+            'ticks_per_second': ticks / elapsed if elapsed else 0.0,
+            'queries': sum(queries),
+            'queries_per_tick': sum(queries) / ticks if ticks else 0.0,
+            'max_queries_per_tick': max(queries) if queries else 0,
+            'messages': messages,
+            'finished': models.Game.objects.filter(
+                pk__in=game_ids, state=models.Game.GAME_OVER
+            ).count(),
+            'rows': {i: rows_after[i] - rows_before[i] for i in rows_after},
+            'db_size': size_after,
+            'db_growth': size_after - size_before,
+        }
+
+    def play(self, game, tick, throw_wrench, rng=None):
+        """Play a game's turn like GameThread.run_game()"""
+        game, now = lib.play_turn(game.pk, throw_wrench=throw_wrench, rng=rng)
+
+        if tick % settings.FLIGHT_PRUNE_INTERVAL == 0:
+            models.Flight.objects.prune(game, now)
+
+    def rows(self):
+        """Return a dict of table -> row count"""
+        return {name: model.objects.count() for name, model in TABLES}
+
+    @staticmethod
+    def database_size():
+        """Return the size (in bytes) of the SQLite database file, or 0"""
+        if connection.vendor != 'sqlite':
+            return 0
+        name = connection.settings_dict['NAME']
+        try:
+            return os.path.getsize(name)
+        except (OSError, TypeError):
+            return 0
+
+    def teardown(self):
+        """Delete the simulated games"""
+        for game in self.games:
+            # or the players would be deleted along with the airports (and
+            # the flights of those in the air)
+            models.Player.objects.filter(
+                Q(airport__game=game) | Q(ticket__game=game)
+            ).update(airport=None, ticket=None)
+            game.delete()
+        self.games = []
@@ -0,0 +1,42 @@
+"""
+Opt-in SQLite tuning.
+
+With the default rollback journal, readers and the writer block each other
+and every commit is fsync'ed twice.  PRODUCTION_PRAGMAS switch to the
+write-ahead log so that the web workers can read while the game server
+writes.  They are applied to each new connection when the SQLITE_PROFILE
+setting is True.
+"""
+from collections import OrderedDict
+
+from .conf import settings
+
+PRODUCTION_PRAGMAS = OrderedDict(
+    [
+        ('journal_mode', 'WAL'),
+        ('synchronous', 'NORMAL'),
+        ('busy_timeout', 5000),  # ms
+        ('mmap_size', 256 * 1024 * 1024),
+        ('cache_size', -16 * 1024),  # KiB
+    ]
+)
+
+
+def pragmas():
+    """Return the pragmas to apply to new connections"""
+    if not settings.SQLITE_PROFILE:
+        return OrderedDict()
+
+    pragmas = OrderedDict(PRODUCTION_PRAGMAS)
+    pragmas.update(settings.SQLITE_PRAGMAS)
+    return pragmas
+
+
+def apply_profile(sender, connection, **kwargs):
+    """connection_created handler to apply the SQLite profile"""
+    if connection.vendor != 'sqlite':
+        return
+
+    cursor = connection.cursor()
+    for name, value in pragmas().items():
+        cursor.execute('PRAGMA {0} = {1}'.format(name, value))
@@ -6,6 +6,8 @@ airport.goldstar = "{{ gold_star }}";
 airport.last_ticket = null;
 airport.paused = null;
 airport.geography = null;
+airport.pending_game = null;
+airport.progress = null;
 
 
 // XXX: Clean up!
@@ -429,7 +431,14 @@ airport.create_game = function (e)
     e.preventDefault();
     airport.play('{{ button_click }}');
 
-    $.post($form.prop('action'), $form.serialize(), airport.refresh_ui);
+    $.post($form.prop('action'), $form.serialize(), function (data) {
+        if (data.pending_game) {
+            // the game server builds the game and tells us when it's ready
+            airport.pending_game = data.pending_game;
+            $('#create_widget').hide();
+        }
+        airport.refresh_ui(data);
+    });
 };
 
 
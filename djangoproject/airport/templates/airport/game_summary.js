@@ -7,17 +7,17 @@ function draw_polylines(map) {
     var arrow = {path: google.maps.SymbolPath.FORWARD_CLOSED_ARROW};
 
     {% for ticket in tickets %}
-    lat1 = {{ ticket.flight.origin.city.latitude }};
-    lon1 = {{ ticket.flight.origin.city.longitude }};
-    lat2 = {{ ticket.flight.destination.city.latitude }};
-    lon2 = {{ ticket.flight.destination.city.longitude }};
+    lat1 = {{ ticket.origin_city.latitude }};
+    lon1 = {{ ticket.origin_city.longitude }};
+    lat2 = {{ ticket.destination_city.latitude }};
+    lon2 = {{ ticket.destination_city.longitude }};
 
     {% if forloop.first %}
         new google.maps.Marker({
             position: new google.maps.LatLng(lat1, lon1),
             map: map,
             icon: "{{ green_dot }}",
-            title: "{{ ticket.flight.origin.city }}" });
+            title: "{{ ticket.origin_city.name }}" });
     {% endif %}
     new google.maps.Polyline( {
         geodesic: true,
@@ -35,7 +35,7 @@ function draw_polylines(map) {
         new google.maps.Marker({
             position: new google.maps.LatLng(lat2, lon2),
             map: map,
-            title: "{{ ticket.flight.destination.city }}",
+            title: "{{ ticket.destination_city.name }}",
             icon: "{{ gold_star }}" });
     {% endif %}
     {% endfor %}
@@ -19,6 +19,44 @@ airport.websocket_handlers = {
         airport.update_games_menu(data.games);
     },
 
+    game_progress: function (data) {
+        airport.progress = airport.progress || new airport.LightBox('#lightbox_content');
+        airport.progress.content.html(Mustache.render($('#game_progress').html(), data));
+        airport.progress.show();
+    },
+
+    game_created: function (data) {
+        if (airport.pending_game !== data.id) {
+            return;
+        }
+        airport.pending_game = null;
+        if (airport.progress) {
+            airport.progress.hide();
+            airport.progress = null;
+        }
+        $.ajax({
+            type: 'GET',
+            success: airport.refresh_ui,
+            url: '{% url "info" %}'
+        });
+    },
+
+    game_failed: function (data) {
+        if (airport.pending_game !== data.game) {
+            return;
+        }
+        airport.pending_game = null;
+        if (airport.progress) {
+            airport.progress.hide();
+            airport.progress = null;
+        }
+        $.ajax({
+            type: 'GET',
+            success: airport.refresh_ui,
+            url: '{% url "info" %}'
+        });
+    },
+
     join_game: function () {
         window.location.replace('{% url "main" %}');
     }
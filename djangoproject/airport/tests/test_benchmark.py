@@ -0,0 +1,91 @@
+from unittest.mock import patch
+
+from django.core import management
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase, TestCase
+
+from airport import benchmark
+
+
+class RunTest(TestCase):
+    def test_run(self):
+        # when we run some of the benchmarks
+        results = benchmark.run(['take_turn', 'games_stats'], repeat=2)
+
+        # then we get their times and query counts
+        self.assertEqual(list(results), ['take_turn', 'games_stats'])
+        for result in results.values():
+            self.assertTrue(result['seconds'] > 0)
+            self.assertTrue(result['queries'] > 0)
+
+    def test_benchmarks(self):
+        # the hot paths all have benchmarks
+        for name in (
+            'create_game.15',
+            'create_game.50',
+            'create_game.150',
+            'take_turn',
+            'player_info',
+            'games_info',
+            'games_stats',
+            'game_summary',
+            'broadcast',
+            'wrench.TailWind',
+        ):
+            self.assertTrue(name in benchmark.BENCHMARKS, name)
+
+        # but not the wrench that does nothing
+        self.assertFalse('wrench.MonkeyWrench' in benchmark.BENCHMARKS)
+
+    def test_wrench_gets_new_game(self):
+        # given the wrench benchmark
+        fixture = benchmark.Fixture()
+        prepare = benchmark.BENCHMARKS['wrench.CancelledFlight']
+
+        # when it is prepared twice
+        with patch('airport.lib.send_message'):
+            first = prepare(fixture).__self__.game
+            second = prepare(fixture).__self__.game
+
+        # then each throw gets its own game
+        self.assertNotEqual(first, second)
+
+
+class CommandTest(SimpleTestCase):
+    def test_no_baseline(self):
+        # when we compare against a baseline that doesn't exist
+        # then the command fails
+        with self.assertRaises(CommandError):
+            management.call_command('benchmark', baseline='/nonexistent.json')
+
+
+class CompareTest(SimpleTestCase):
+    baseline = {
+        'take_turn': {'seconds': 0.5, 'queries': 100},
+        'broadcast': {'seconds': 0.001, 'queries': 8},
+    }
+
+    def test_within_threshold(self):
+        # given the results within the threshold of the baseline
+        results = {'take_turn': {'seconds': 0.6, 'queries': 110}}
+
+        # then there are no regressions
+        self.assertEqual(benchmark.compare(results, self.baseline, 0.25), [])
+
+    def test_regressions(self):
+        # given the results worse than the baseline
+        results = {
+            'take_turn': {'seconds': 0.7, 'queries': 200},
+            'broadcast': {'seconds': 0.002, 'queries': 8},
+            'new': {'seconds': 1, 'queries': 1},
+        }
+
+        # when we compare them
+        regressions = benchmark.compare(results, self.baseline, 0.25)
+
+        # then we get the regressions (small differences in time are noise
+        # and new benchmarks have nothing to compare to)
+        self.assertEqual(
+            regressions,
+            [('take_turn', 'seconds', 0.5, 0.7), ('take_turn', 'queries', 100, 200)],
+        )
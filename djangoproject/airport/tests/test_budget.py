@@ -0,0 +1,156 @@
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.test import RequestFactory
+
+from airport import budget, lib, models
+from airport.conf import settings
+from airport.simulation import Simulation
+from airport.tests import BaseTestCase
+
+
+def make_queries(count):
+    for i in range(count):
+        User.objects.filter(pk=i).exists()
+
+
+class QueryBudgetTest(BaseTestCase):
+    @patch.object(settings, 'QUERY_BUDGETS', budget.ENFORCE)
+    def test_within_budget(self):
+        with budget.query_budget('test', 3):
+            make_queries(3)
+
+    @patch.object(settings, 'QUERY_BUDGETS', budget.ENFORCE)
+    def test_enforce(self):
+        # when a block goes over its budget
+        with self.assertRaises(budget.QueryBudgetExceeded) as context:
+            with budget.query_budget('test', 3):
+                make_queries(4)
+
+        # then the exception has the queries made
+        error = context.exception
+        self.assertEqual(error.name, 'test')
+        self.assertEqual(error.limit, 3)
+        self.assertEqual(len(error.queries), 4)
+
+        # and the report groups them
+        self.assertTrue('test exceeded: 4 > 3' in str(error))
+        self.assertTrue('    4 x ' in str(error))
+
+    @patch('airport.budget.logger')
+    @patch.object(settings, 'QUERY_BUDGETS', budget.LOG)
+    def test_log(self, logger):
+        # when a block goes over its budget in "log" mode
+        with budget.query_budget('test', 3):
+            make_queries(4)
+
+        # then it is logged rather than raised
+        self.assertEqual(logger.warning.call_count, 1)
+        self.assertTrue('test exceeded' in logger.warning.call_args[0][0])
+
+    @patch('airport.budget.logger')
+    @patch.object(settings, 'QUERY_BUDGETS', None)
+    def test_off(self, logger):
+        # when budgets aren't checked, nothing happens
+        with budget.query_budget('test', 0):
+            make_queries(1)
+
+        self.assertEqual(logger.warning.call_count, 0)
+
+    @patch.object(settings, 'QUERY_BUDGETS', budget.ENFORCE)
+    def test_per_game(self):
+        # given a function budgeted by the size of its game
+        @budget.query_budget('test', budget.per_game(1, airports=1))
+        def func(game, count):
+            make_queries(count)
+
+        airports = self.game.airports.count()
+
+        # then the budget grows with the game
+        func(self.game, airports + 1)
+        with self.assertRaises(budget.QueryBudgetExceeded) as context:
+            func(self.game, airports + 2)
+        self.assertEqual(context.exception.limit, airports + 1)
+
+    def test_per_game_flights(self):
+        # given the game with flights, some of them arrived
+        self.game.begin()
+        with patch('airport.lib.send_message'):
+            lib.take_turn(self.game)
+        flights = models.Flight.objects.filter(game=self.game)
+        flights.filter(pk=flights[0].pk).update(state='Arrived')
+        scheduled = flights.exclude(state='Arrived').count()
+
+        # then the limit counts the flights that haven't arrived
+        limit = budget.per_game(10, flights=2)
+        self.assertEqual(limit(self.game), 10 + 2 * scheduled)
+
+    def test_per_game_request(self):
+        # given a view budgeted by the size of the requesting player's game
+        limit = budget.per_game(5, players=1, game=budget.request_game)
+        request = RequestFactory().get('/')
+        request.user = self.player.user
+        players = self.game.players.distinct().count()
+
+        # then the limit grows with the player's game
+        self.assertEqual(limit(request), 5 + players)
+
+        # and is the base when the player isn't in a game
+        request.user = User.objects.create_user(username='lobby', password='test')
+        models.Player.objects.create(user=request.user)
+        self.assertEqual(limit(request), 5)
+
+    @patch.object(settings, 'QUERY_BUDGETS', budget.ENFORCE)
+    def test_nested_limit_queries(self):
+        # given a block nested in another, with a limit that makes queries
+        def limit():
+            make_queries(5)
+            return 1
+
+        # when both blocks make one query
+        with budget.query_budget('outer', 2):
+            with budget.query_budget('inner', limit):
+                make_queries(1)
+            make_queries(1)
+
+        # then the inner limit's queries don't count against the outer block
+
+
+class HotPathsTest(BaseTestCase):
+
+    """The budgeted views and game loop phases stay within their budgets"""
+
+    def setUp(self):
+        self.player, self.player2 = self.create_players(2)
+
+    @patch.object(settings, 'QUERY_BUDGETS', budget.ENFORCE)
+    def test_game_loop(self):
+        # flights pile up as the game goes on so the smaller game is played
+        # for longer
+        for airports, hours in ((15, 3), (40, 1)):
+            simulation = Simulation(
+                airports=airports, players=2, ai=True, wrenches=True, seed=1
+            )
+            simulation.run(hours)
+            simulation.teardown()
+
+    @patch('airport.lib.send_message')
+    @patch.object(settings, 'QUERY_BUDGETS', budget.ENFORCE)
+    def test_views(self, send_message):
+        self.client.login(username=self.player.username, password='test')
+        self.client.get(reverse('games_info'))
+
+        for airports in (15, 40):
+            game = models.Game.objects.create_game(
+                host=self.player, goals=3, airports=airports
+            )
+            game.add_player(self.player2)
+            game.begin()
+            flight = self.player.airport.next_flights(game.time)[0]
+
+            self.client.get(reverse('info'))
+            self.client.post(reverse('info'), {'selected': flight.pk})
+            self.client.get(reverse('games_info'))
+            self.client.get(reverse('messages'))
+            game.end()
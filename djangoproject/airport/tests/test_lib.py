@@ -3,20 +3,24 @@ Tests for the airport app
 """
 import datetime
 import json
+import random
+from io import StringIO
 from unittest.mock import Mock, call, patch
 
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core import management
 from django.core.urlresolvers import reverse
+from django.db import OperationalError
 from django.test import TestCase
 from tornado import gen
-from tornado.concurrent import Future
+from tornado.concurrent import Future, dummy_executor
 from tornado.testing import AsyncHTTPTestCase, gen_test
 from tornado.web import Application
 from tornado.websocket import WebSocketHandler, websocket_connect
 
-from airport import lib
+from airport import lib, metrics
 from airport import models as db
 from airport.tests import BaseTestCase
 
@@ -87,17 +91,18 @@ class TakeTurn(BaseTestCase):
         # then nothing happens
         self.assertEqual(now, new_now)
 
-    def test_throw_wrench(self, mock_send_msg):
+    @patch('airport.lib.throw_monkey_wrench')
+    def test_throw_wrench(self, mock_throw, mock_send_msg):
         # given the game in progress
         game = self.game
         game.begin()
 
         # when we call take_turnw(throw_wrench=True)
-        lib.take_turn(game, throw_wrench=True)
+        rng = random.Random(1)
+        lib.take_turn(game, throw_wrench=True, rng=rng)
 
-        # then a message to throw a wrench is sent
-        expected = call.send_message('throw_wrench', game.pk)
-        mock_send_msg.assert_has_calls([expected])
+        # then a wrench is thrown with the given random number generator
+        mock_throw.assert_called_with(game.pk, rng)
 
     @patch('airport.lib.handle_flights')
     def test_handles_flights(self, mock_handle_flights, mock_send_msg):
@@ -136,6 +141,58 @@ class TakeTurn(BaseTestCase):
         self.assertGreater(game_time, now)
 
 
+class PlayTurnTestCase(BaseTestCase):
+
+    """tests for lib.play_turn()"""
+
+    def setUp(self):
+        super(PlayTurnTestCase, self).setUp()
+        self.game.begin()
+
+    @patch('airport.lib.IPCHandler.send_message')
+    def test_messages_held_until_commit(self, ipc_send):
+        def take_turn(game, throw_wrench, rng):
+            lib.send_message('throw_wrench', game.pk)
+            # nothing is sent until the turn is done
+            self.assertFalse(ipc_send.called)
+            return game.time
+
+        with patch('airport.lib.take_turn', side_effect=take_turn):
+            game, now = lib.play_turn(self.game.pk)
+
+        self.assertEqual(game, self.game)
+        ipc_send.assert_called_once_with('throw_wrench', self.game.pk)
+
+    @patch.object(lib.settings, 'TURN_RETRY_DELAY', 0)
+    @patch('airport.lib.IPCHandler.send_message')
+    def test_retries_when_locked(self, ipc_send):
+        attempts = []
+
+        def take_turn(game, throw_wrench, rng):
+            attempts.append(game)
+            lib.send_message('throw_wrench', game.pk)
+            if len(attempts) == 1:
+                raise OperationalError('database is locked')
+            return game.time
+
+        with patch('airport.lib.take_turn', side_effect=take_turn):
+            lib.play_turn(self.game.pk)
+
+        # then the turn is retried and the first attempt's messages dropped
+        self.assertEqual(len(attempts), 2)
+        ipc_send.assert_called_once_with('throw_wrench', self.game.pk)
+
+    @patch('airport.lib.IPCHandler.send_message')
+    def test_other_errors_raised(self, ipc_send):
+        error = OperationalError('no such table')
+
+        with patch('airport.lib.take_turn', side_effect=error):
+            with self.assertRaises(OperationalError):
+                lib.play_turn(self.game.pk)
+
+        self.assertFalse(ipc_send.called)
+
+
 @patch('airport.lib.IPCHandler.send_message')
 class HandleFlightsTestCase(BaseTestCase):
 
@@ -610,6 +667,100 @@ class GameResumeTestCase(BaseTestCase):
         self.assertEqual(info_calls, expected)
 
 
+@patch('airport.lib.IOLoop')
+class BuildGameTestCase(BaseTestCase):
+
+    """tests for the build_game() function"""
+
+    def setUp(self):
+        super().setUp()
+        self.game.end()
+
+    def test_builds_game(self, mock_ioloop):
+        # given the pending game
+        game = db.Game.objects.create_pending_game(self.player)
+
+        # when we call build_game()
+        data = {'game': game.pk, 'goals': 2, 'airports': 10, 'ai_player': True}
+        lib.build_game(data)
+
+        # then the game is ready to play
+        game = db.Game.objects.get(pk=game.pk)
+        self.assertEqual(game.state, game.NOT_STARTED)
+        self.assertEqual(game.airports.count(), 10)
+        self.assertEqual(game.goals.count(), 2)
+        self.assertTrue(game.players.filter(ai_player=True).exists())
+
+    def test_sends_progress_and_game_created(self, mock_ioloop):
+        # given the pending game
+        game = db.Game.objects.create_pending_game(self.player)
+
+        # when we call build_game()
+        data = {'game': game.pk, 'goals': 1, 'airports': 10, 'ai_player': False}
+        game = lib.build_game(data)
+
+        # then the host is sent progress and the lobby is told about the game
+        add_callback = mock_ioloop.instance.return_value.add_callback
+        progress = {'game': game.pk, 'stage': 'done', 'percent': 100}
+        add_callback.assert_any_call(
+            lib.SocketHandler.message, self.player.user, 'game_progress', progress
+        )
+        add_callback.assert_any_call(
+            lib.SocketHandler.broadcast, 'game_created', game.info()
+        )
+
+    @patch('airport.lib.models.Game.objects.build_game')
+    def test_failure_deletes_game(self, mock_build_game, mock_ioloop):
+        # given the pending game
+        game = db.Game.objects.create_pending_game(self.player)
+
+        # when building the game fails
+        mock_build_game.side_effect = ValueError
+        data = {'game': game.pk, 'goals': 1, 'airports': 10, 'ai_player': False}
+        with patch('airport.lib.logger'):
+            result = lib.build_game(data)
+
+        # then the pending game is removed
+        self.assertEqual(result, None)
+        self.assertFalse(db.Game.objects.filter(pk=game.pk).exists())
+
+        # and the host is told
+        add_callback = mock_ioloop.instance.return_value.add_callback
+        add_callback.assert_any_call(
+            lib.SocketHandler.message,
+            self.player.user,
+            'game_failed',
+            {'game': data['game']},
+        )
+
+    def test_pending_game_gone(self, mock_ioloop):
+        # given the pending game that has since been deleted
+        game = db.Game.objects.create_pending_game(self.player)
+        game_id = game.pk
+        game.delete()
+
+        # when we call build_game()
+        data = {
+            'game': game_id,
+            'host': self.player.pk,
+            'goals': 1,
+            'airports': 10,
+            'ai_player': False,
+        }
+        with patch('airport.lib.logger'):
+            result = lib.build_game(data)
+
+        # then the host is told it failed
+        self.assertEqual(result, None)
+        add_callback = mock_ioloop.instance.return_value.add_callback
+        add_callback.assert_any_call(
+            lib.SocketHandler.message,
+            self.player.user,
+            'game_failed',
+            {'game': game_id},
+        )
+
+
 @patch('airport.lib.IPCHandler.send_message')
 class SendMessageTestCase(TestCase):
 
@@ -639,7 +790,8 @@ class TestWebSocketHandler(WebSocketHandler):
 
 
 class TestSocketHandler(TestWebSocketHandler, lib.SocketHandler):
-    pass
+    # run the database work inline so it sees the test transaction
+    executor = dummy_executor
 
 
 class SocketHandlerTest(WebSocketBaseTestCase, TestCase):
@@ -714,6 +866,11 @@ class SocketHandlerTest(WebSocketBaseTestCase, TestCase):
         # then the message gets sent to the one connection
         self.assertEqual(result, 1)
 
+        # which has the user and player pinned
+        client = TestSocketHandler.clients[0]
+        self.assertEqual(client.user_id, user.pk)
+        self.assertEqual(client.player_id, player.pk)
+
         # and we can read the message
         result = yield ws.read_message()
         result = json.loads(result)
@@ -722,6 +879,28 @@ class SocketHandlerTest(WebSocketBaseTestCase, TestCase):
 
         yield self.close(ws)
 
+    @gen_test
+    def test_message_by_username(self):
+        # given the player with a websocket connection
+        user = self.player.user
+
+        with patch('airport.lib.SocketHandler.get_current_user') as gcu:
+            gcu.return_value = user
+            ws = yield self.ws_connect('/')
+
+        # when we send a message to the username
+        with self.assertNumQueries(0):
+            result = TestSocketHandler.message(
+                user.username, 'player_message', 'test'
+            )
+
+        # then it's sent to the connection without looking up the user
+        self.assertEqual(result, 1)
+        result = yield ws.read_message()
+        self.assertEqual(json.loads(result)['data'], 'test')
+
+        yield self.close(ws)
+
     @gen_test
     def test_broadcast(self):
         # given the player with a websocket connection
@@ -754,10 +933,14 @@ class SocketHandlerTest(WebSocketBaseTestCase, TestCase):
         with patch('airport.lib.SocketHandler.get_current_user') as gcu:
             gcu.return_value = player.user
             ws = yield self.ws_connect('/')
+        metrics.reset()
         TestSocketHandler.games_info()
 
         # then the client is sent game infos
         result = yield ws.read_message()
+
+        # and only the sending holds up the IOLoop
+        self.assertEqual(metrics.get('ioloop.blocked.count'), 1)
         result = json.loads(result)
         expected = {
             'data': {
@@ -800,6 +983,31 @@ class SocketHandlerTest(WebSocketBaseTestCase, TestCase):
         # then we get the user
         self.assertEqual(user, self.player.user)
 
+    def test_get_current_user_cached(self):
+        # given the logged in client whose user has been looked up
+        self.client.login(username=self.player.username, password='test')
+        session_id = self.client.cookies['sessionid'].value
+        lib.get_user_from_session_id(session_id)
+
+        # when we look up the user again
+        with self.assertNumQueries(1):
+            user = lib.get_user_from_session_id(session_id)
+
+        # then the session isn't read again
+        self.assertEqual(user, self.player.user)
+
+    def test_logout_forgets_session(self):
+        # given the logged in client whose user has been looked up
+        self.client.login(username=self.player.username, password='test')
+        session_id = self.client.cookies['sessionid'].value
+        lib.get_user_from_session_id(session_id)
+
+        # when the client logs out
+        self.client.logout()
+
+        # then the session's user is no longer cached
+        self.assertEqual(cache.get(lib.session_cache_key(session_id)), None)
+
     def test_get_current_user_no_session(self):
         # given the user who hasn't logged in
         self.client.get('/')
@@ -835,13 +1043,18 @@ class SocketHandlerTest(WebSocketBaseTestCase, TestCase):
 
 
 class TestIPCHandler(TestWebSocketHandler, lib.IPCHandler):
-    pass
+    # run the handlers' database work inline so it sees the test transaction
+    executor = dummy_executor
+    builder = dummy_executor
 
 
 class IPCHandlerTest(WebSocketBaseTestCase, TestCase):
     def setUp(self):
         super().setUp()
         self.player = BaseTestCase.create_players(1)[0]
+        patcher = patch.object(lib.SocketHandler, 'executor', dummy_executor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
     def _send_message(self, message_type, data):
 
@@ -901,11 +1114,27 @@ class IPCHandlerTest(WebSocketBaseTestCase, TestCase):
 
         # then it (attempts to) send a message to the user
         mock_ws_msg.assert_called_with(
-            self.player.user,
+            self.player.username,
             'info',
             {'player': self.player.username, 'data': {'this': 'is', 'a': 'test'}},
         )
 
+    @patch('airport.lib.SocketHandler.message')
+    @gen_test
+    def test_handler_time_is_recorded(self, mock_ws_msg):
+        # given the metrics
+        metrics.reset()
+
+        # when we send a message to ipc
+        message = self.message('info', {'player': self.player.username})
+        ws = yield self.ws_connect('/ipc')
+        ws.write_message(message)
+        yield self.close(ws)
+
+        # then the time the handler blocked the IOLoop is recorded
+        self.assertEqual(metrics.get('ioloop.blocked.count'), 1)
+        self.assertTrue(metrics.get('ioloop.blocked.max') >= 0)
+
     @patch('airport.lib.SocketHandler.message')
     @gen_test
     def test_handle_start_game(self, mock_ws_msg):
@@ -938,6 +1167,22 @@ class IPCHandlerTest(WebSocketBaseTestCase, TestCase):
         # then it sends a games_info() message to all the players
         mock_ws_games_info.assert_called()
 
+    @patch('airport.lib.build_game')
+    @gen_test
+    def test_handle_create_game(self, mock_build_game):
+        # given the pending game
+        game = db.Game.objects.create_pending_game(self.player)
+
+        # when we send a create_game message to the ipc
+        data = {'game': game.pk, 'goals': 1, 'airports': 10, 'ai_player': True}
+        message = self.message('create_game', data)
+        ws = yield self.ws_connect('/ipc')
+        ws.write_message(message)
+        yield self.close(ws)
+
+        # then the game is built in the background
+        mock_build_game.assert_called_with(data)
+
     @patch('airport.lib.SocketHandler.games_info')
     @gen_test
     def test_handle_game_ended(self, mock_ws_games_info):
@@ -1012,6 +1257,7 @@ class IPCHandlerTest(WebSocketBaseTestCase, TestCase):
         # then it sends a broadcast() message to all the players
         mock_broadcast.assert_called_with('wall', 'Hello world!')
 
+    @patch.object(lib, 'wrench_requests', lib.WrenchRequests())
     @patch('airport.monkeywrench.MonkeyWrenchFactory.create')
     @gen_test
     def test_handle_throw_wrench(self, mock_mwf):
@@ -1025,6 +1271,26 @@ class IPCHandlerTest(WebSocketBaseTestCase, TestCase):
         ws.write_message(message)
         yield self.close(ws)
 
+        # then the request is left for the game loop
+        self.assertFalse(mock_mwf.called)
+        self.assertTrue(game.pk in lib.wrench_requests.take())
+
+    @patch.object(lib.settings, 'GAMESERVER_MULTIPROCESSING', True)
+    @patch.object(lib, 'wrench_requests', lib.WrenchRequests())
+    @patch('airport.monkeywrench.MonkeyWrenchFactory.create')
+    @gen_test
+    def test_handle_throw_wrench_multiprocessing(self, mock_mwf):
+        # given the game
+        game = BaseTestCase.create_game(self.player)
+        game.begin()
+
+        # when we send a throw_wrench message to the ipc (and the game loop
+        # is in another process)
+        message = self.message('throw_wrench', game.pk)
+        ws = yield self.ws_connect('/ipc')
+        ws.write_message(message)
+        yield self.close(ws)
+
         # then it raises a monkey wrench in the game
         mock_mwf.assert_called_with(game)
         throw = call().throw()
@@ -1060,7 +1326,259 @@ class IPCHandlerTest(WebSocketBaseTestCase, TestCase):
 
         # then it attempt to send the message to the player via the websocket
         # handler
-        mock_ws_msg.assert_called_with(player.user, 'message', 'Hello player!')
+        mock_ws_msg.assert_called_with(player.username, 'message', 'Hello player!')
+
+
+class FillPoolTestCase(BaseTestCase):
+
+    """tests for GameThread.fill_pool()"""
+
+    @patch.object(lib.settings, 'GAME_POOL_SIZE', 1)
+    @patch.object(lib.settings, 'GAME_POOL_PRESETS', ((10, 1), (12, 1)))
+    def test_fills_pool(self):
+        # when we fill the pool
+        first = lib.GameThread.fill_pool()
+        second = lib.GameThread.fill_pool()
+        third = lib.GameThread.fill_pool()
+
+        # then a world is built for each preset until the pool is full
+        self.assertEqual(first.airports.count(), 10)
+        self.assertEqual(second.airports.count(), 12)
+        self.assertEqual(third, None)
+
+
+class WrenchSchedulerTestCase(BaseTestCase):
+
+    """tests for the WrenchScheduler"""
+
+    def test_tick(self):
+        # given the scheduler
+        scheduler = lib.WrenchScheduler(seed=1)
+
+        # when the game is first seen
+        due = scheduler.tick([self.game], now=0)
+
+        # then it's scheduled but not yet due
+        self.assertEqual(due, set())
+        when = scheduler.next_throw[self.game.pk]
+
+        # and when its time comes it gets a wrench and is rescheduled
+        due = scheduler.tick([self.game], now=when)
+        self.assertEqual(due, {self.game.pk})
+        self.assertTrue(scheduler.next_throw[self.game.pk] > when)
+
+    def test_seed(self):
+        # given two schedulers with the same seed
+        first = lib.WrenchScheduler(seed=42)
+        second = lib.WrenchScheduler(seed=42)
+
+        # when they schedule the game
+        first.tick([self.game], now=0)
+        second.tick([self.game], now=0)
+
+        # then they schedule the same throw
+        self.assertEqual(first.next_throw, second.next_throw)
+
+    def test_scales_with_airports(self):
+        # given the scheduler scaled to games twice the size of ours
+        scheduler = lib.WrenchScheduler(seed=1)
+        airports = self.game.airports.count()
+
+        # when we get the waits
+        with patch.object(lib.settings, 'WRENCH_SCALE_AIRPORTS', airports * 2):
+            waits = [scheduler.wait(self.game) for i in range(20)]
+
+        # then they're up to twice as long
+        max_wait = lib.settings.MAX_TIME_BETWEEN_WRENCHES
+        self.assertTrue(max(waits) > max_wait)
+        self.assertTrue(max(waits) <= max_wait * 2)
+
+    def test_closed_game_dropped(self):
+        # given the scheduled game
+        scheduler = lib.WrenchScheduler(seed=1)
+        scheduler.tick([self.game], now=0)
+        when = scheduler.next_throw[self.game.pk]
+
+        # when its time comes but the game is no longer open
+        due = scheduler.tick([], now=when)
+
+        # then it doesn't get a wrench and is dropped
+        self.assertEqual(due, set())
+        self.assertEqual(scheduler.next_throw, {})
+
+
+class WrenchRequestsTestCase(TestCase):
+
+    """tests for the WrenchRequests"""
+
+    @patch.object(lib.settings, 'WRENCH_COALESCE_WINDOW', 10)
+    def test_coalesces(self):
+        # given the many requests for a game
+        requests = lib.WrenchRequests()
+        for i in range(5):
+            requests.add(1)
+
+        # when the game loop takes them
+        due = requests.take(now=100)
+
+        # then the game gets one wrench
+        self.assertEqual(due, {1})
+        self.assertEqual(requests.take(now=100), set())
+
+        # and further requests wait for the window to pass
+        requests.add(1)
+        self.assertEqual(requests.take(now=105), set())
+        self.assertEqual(requests.take(now=110), {1})
+
+
+@patch('airport.lib.send_message')
+class ReapGamesTestCase(BaseTestCase):
+
+    """tests for lib.reap_games()"""
+
+    def age(self, game, **kwargs):
+        """Make *game* look older"""
+        past = datetime.datetime.now() - datetime.timedelta(**kwargs)
+        db.Game.objects.filter(pk=game.pk).update(creation_time=past)
+        return db.Game.objects.get(pk=game.pk)
+
+    def test_active_games_not_reaped(self, send_message):
+        # given the game in progress
+        lib.start_game(self.game)
+
+        # when we reap games
+        reaped = lib.reap_games()
+
+        # then it is left alone
+        self.assertEqual(reaped, [])
+        self.assertEqual(metrics.get('games.open'), 1)
+
+    def test_paused_too_long(self, send_message):
+        # given the game that was paused a long time ago
+        lib.start_game(self.game)
+        self.game.pause()
+        past = datetime.datetime.now() - datetime.timedelta(hours=13)
+        db.Game.objects.filter(pk=self.game.pk).update(pausestamp=past)
+
+        # when we reap games
+        reaped = lib.reap_games()
+
+        # then the game is ended
+        self.assertEqual(reaped, [self.game])
+        game = db.Game.objects.get(pk=self.game.pk)
+        self.assertEqual(game.state, game.GAME_OVER)
+        send_message.assert_any_call('game_ended', game.pk)
+
+    def test_never_started(self, send_message):
+        # given the game that was created long ago but never started
+        self.age(self.game, hours=7)
+
+        # when we reap games
+        reaped = lib.reap_games()
+
+        # then the game is ended
+        self.assertEqual(reaped, [self.game])
+
+    def test_host_left(self, send_message):
+        # given the game whose host has left but another player is waiting
+        user = User.objects.create_user(username='user2', password='test')
+        self.game.add_player(db.Player.objects.create(user=user))
+        self.game.remove_player(self.player)
+
+        # then it is reaped
+        stale = db.Game.objects.stale_games()
+        self.assertEqual(stale, [(self.game, 'host left')])
+
+    def test_no_humans(self, send_message):
+        # given the game with only the AI player left
+        lib.start_game(self.game)
+        self.game.remove_player(self.player)
+
+        # then it isn't reaped right away
+        self.assertEqual(db.Game.objects.stale_games(), [])
+
+        # but it is after REAP_NO_HUMANS_AFTER minutes
+        later = datetime.datetime.now() + datetime.timedelta(minutes=61)
+        stale = db.Game.objects.stale_games(later)
+        self.assertEqual(stale, [(self.game, 'no human players')])
+
+    @patch.object(lib.settings, 'REAP_NO_HUMANS_AFTER', None)
+    def test_no_humans_disabled(self, send_message):
+        # given the AI-only game
+        lib.start_game(self.game)
+        self.game.remove_player(self.player)
+
+        # when the threshold is disabled then it's never reaped
+        later = datetime.datetime.now() + datetime.timedelta(days=7)
+        self.assertEqual(db.Game.objects.stale_games(later), [])
+
+    def test_idle(self, send_message):
+        # given the game in progress
+        lib.start_game(self.game)
+
+        # when the human player hasn't done anything for REAP_IDLE_AFTER
+        # minutes then it is reaped
+        later = datetime.datetime.now() + datetime.timedelta(hours=3, minutes=1)
+        stale = db.Game.objects.stale_games(later)
+        self.assertEqual(stale, [(self.game, 'idle')])
+
+        # but not if they bought a ticket in the meantime
+        flight = self.player.airport.next_flights(self.game.time)[0]
+        db.Purchase.objects.create(
+            player=self.player, game=self.game, flight=flight
+        )
+        db.Purchase.objects.update(
+            creation_time=later - datetime.timedelta(minutes=10)
+        )
+        self.assertEqual(db.Game.objects.stale_games(later), [])
+
+    def test_never_built(self, send_message):
+        # given the game that started being created long ago
+        self.game.end()
+        game = db.Game.objects.create_pending_game(self.player)
+        game = self.age(game, hours=1)
+
+        # when we reap games
+        reaped = lib.reap_games()
+
+        # then the game is deleted
+        self.assertEqual(len(reaped), 1)
+        self.assertFalse(db.Game.objects.filter(pk=game.pk).exists())
+
+    @patch.object(lib.settings, 'REAP_NOT_STARTED_AFTER', None)
+    def test_disabled_threshold(self, send_message):
+        # given the game that was created long ago but never started
+        self.age(self.game, hours=7)
+
+        # when the threshold is disabled then it's not reaped
+        self.assertEqual(lib.reap_games(), [])
+
+
+@patch('airport.lib.send_message')
+class ArchiveGamesTestCase(BaseTestCase):
+
+    """tests for lib.archive_games()"""
+
+    def test_archives_games_that_ended_a_while_ago(self, send_message):
+        # given the game that ended
+        self.game.end()
+
+        # when we archive games right away
+        # then it isn't archived
+        self.assertEqual(lib.archive_games(), [])
+
+        # but when we archive them later, it is
+        later = datetime.datetime.now() + datetime.timedelta(hours=2)
+        archived = lib.archive_games(later)
+        self.assertEqual(archived, [self.game])
+        self.assertTrue(db.Game.objects.get(pk=self.game.pk).archived)
+
+    @patch.object(lib.settings, 'ARCHIVE_AFTER', None)
+    def test_disabled(self, send_message):
+        self.game.end()
+        later = datetime.datetime.now() + datetime.timedelta(hours=2)
+
+        self.assertEqual(lib.archive_games(later), [])
 
 
 class GameServerTest(BaseTestCase):
@@ -1188,3 +1706,35 @@ class GameServerTest(BaseTestCase):
         self.assertEqual(game.host, self.player)
         self.assertEqual(game.airports.count(), num_airports)
         self.assertEqual(game.goals.count(), num_goals)
+
+    @patch('airport.lib.send_message')
+    def test_reap(self, send_message):
+        # given the game that was paused a long time ago
+        lib.start_game(self.game)
+        self.game.pause()
+        past = datetime.datetime.now() - datetime.timedelta(days=1)
+        db.Game.objects.filter(pk=self.game.pk).update(pausestamp=past)
+
+        # when we call the reap command
+        out = StringIO()
+        management.call_command('gameserver', reap=True, stdout=out)
+
+        # then the game is ended
+        game = db.Game.objects.get(pk=self.game.pk)
+        self.assertEqual(game.state, game.GAME_OVER)
+        self.assertEqual(out.getvalue(), 'Reaped {0}.\n'.format(game))
+
+    def test_compact(self):
+        # given the player with read messages of an ended game
+        db.Message.objects.broadcast('Hello', self.game)
+        db.Message.objects.update(read=True)
+
+        # when we call the compact command
+        out = StringIO()
+        with patch.object(lib.settings, 'MESSAGE_GAME_TTL', 0):
+            self.game.end()
+            management.call_command('gameserver', compact=True, stdout=out)
+
+        # then the messages are deleted
+        self.assertFalse(db.Message.objects.filter(game=self.game).exists())
+        self.assertTrue(out.getvalue().startswith('Deleted'))
@@ -2,14 +2,16 @@ import datetime
 import json
 import random
 import time
-from unittest.mock import call, patch
+from unittest.mock import ANY, call, patch
 
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.core.urlresolvers import reverse
+from django.db import connection
 from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 
-from airport import lib, models
+from airport import lib, models, routing
 from airport.conf import settings
 from airport.tests import BaseTestCase
 
@@ -258,6 +260,484 @@ class GameManagerTest(TransactionTestCase):
 
         self.assertEqual(game.airports.count(), 10)
 
+    def test_create_game_with_start_not_duplicated(self):
+        player = BaseTestCase.create_players(1)[0]
+        start = models.AirportMaster.objects.all()[0]
+
+        game = models.Game.objects.create_game(
+            host=player, goals=1, airports=100, start=start
+        )
+
+        codes = game.airports.values_list('master__code', flat=True)
+        self.assertEqual(len(set(codes)), len(codes))
+
+    def test_create_pending_game(self):
+        # given the player
+        player = BaseTestCase.create_players(1)[0]
+
+        # when we create a pending game
+        game = models.Game.objects.create_pending_game(player)
+
+        # then it is in the CREATING state and has no world
+        self.assertEqual(game.state, game.CREATING)
+        self.assertEqual(game.host, player)
+        self.assertFalse(game.airports.exists())
+
+        # and it isn't an open game
+        self.assertFalse(models.Game.open_games().filter(pk=game.pk).exists())
+        self.assertEqual(models.Game.games_info(), [])
+
+    def test_build_game(self):
+        # given the pending game
+        player = BaseTestCase.create_players(1)[0]
+        game = models.Game.objects.create_pending_game(player)
+        stages = []
+
+        # when we build it
+        game = models.Game.objects.build_game(
+            game, goals=2, airports=10, progress=lambda *args: stages.append(args)
+        )
+
+        # then the world is built and the game can be started
+        self.assertEqual(game.state, game.NOT_STARTED)
+        self.assertEqual(game.airports.count(), 10)
+        self.assertEqual(game.goals.count(), 2)
+        self.assertTrue(player.is_playing(game))
+
+        # and the progress was reported
+        self.assertEqual(stages[-1], ('done', 100))
+
+
+class DirtyFieldsTest(BaseTestCase):
+    def test_no_op_save(self):
+        # given the freshly loaded player
+        player = models.Player.objects.get(pk=self.player.pk)
+
+        # when we save it without changing anything
+        # then nothing is written
+        with self.assertNumQueries(0):
+            player.save()
+
+    def test_only_changed_fields_saved(self):
+        # given the freshly loaded flight
+        airport = self.game.start_airport
+        flight = airport.next_flights(self.game.time)[0]
+        flight = models.Flight.objects.get(pk=flight.pk)
+
+        # when we change one field and save
+        flight.state = 'Delayed'
+        self.assertEqual(flight.dirty_fields(), ['state'])
+        with CaptureQueriesContext(connection) as context:
+            flight.save()
+
+        # then only that field is updated
+        self.assertEqual(len(context.captured_queries), 1)
+        sql = context.captured_queries[0]['sql']
+        self.assertIn('"state"', sql)
+        self.assertNotIn('"depart_time"', sql)
+        self.assertEqual(models.Flight.objects.get(pk=flight.pk).state, 'Delayed')
+
+        # and afterwards it's clean again
+        self.assertEqual(flight.dirty_fields(), [])
+
+    def test_update_fields_keeps_other_changes(self):
+        # given the game with an unsaved state change
+        game = models.Game.objects.get(pk=self.game.pk)
+        game.state = game.PAUSED
+
+        # when another field is saved on its own
+        game.archived = True
+        game.save(update_fields=['archived'])
+
+        # then the state change is still dirty
+        self.assertEqual(game.dirty_fields(), ['state'])
+
+        # and the next save writes it
+        game.save()
+        game = models.Game.objects.get(pk=self.game.pk)
+        self.assertEqual(game.state, game.PAUSED)
+        self.assertTrue(game.archived)
+
+    def test_refresh_fields(self):
+        # given the game with an unsaved state change
+        game = models.Game.objects.get(pk=self.game.pk)
+        game.state = game.PAUSED
+
+        # when another field is refreshed
+        game.refresh_from_db(fields=['archived'])
+
+        # then the state change is still dirty
+        self.assertEqual(game.dirty_fields(), ['state'])
+
+    @patch('airport.models.broadcast')
+    def test_achievement_broadcast(self, broadcast):
+        # given the player's achievement
+        self.game.begin()
+        ach = models.Achievement.objects.get(game=self.game, player=self.player)
+        ach = models.Achievement.objects.select_related(
+            'goal', 'player__user', 'game'
+        ).get(pk=ach.pk)
+
+        # when it's fulfilled then the old row isn't re-fetched to tell
+        with self.assertNumQueries(2):
+            ach.timestamp = self.game.time
+            ach.save()
+
+        # then the goal is broadcast (once)
+        ach.save()
+        self.assertEqual(broadcast.call_count, 1)
+
+
+class GameAchievementCountsTest(BaseTestCase):
+    def test_achievement_counts(self):
+        # given the game where the host has achieved a goal
+        game = self.game
+        game.begin()
+        ach = models.Achievement.objects.get(game=game, player=self.player)
+        ach.fulfill(game.time)
+        ai_player = game.players.get(ai_player=True)
+
+        # when we get the achievement counts
+        with self.assertNumQueries(1):
+            counts = game.achievement_counts()
+
+        # then we get the goals achieved for each player
+        expected = {
+            self.player.pk: {'username': 'user1', 'achieved': 1, 'goals': 1},
+            ai_player.pk: {'username': ai_player.username, 'achieved': 0, 'goals': 1},
+        }
+        self.assertEqual(counts, expected)
+
+        # which can be used for the stats and is_over() without more queries
+        with self.assertNumQueries(0):
+            stats = game.stats(counts)
+            is_over = game.is_over(counts)
+
+        self.assertEqual(stats, game.stats())
+        self.assertEqual(sorted(stats), [[ai_player.username, 0], ['user1', 1]])
+        self.assertFalse(is_over)
+
+    def test_is_over(self):
+        # given the game where all players have achieved all goals
+        game = self.game
+        game.begin()
+        for ach in models.Achievement.objects.filter(game=game):
+            ach.fulfill(game.time)
+
+        # then the game is over
+        self.assertTrue(game.is_over())
+
+    def test_is_over_no_players(self):
+        # given the game with no players
+        game = self.game
+        for player in game.players.distinct():
+            game.remove_player(player)
+
+        # then the game is over
+        self.assertTrue(game.is_over())
+
+
+class PlayerStatsTest(BaseTestCase):
+    def play_game(self):
+        """Play self.game to the end with self.player winning"""
+        game = self.game
+        game.begin()
+        now = game.time
+        flight = models.Flight.objects.create(
+            game=game,
+            origin=game.start_airport,
+            destination=game.start_airport.destinations.all()[0],
+            depart_time=now,
+            flight_time=90,
+        )
+        game.record_ticket_purchase([self.player], flight)
+        ach = models.Achievement.objects.get(game=game, player=self.player)
+        ach.fulfill(flight.arrival_time)
+        ach.fulfill(flight.arrival_time)  # no double counting
+        game.end()
+        return flight
+
+    def test_new_player_has_stats(self):
+        # when a player is created
+        user = User.objects.create_user(username='newbie', password='test')
+        player = models.Player.objects.create(user=user)
+
+        # then it has (empty) stats
+        stats = models.PlayerStats.objects.get(player=player)
+        self.assertEqual(stats.game_count, 0)
+        self.assertEqual(stats.won_count, 0)
+
+    def test_stats_updated(self):
+        # when the player plays and wins a game
+        flight = self.play_game()
+
+        # then the stats are updated
+        stats = models.PlayerStats.objects.get(player=self.player)
+        finish_time = flight.arrival_time - self.game.creation_time
+        self.assertEqual(stats.game_count, 1)
+        self.assertEqual(stats.won_count, 1)
+        self.assertEqual(stats.goal_count, 1)
+        self.assertEqual(stats.ticket_count, 1)
+        self.assertEqual(stats.flight_time, 90)
+        self.assertAlmostEqual(stats.total_time, finish_time.total_seconds())
+        self.assertEqual(stats.finished_count, 1)
+
+        # and they are the same as the ones built from the game history
+        stats.delete()
+        rebuilt = models.PlayerStats.objects.for_player(self.player)
+        for field in (
+            'game_count',
+            'won_count',
+            'goal_count',
+            'ticket_count',
+            'finished_count',
+        ):
+            self.assertEqual(getattr(rebuilt, field), 1)
+        self.assertEqual(rebuilt.flight_time, 90)
+        self.assertAlmostEqual(rebuilt.total_time, finish_time.total_seconds())
+
+    def test_remove_player(self):
+        # when the player quits the game
+        self.game.remove_player(self.player)
+
+        # then it's no longer counted
+        stats = models.PlayerStats.objects.get(player=self.player)
+        self.assertEqual(stats.game_count, 0)
+
+
+class ArchiveTest(BaseTestCase):
+    def setUp(self):
+        super(ArchiveTest, self).setUp()
+        game = self.game
+        game.begin()
+        self.flight = game.start_airport.next_flights(game.time)[0]
+        game.record_ticket_purchase([self.player], self.flight)
+        self.player.ticket = self.flight
+        self.player.save()
+        models.Message.objects.broadcast('Hello', game)
+        models.Message.objects.filter(game=game).update(read=True)
+        game.end()
+
+    def test_archive(self):
+        # when the game is archived
+        models.Game.objects.archive(self.game)
+
+        # then its flights, purchases and messages are moved to the archive
+        game = models.Game.objects.get(pk=self.game.pk)
+        self.assertTrue(game.archived)
+        self.assertFalse(models.Flight.objects.filter(game=game).exists())
+        self.assertFalse(models.Purchase.objects.filter(game=game).exists())
+        self.assertFalse(models.Message.objects.filter(game=game).exists())
+        self.assertTrue(models.ArchivedFlight.objects.filter(game=game).exists())
+        purchase = models.ArchivedPurchase.objects.get(game=game)
+        self.assertEqual(purchase.flight.number, self.flight.number)
+        messages = models.ArchivedMessage.objects.filter(game=game)
+        self.assertTrue(messages.filter(text='Hello').exists())
+
+        # and the player (whose ticket was archived) is still around
+        player = models.Player.objects.get(pk=self.player.pk)
+        self.assertEqual(player.ticket, None)
+
+    def test_summary_and_stats_read_from_archive(self):
+        # given the summary and stats of the game
+        summary = models.GameSummary.objects.summarize(self.game, self.player)
+        stats = models.PlayerStats.objects.rebuild(self.player)
+
+        # when the game is archived
+        game = models.Game.objects.archive(self.game)
+
+        # then they are the same when computed from the archive
+        self.assertEqual(models.GameSummary.objects.summarize(game, self.player), summary)
+        rebuilt = models.PlayerStats.objects.rebuild(self.player)
+        self.assertEqual(rebuilt.ticket_count, stats.ticket_count)
+        self.assertEqual(rebuilt.flight_time, stats.flight_time)
+
+
+class LeaderboardTest(BaseTestCase):
+    def setUp(self):
+        self.player, self.player2, self.player3 = self.create_players(3)
+        bump = models.PlayerStats.objects.bump
+        bump([self.player2], won_count=2, goal_count=4, game_count=2)
+        bump([self.player3], won_count=2, goal_count=6, game_count=3)
+        bump([self.player], won_count=1, goal_count=9, game_count=3)
+
+    def test_leaderboard(self):
+        # when we get the leaderboard
+        leaderboard = models.PlayerStats.objects.leaderboard()
+
+        # then the players are ranked by wins, then goals. AI players are left
+        # out
+        usernames = [i['username'] for i in leaderboard]
+        self.assertEqual(usernames, ['user3', 'user2', 'user1'])
+        self.assertEqual([i['rank'] for i in leaderboard], [1, 2, 3])
+        self.assertEqual(leaderboard[0]['goals_per_game'], 2.0)
+
+    def test_leaderboard_count(self):
+        leaderboard = models.PlayerStats.objects.leaderboard(2)
+
+        self.assertEqual(len(leaderboard), 2)
+
+    def test_rank(self):
+        rank = models.PlayerStats.objects.rank
+
+        self.assertEqual(rank(self.player3), 1)
+        self.assertEqual(rank(self.player2), 2)
+        self.assertEqual(rank(self.player), 3)
+
+
+class LobbyTest(BaseTestCase):
+    def test_games_info(self):
+        # given the snapshot of the lobby
+        games_info = models.Game.games_info()
+
+        # then it has the same info as Game.info()
+        self.assertEqual(games_info, [self.game.info()])
+
+        # and the next time it doesn't hit the database
+        with self.assertNumQueries(0):
+            self.assertEqual(models.Game.games_info(), games_info)
+
+    def test_build_counts(self):
+        # given the game with several players, goals and airports
+        self.game.end()
+        game = models.Game.objects.create_game(self.player, goals=3, airports=10)
+        user = User.objects.create_user(username='user2', password='test')
+        game.add_player(models.Player.objects.create(user=user))
+
+        # when the snapshot is built
+        with CaptureQueriesContext(connection) as context:
+            rows = models.Lobby.build()
+
+        # then it's one query that doesn't join them together
+        self.assertEqual(len(context), 1)
+        sql = context[0]['sql']
+        for model in (models.Achievement, models.Goal, models.Airport):
+            self.assertFalse('JOIN "{0}"'.format(model._meta.db_table) in sql)
+
+        # and the counts are right
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['num_players'], 3)
+        self.assertEqual(rows[0]['num_goals'], 3)
+        self.assertEqual(rows[0]['num_airports'], 10)
+
+    def test_invalidated_when_player_joins(self):
+        # given the snapshot of the lobby
+        models.Game.games_info()
+
+        # when a player joins the game
+        user = User.objects.create_user(username='user2', password='test')
+        self.game.add_player(models.Player.objects.create(user=user))
+
+        # then the snapshot is rebuilt
+        games_info = models.Game.games_info()
+        self.assertEqual(games_info[0]['players'], 3)
+
+    def test_invalidated_when_game_ends(self):
+        # given the snapshot of the lobby
+        models.Game.games_info()
+
+        # when the game ends
+        self.game.end()
+
+        # then it's gone from the lobby
+        self.assertEqual(models.Game.games_info(), [])
+
+    @patch('airport.models.settings.LOBBY_SHARED_CACHE', True)
+    def test_shared_cache(self):
+        # given the snapshot of the lobby in the shared cache
+        games_info = models.Game.games_info()
+
+        # when another process (with its own Lobby) asks for it
+        with self.assertNumQueries(0):
+            self.assertEqual(models.Lobby().games_info(), games_info)
+
+        # and when another process invalidates it
+        models.Lobby().invalidate()
+
+        # then the snapshot is rebuilt
+        with self.assertNumQueries(1):
+            models.Game.games_info()
+
+
+class GamePoolTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.game.end()
+
+    def test_create_pooled_game(self):
+        # when we create a pooled game
+        pooled = models.Game.objects.create_pooled_game(10)
+
+        # then it has a world but no host and isn't an open game
+        self.assertEqual(pooled.state, pooled.POOLED)
+        self.assertEqual(pooled.host, None)
+        self.assertEqual(pooled.airports.count(), 10)
+        self.assertFalse(models.Game.open_games().filter(pk=pooled.pk).exists())
+        self.assertEqual(list(models.Game.objects.pooled_games(10)), [pooled])
+        self.assertFalse(models.Game.objects.pooled_games(11).exists())
+
+    def test_create_game_claims_pooled_world(self):
+        # given the pooled game
+        pooled = models.Game.objects.create_pooled_game(10)
+        airport_ids = set(pooled.airports.values_list('id', flat=True))
+
+        # when a game is created with the same number of airports
+        game = models.Game.objects.create_game(self.player, 2, 10)
+
+        # then it gets the pooled world
+        self.assertEqual(set(game.airports.values_list('id', flat=True)), airport_ids)
+        self.assertEqual(game.min_distance, int(pooled.min_distance))
+        self.assertEqual(game.goals.count(), 2)
+        self.assertEqual(game.host, self.player)
+        self.assertTrue(game.start_airport.id in airport_ids)
+
+        # and the pooled game is gone
+        self.assertFalse(models.Game.objects.filter(pk=pooled.pk).exists())
+
+    def test_claim_during_build(self):
+        # given the game wanting a world while a pooled one is being built
+        game = models.Game.objects.create_pending_game(self.player)
+        claims = []
+        get_destinations = models.Airport.get_destinations
+
+        def claim(airport, *args, **kwargs):
+            claims.append(models.Game.objects.claim_pooled_world(game, 10))
+            return get_destinations(airport, *args, **kwargs)
+
+        # when it tries to claim a world during the build
+        with patch.object(models.Airport, 'get_destinations', claim):
+            pooled = models.Game.objects.create_pooled_game(10)
+
+        # then the half-built world isn't claimed
+        self.assertTrue(claims)
+        self.assertFalse(any(claims))
+        self.assertFalse(game.airports.exists())
+
+        # and once built it is pooled
+        pooled = models.Game.objects.get(pk=pooled.pk)
+        self.assertEqual(pooled.state, pooled.POOLED)
+        self.assertNotEqual(pooled.min_distance, None)
+
+    def test_claim_with_start(self):
+        # given the pooled game
+        pooled = models.Game.objects.create_pooled_game(10)
+        masters = models.AirportMaster.objects.exclude(airport__game=pooled)
+        game = models.Game.objects.create_pending_game(self.player)
+
+        # when we try to claim a world starting at an airport it doesn't have
+        result = models.Game.objects.claim_pooled_world(game, 10, masters[0])
+
+        # then nothing is claimed
+        self.assertFalse(result)
+
+        # when we try to claim a world with an airport it does have
+        start = pooled.airports.all()[0].master
+        result = models.Game.objects.claim_pooled_world(game, 10, start)
+
+        # then it's claimed
+        self.assertTrue(result)
+        self.assertTrue(game.airports.filter(master=start).exists())
+
 
 class GamePause(BaseTestCase):
     """Test the pausing/resuming of a game"""
@@ -434,9 +914,13 @@ class CreateGameTest(BaseTestCase):
         self.client.login(username='user1', password='test')
         response = self.client.post(url, post)
 
-        # Then we're given a game starting at the requested airport
+        # and the game server builds it
         response = json.loads(response.content.decode('utf-8'))
-        game_id = response['current_game']
+        game_id = response['pending_game']
+        mock_send_message.assert_called_with('create_game', ANY)
+        lib.build_game(mock_send_message.call_args[0][1])
+
+        # Then we're given a game starting at the requested airport
         game = models.Game.objects.get(pk=game_id)
         self.assertEqual(game.start_airport.city, start)
 
@@ -461,10 +945,11 @@ class CreateGameTest(BaseTestCase):
         # when we create a game through the view
         self.client.login(username='user1', password='test')
         response = self.client.post(url, post)
+        lib.build_game(mock_send_message.call_args[0][1])
 
         # Then we're still given a game, but not at the airport (obviously)
         response = json.loads(response.content.decode('utf-8'))
-        game_id = response['current_game']
+        game_id = response['pending_game']
         game = models.Game.objects.get(pk=game_id)
         self.assertNotEqual(game.start_airport.city.name, start)
 
@@ -506,6 +991,81 @@ class FlightTest(BaseTestCase):
         now = datetime.datetime(2011, 11, 18, 5, 0)
         self.assertFalse(flight.in_flight(now))
 
+    def test_prune(self):
+        # given the game with flights that have long since landed
+        self.game.begin()
+        now = self.game.time
+        airport = self.game.start_airport
+        flights = [
+            models.Flight.objects.create(
+                game=self.game,
+                origin=airport,
+                destination=airport.destinations.all()[0],
+                depart_time=now - datetime.timedelta(minutes=i),
+                flight_time=60,
+            )
+            for i in range(3)
+        ]
+        purchased, ticketed = flights[:2]
+        self.game.record_ticket_purchase([self.player], purchased)
+        self.player.ticket = ticketed
+        self.player.save()
+
+        # when we prune flights a day later
+        later = now + datetime.timedelta(days=1)
+        pruned = models.Flight.objects.prune(self.game, later)
+
+        # then the old flights are gone except for ones people bought
+        self.assertEqual(pruned, 1)
+        remaining = models.Flight.objects.filter(game=self.game)
+        self.assertEqual(set(remaining), {purchased, ticketed})
+
+        # and pruning again does nothing
+        self.assertEqual(models.Flight.objects.prune(self.game, later), 0)
+
+    def test_delay_departures(self):
+        # given the airport with flights yet to depart
+        now = self.game.time
+        airport = self.game.start_airport
+        flights = airport.next_flights(now, future_only=True)
+        departures = {i.pk: (i.depart_time, i.arrival_time) for i in flights}
+
+        # when we delay its departures
+        delay = datetime.timedelta(minutes=30)
+        with self.assertNumQueries(1):
+            count = models.Flight.objects.delay_departures(airport, delay, now)
+
+        # then they are all delayed
+        self.assertEqual(count, len(departures))
+        for flight in models.Flight.objects.filter(pk__in=departures):
+            depart_time, arrival_time = departures[flight.pk]
+            self.assertEqual(flight.state, 'Delayed')
+            self.assertEqual(flight.depart_time, depart_time + delay)
+            self.assertEqual(flight.arrival_time, arrival_time + delay)
+
+    def test_cancel_departures(self):
+        # given the airport with flights yet to depart
+        now = self.game.time
+        airport = self.game.start_airport
+        flights = airport.next_flights(now, future_only=True)
+
+        # and the player holding a ticket on one of them
+        self.player.ticket = flights[0]
+        self.player.save()
+
+        # when we cancel its departures
+        cancelled, revoked = models.Flight.objects.cancel_departures(airport, now)
+
+        # then they are all cancelled
+        self.assertEqual(cancelled, len(flights))
+        states = models.Flight.objects.filter(pk__in=[i.pk for i in flights])
+        self.assertEqual(set(states.values_list('state', flat=True)), {'Cancelled'})
+
+        # and the ticket is revoked
+        self.assertEqual(revoked, 1)
+        self.player.refresh_from_db()
+        self.assertEqual(self.player.ticket, None)
+
     def test_cancelled_has_landed(self):
         # Given flight
         airport = models.Airport.objects.filter(game=self.game)[0]
@@ -851,9 +1411,8 @@ class AIPlayerTest(BaseTestCase):
         self.assertTrue(send_message.called)
 
         args = send_message.call_args[0]
-        self.assertEqual(args[0], 'game_created')
-        game_id = args[1]
-        game = models.Game.objects.get(pk=game_id)
+        self.assertEqual(args[0], 'create_game')
+        game = lib.build_game(args[1])
         ai_player = game.players.filter(ai_player=True)
         self.assertTrue(ai_player.exists())
         game.end()
@@ -864,9 +1423,8 @@ class AIPlayerTest(BaseTestCase):
         self.client.post(url, form)
 
         args = send_message.call_args[0]
-        self.assertEqual(args[0], 'game_created')
-        game_id = args[1]
-        game = models.Game.objects.get(pk=game_id)
+        self.assertEqual(args[0], 'create_game')
+        game = lib.build_game(args[1])
         ai_player = game.players.filter(ai_player=True)
         self.assertFalse(ai_player.exists())
 
@@ -901,6 +1459,49 @@ class AIPlayerTest(BaseTestCase):
         self.assertEqual(ai_player.ticket, None)
 
 
+class MakeMovesTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.game.end()
+        self.game = models.Game.objects.create_game(
+            host=self.player, goals=2, airports=15, ai_player=False
+        )
+        for i in range(3):
+            user = User.objects.create_user(username='robot%s' % i)
+            ai_player = models.Player.objects.create(user=user, ai_player=True)
+            self.game.add_player(ai_player)
+
+    @patch('airport.lib.send_message')
+    def test_make_moves(self, send_message):
+        # given the game in progress with flights
+        game = self.game
+        game.begin()
+        now = lib.take_turn(game, throw_wrench=False)
+        routing.routing_table(game)
+
+        # when we make moves for all the ai players
+        with self.assertNumQueries(4):
+            purchases = models.Player.objects.make_moves(game, now)
+
+        # then every ai player bought a ticket out of the start airport
+        ai_players = game.players.filter(ai_player=True).distinct()
+        self.assertEqual(set(purchases), {i.pk for i in ai_players})
+        for ai_player in ai_players:
+            self.assertEqual(ai_player.ticket, purchases[ai_player.pk])
+            self.assertEqual(ai_player.ticket.origin, game.start_airport)
+
+        # and the human player was left alone
+        player = models.Player.objects.get(pk=self.player.pk)
+        self.assertEqual(player.ticket, None)
+
+    def test_game_not_started(self):
+        # when we make moves for a game that hasn't started
+        purchases = models.Player.objects.make_moves(self.game)
+
+        # then nothing happens
+        self.assertEqual(purchases, {})
+
+
 class Messages(BaseTestCase):
     """Test the messages model"""
 
@@ -993,6 +1594,57 @@ class Messages(BaseTestCase):
         self.assertEqual(messages[0].text, 'this is test3')
 
 
+    @patch.object(models.settings, 'MESSAGE_RETENTION_COUNT', 3)
+    def test_compact_keeps_last_messages(self):
+        # given the player with a bunch of messages, the last one unread
+        for i in range(5):
+            models.Message.objects.send(self.player, 'Test %s' % i)
+        models.Message.objects.update(read=True)
+        unread = models.Message.objects.send(self.player, 'Unread')
+
+        # when we compact the messages
+        deleted = models.Message.objects.compact()
+
+        # then only the last few are kept (the welcome message is gone too)
+        self.assertEqual(deleted, 4)
+        messages = models.Message.objects.filter(player=self.player)
+        texts = [i.text for i in messages.order_by('id')]
+        self.assertEqual(texts, ['Test 3', 'Test 4', unread.text])
+
+    @patch.object(models.settings, 'MESSAGE_RETENTION_COUNT', 0)
+    def test_compact_keeps_nothing(self):
+        # given the player with read messages and an unread one
+        for i in range(3):
+            models.Message.objects.send(self.player, 'Test %s' % i)
+        models.Message.objects.update(read=True)
+        unread = models.Message.objects.send(self.player, 'Unread')
+
+        # when we compact the messages keeping none
+        models.Message.objects.compact()
+
+        # then only the unread message is left
+        messages = models.Message.objects.filter(player=self.player)
+        self.assertEqual(list(messages), [unread])
+
+    def test_compact_drops_messages_of_ended_games(self):
+        # given the game that has ended and whose messages have been read
+        game = models.Game.objects.create_game(
+            host=self.player, goals=1, airports=4, density=1
+        )
+        game.begin()
+        models.Message.objects.broadcast('Game message', game)
+        game.end()
+        models.Message.objects.update(read=True)
+
+        # when we compact the messages a week later
+        later = datetime.datetime.now() + datetime.timedelta(days=8)
+        models.Message.objects.compact(later)
+
+        # then the game's messages are gone
+        self.assertFalse(models.Message.objects.filter(game=game).exists())
+        self.assertTrue(models.Message.objects.filter(player=self.player).exists())
+
+
 class Cities(BaseTestCase):
     """Test the Cities module"""
 
@@ -1164,3 +1816,29 @@ class ChoiceTest(TestCase):
 
         # then we don't get the excluded item
         self.assertEqual(result, other)
+
+    def test_does_not_count(self):
+        # given the queryset with multiple items
+        for i in range(10):
+            User.objects.create_user(username='test%s' % i, password='***')
+        queryset = User.objects.filter(username__startswith='test')
+
+        # when we call choice() on the queryset
+        with self.assertNumQueries(2):
+            result = models.random_choice(queryset)
+
+        # then we get an entry in the queryset (without counting it)
+        self.assertTrue(result.username.startswith('test'))
+
+    def test_list(self):
+        # given the list of items
+        items = [1, 2, 3]
+
+        # when we call choice() on the list
+        result = models.random_choice(items)
+
+        # then we get an item from the list
+        self.assertTrue(result in items)
+
+        # and an empty list gives None
+        self.assertEqual(models.random_choice([]), None)
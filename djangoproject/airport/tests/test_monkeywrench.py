@@ -1,4 +1,5 @@
 import datetime
+import random
 from unittest.mock import patch
 
 from airport import lib, models, monkeywrench
@@ -64,6 +65,21 @@ class CancelledFlightMonkeyWrenchTest(MonkeyWrenchTestBase):
         self.assertTrue(mw.thrown)
         self.assertTrue(cancelled.exists())
 
+    @patch('airport.models.randint')
+    def test_seeded(self, global_randint):
+        # given the flight a seeded random number generator picks
+        flights = self.game.flights.filter(depart_time__gt=self.now)
+        flight = models.random_choice(flights, random.Random(5))
+
+        # when the CancelledFlight is thrown with the same seed
+        mw = monkeywrench.CancelledFlight(self.game, rng=random.Random(5))
+        mw.throw()
+
+        # then that flight gets cancelled
+        flight = models.Flight.objects.get(pk=flight.pk)
+        self.assertEqual(flight.state, 'Cancelled')
+        self.assertFalse(global_randint.called)
+
 
 class DelayedFlightMonkeyWrenchTest(MonkeyWrenchTestBase):
     def test_throw(self):
@@ -237,3 +253,64 @@ class TailWindMonkeyWrenchTest(BaseTestCase):
         # then the flight's arrival_time changed
         flight = models.Flight.objects.get(pk=flight.pk)
         self.assertGreater(original_time, flight.arrival_time)
+
+
+class MonkeyWrenchFactoryTest(BaseTestCase):
+    def test_all_wrenches(self):
+        # when we create a factory with the default settings
+        mwf = monkeywrench.MonkeyWrenchFactory()
+
+        # then it has all the wrenches, equally weighted
+        self.assertEqual(set(mwf.wrenches), set(monkeywrench.registry().values()))
+        self.assertEqual(set(mwf.wrenches.values()), {1})
+
+    def test_enabled(self):
+        # given the setting enabling only the TailWind wrench
+        with patch.object(monkeywrench.settings, 'MONKEYWRENCH_ENABLED', ['TailWind']):
+            # when we create a wrench
+            wrench = monkeywrench.MonkeyWrenchFactory().create(self.game)
+
+        # then it's a TailWind
+        self.assertEqual(type(wrench), monkeywrench.TailWind)
+
+    def test_weights(self):
+        # given the weights disabling all but the Hint wrench
+        weights = {name: 0 for name in monkeywrench.registry()}
+        weights['Hint'] = 5
+
+        # when we create a factory
+        with patch.object(monkeywrench.settings, 'MONKEYWRENCH_WEIGHTS', weights):
+            mwf = monkeywrench.MonkeyWrenchFactory()
+
+        # then only the Hint wrench gets thrown
+        self.assertEqual(mwf.wrenches, {monkeywrench.Hint: 5})
+        self.assertEqual(type(mwf.create(self.game)), monkeywrench.Hint)
+
+    def test_weighted_choice(self):
+        # given the Hint wrench weighted 3 to the TailWind's 1
+        weights = {name: 0 for name in monkeywrench.registry()}
+        weights.update(Hint=3, TailWind=1)
+        with patch.object(monkeywrench.settings, 'MONKEYWRENCH_WEIGHTS', weights):
+            mwf = monkeywrench.MonkeyWrenchFactory(random.Random(1))
+
+        # when we create wrenches with a seeded random number generator
+        wrenches = [type(mwf.create(self.game)) for i in range(400)]
+
+        # then about three in four are Hints
+        hints = wrenches.count(monkeywrench.Hint)
+        self.assertEqual(hints + wrenches.count(monkeywrench.TailWind), 400)
+        self.assertTrue(270 < hints < 330, hints)
+
+    @patch('airport.monkeywrench.random')
+    def test_seeded(self, global_random):
+        # given two factories seeded the same
+        factories = [
+            monkeywrench.MonkeyWrenchFactory(random.Random(5)) for i in range(2)
+        ]
+
+        # when they create wrenches
+        wrenches = [[type(f.create(self.game)) for i in range(20)] for f in factories]
+
+        # then they create the same ones without the global random
+        self.assertEqual(wrenches[0], wrenches[1])
+        self.assertFalse(global_random.mock_calls)
@@ -0,0 +1,152 @@
+import datetime
+from unittest.mock import patch
+
+from airport import models, routing
+from airport.tests import BaseTestCase
+
+MINUTE = datetime.timedelta(seconds=60)
+
+
+class RoutingTestBase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.table = routing.RoutingTable(self.game)
+        self.now = self.game.time
+
+    def flight(self, origin_id, destination_id, depart, arrive, **kwargs):
+        """Return an (unsaved) Flight departing/arriving *depart*/*arrive*
+        minutes from now"""
+        return models.Flight(
+            origin_id=origin_id,
+            destination_id=destination_id,
+            depart_time=self.now + depart * MINUTE,
+            arrival_time=self.now + arrive * MINUTE,
+            **kwargs
+        )
+
+
+class RoutingTableTest(RoutingTestBase):
+    def test_hops_to(self):
+        # given the game's goal city
+        goal = models.Goal.objects.get(game=self.game)
+        goal_airports = set(self.table.airports_in(goal.city_id))
+
+        # when we get the hops to the city
+        hops = self.table.hops_to(goal.city_id)
+
+        # then the goal's airports are 0 hops away
+        self.assertEqual({i for i in hops if hops[i] == 0}, goal_airports)
+
+        # and the rest are one more than their closest destination
+        for airport_id, count in hops.items():
+            if count == 0:
+                continue
+            destinations = self.table.destinations[airport_id]
+            closest = min(hops[i] for i in destinations if i in hops)
+            self.assertEqual(count, closest + 1)
+
+    def test_routing_table_is_cached(self):
+        # when we get the routing table for a game twice
+        table = routing.routing_table(self.game)
+
+        # then the second time doesn't hit the database
+        with self.assertNumQueries(0):
+            self.assertIs(routing.routing_table(self.game), table)
+
+        # until it's forgotten
+        routing.forget(self.game)
+        self.assertIsNot(routing.routing_table(self.game), table)
+        routing.forget(self.game)
+
+
+class EarliestArrivalsTest(RoutingTestBase):
+    def test_connections(self):
+        # given the flights
+        direct = self.flight(1, 3, 10, 200)
+        first_leg = self.flight(1, 2, 5, 60)
+        second_leg = self.flight(2, 3, 70, 120)
+        missed = self.flight(2, 3, 30, 90)
+
+        # when we search for earliest arrivals from airport 1
+        flights = [direct, second_leg, missed, first_leg]
+        arrivals = routing.earliest_arrivals(flights, 1, self.now)
+
+        # then the connection beats the direct flight
+        self.assertEqual(arrivals[3], (second_leg.arrival_time, first_leg))
+        self.assertEqual(arrivals[2], (first_leg.arrival_time, first_leg))
+        self.assertEqual(arrivals[1], (self.now, None))
+
+    def test_skips_full_and_cancelled(self):
+        # given the full and cancelled flights
+        flights = [
+            self.flight(1, 2, 5, 60, full=True),
+            self.flight(1, 3, 5, 60, state='Cancelled'),
+        ]
+
+        # when we search for earliest arrivals
+        arrivals = routing.earliest_arrivals(flights, 1, self.now)
+
+        # then we can't get anywhere
+        self.assertEqual(list(arrivals), [1])
+
+
+class PlanMoveTest(RoutingTestBase):
+    def test_heads_towards_goal(self):
+        # given the routing table where airport 1 is 2 hops from the goal via
+        # airport 2 but 3 hops via airport 4
+        self.table.cities = {1: 10, 2: 20, 3: 30, 4: 40, 5: 50}
+        self.table.destinations = {
+            1: {2, 4},
+            2: {1, 3},
+            3: {2, 5},
+            4: {1, 5},
+            5: {3, 4},
+        }
+        self.table._hops = {}
+
+        # and the outbound flights (which don't connect to the goal yet)
+        to_2 = self.flight(1, 2, 30, 90)
+        to_4 = self.flight(1, 4, 5, 40)
+
+        # when we plan a move to the goal city
+        flight = routing.plan_move(self.table, [to_4, to_2], 1, 30, self.now)
+
+        # then we take the flight that gets us closer
+        self.assertIs(flight, to_2)
+
+    def test_nothing_to_take(self):
+        # when there are no flights
+        flight = routing.plan_move(self.table, [], 1, 30, self.now)
+
+        # then there's nothing to take
+        self.assertEqual(flight, None)
+
+
+@patch('airport.lib.send_message')
+class MakeMoveTest(BaseTestCase):
+    def test_buys_direct_flight_to_goal(self, send_message):
+        # given the game with an ai player
+        game = self.game
+        ai_player = game.players.get(ai_player=True)
+        game.begin()
+        now = game.time
+
+        # and a flight from the start airport directly to the goal city
+        goal = models.Goal.objects.get(game=game)
+        destination = models.Airport.objects.filter(
+            game=game, master__city=goal.city
+        )[0]
+        flight = models.Flight.objects.create(
+            game=game,
+            origin=game.start_airport,
+            destination=destination,
+            depart_time=now + 10 * MINUTE,
+            flight_time=60,
+        )
+
+        # when the ai player makes a move
+        ai_player = models.Player.objects.get(pk=ai_player.pk)
+        ai_player.make_move(game, now)
+
+        # then it buys the flight
+        self.assertEqual(ai_player.ticket, flight)
@@ -0,0 +1,72 @@
+from contextlib import contextmanager
+from io import StringIO
+from unittest.mock import patch
+
+from django.core import management
+from django.test import TestCase
+
+from airport import models
+from airport.simulation import Simulation
+
+
+class SimulationTest(TestCase):
+    def test_run(self):
+        # given the simulation of two games with AI players
+        simulation = Simulation(games=2, airports=10, goals=1, players=2, ai=True)
+
+        # when we run it for half an hour of game time
+        stats = simulation.run(0.5)
+
+        # then it ticks (without waiting half an hour)
+        self.assertEqual(stats['games'], 2)
+        self.assertEqual(stats['ticks'], 8)
+        self.assertTrue(stats['queries_per_tick'] > 0)
+        self.assertTrue(stats['rows']['flights'] > 0)
+
+        # and the AI players buy tickets
+        players = models.Player.objects.filter(user__username__startswith='simulator')
+        self.assertTrue(players.exclude(ticket=None).exists())
+
+        # and game time is real time again
+        self.assertFalse(hasattr(models.Game, 'gettime'))
+
+    def test_teardown(self):
+        # given the simulation that has run
+        simulation = Simulation(airports=10, goals=1, players=1, ai=True)
+        simulation.run(0.5)
+        games = [i.pk for i in simulation.games]
+
+        # when we tear it down
+        simulation.teardown()
+
+        # then the games are gone but the players are not
+        self.assertFalse(models.Game.objects.filter(pk__in=games).exists())
+        self.assertTrue(
+            models.Player.objects.filter(user__username='simulator1').exists()
+        )
+
+    def test_command(self):
+        databases = []
+
+        @contextmanager
+        def test_database(kind):
+            # the test runner's database stands in for the throw-away one
+            databases.append(kind)
+            yield
+
+        # when we run the simulate command
+        stdout = StringIO()
+        with patch(
+            'airport.management.commands.simulate.test_database', test_database
+        ):
+            management.call_command(
+                'simulate', games=1, airports=10, goals=1, hours=0.5, stdout=stdout
+            )
+
+        # then it's run in a throw-away database
+        self.assertEqual(databases, ['file'])
+
+        # and it reports the stats
+        output = stdout.getvalue()
+        self.assertTrue('Ticks/second' in output, output)
+        self.assertTrue('Queries/tick' in output, output)
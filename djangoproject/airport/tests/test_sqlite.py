@@ -0,0 +1,42 @@
+from unittest.mock import Mock, call, patch
+
+from django.test import SimpleTestCase
+
+from airport import sqlite
+
+
+class ApplyProfileTest(SimpleTestCase):
+    def setUp(self):
+        self.connection = Mock(vendor='sqlite')
+        self.execute = self.connection.cursor.return_value.execute
+
+    def test_off_by_default(self):
+        sqlite.apply_profile(None, self.connection)
+
+        self.assertFalse(self.execute.called)
+
+    @patch.object(sqlite.settings, 'SQLITE_PROFILE', True)
+    @patch.object(sqlite.settings, 'SQLITE_PRAGMAS', {'cache_size': -1024})
+    def test_apply_profile(self):
+        # when the profile is applied to a new connection
+        sqlite.apply_profile(None, self.connection)
+
+        # then the pragmas are set (overrides included)
+        self.assertEqual(
+            self.execute.call_args_list,
+            [
+                call('PRAGMA journal_mode = WAL'),
+                call('PRAGMA synchronous = NORMAL'),
+                call('PRAGMA busy_timeout = 5000'),
+                call('PRAGMA mmap_size = 268435456'),
+                call('PRAGMA cache_size = -1024'),
+            ],
+        )
+
+    @patch.object(sqlite.settings, 'SQLITE_PROFILE', True)
+    def test_other_databases(self):
+        self.connection.vendor = 'postgresql'
+
+        sqlite.apply_profile(None, self.connection)
+
+        self.assertFalse(self.execute.called)
@@ -1,6 +1,7 @@
 import json
 from unittest.mock import patch
 
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
 
 from airport import models
@@ -224,3 +225,85 @@ def decode_response(response):
     content = response.content
     content = content.decode(response.charset)
     return json.loads(content)
+
+
+class GameSummaryViewTestCase(ViewTest):
+    view = reverse('game_summary')
+
+    def setUp(self):
+        super(GameSummaryViewTestCase, self).setUp()
+        cache.clear()
+        self.game = models.Game.objects.create_game(
+            host=self.player, goals=1, airports=4, density=1
+        )
+        self.game.add_player(self.player2)
+        self.game.begin()
+        origin = self.game.start_airport
+        flight = models.Flight.objects.create(
+            game=self.game,
+            origin=origin,
+            destination=self.game.airports.exclude(pk=origin.pk)[0],
+            depart_time=self.game.time,
+            flight_time=60,
+        )
+        self.game.record_ticket_purchase([self.player], flight)
+        self.client.login(username=self.player.username, password='test')
+
+    def test_in_progress(self):
+        # when we view the summary of a game in progress
+        response = self.client.get(self.view, {'id': self.game.pk})
+
+        # then it's computed but not stored
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['tickets']), 1)
+        self.assertIn(self.player2.username, response.context['players'])
+        self.assertNotIn(self.player.username, response.context['players'])
+        self.assertFalse(models.GameSummary.objects.exists())
+
+    def test_game_over(self):
+        # given the finished game
+        with patch('airport.lib.send_message'):
+            self.game.end()
+
+        # then the summaries were built when the game ended
+        summaries = models.GameSummary.objects.filter(game=self.game)
+        self.assertEqual(summaries.count(), self.game.players.distinct().count())
+
+        # when we view the summary
+        response = self.client.get(self.view, {'id': self.game.pk})
+        self.assertEqual(len(response.context['tickets']), 1)
+
+        # then the second time around it comes from the cache
+        with self.assertNumQueries(5):
+            cached = self.client.get(self.view, {'id': self.game.pk})
+        self.assertEqual(cached.content, response.content)
+
+    def test_cache_versioned(self):
+        # given the finished game whose summary has been viewed
+        with patch('airport.lib.send_message'):
+            self.game.end()
+        self.client.get(self.view, {'id': self.game.pk})
+
+        # when a new version is deployed
+        with patch('airport.views.VERSION', 'next'):
+            response = self.client.get(self.view, {'id': self.game.pk})
+
+        # then the page is rendered again
+        self.assertEqual(len(response.context['tickets']), 1)
+
+
+class LeaderboardViewTestCase(ViewTest):
+    view = reverse('leaderboard')
+
+    def test_leaderboard(self):
+        # given the player who has won a game
+        models.PlayerStats.objects.bump([self.player2], won_count=1)
+
+        # when the player views the leaderboard
+        self.client.login(username=self.player.username, password='test')
+        response = self.client.get(self.view)
+
+        # then they get the leaderboard and their rank
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(data['leaderboard'][0]['username'], self.player2.username)
+        self.assertEqual(data['rank'], 2)
@@ -8,6 +8,7 @@ urlpatterns = [
     url(r'^messages/$', views.messages, name='messages'),
     url(r'^games_info/$', views.games_info, name='games_info'),
     url(r'^games_stats/$', views.games_stats),
+    url(r'^leaderboard/$', views.leaderboard, name='leaderboard'),
     url(r'^games_create/$', views.games_create, name='games_create'),
     url(r'^games_join/$', views.games_join, name='games_join'),
     url(r'^games_pause/$', views.pause_game, name='pause_game'),
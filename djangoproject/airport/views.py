@@ -10,6 +10,7 @@ from django.contrib import messages as django_messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.http import HttpResponse
 from django.shortcuts import (get_object_or_404, redirect, render,
@@ -18,6 +19,7 @@ from django.template.loader import render_to_string
 from django.views.decorators.http import require_http_methods
 
 from airport import VERSION, forms, lib, models
+from airport.budget import per_game, query_budget, request_game
 from airport.conf import settings
 
 
@@ -41,6 +43,7 @@ def main(request):
 
 
 @login_required
+@query_budget('views.info', per_game(30, players=1, game=request_game))
 def info(request):
     """Used ajax called to be used by the main() view.
 
@@ -137,6 +140,7 @@ def rage_quit(request):
 
 
 @login_required
+@query_budget('views.messages', 4)
 def messages(request):
     """View to return user's current messages"""
     last_message = int(request.GET.get('last', 0))
@@ -158,6 +162,7 @@ def messages(request):
 
 
 @login_required
+@query_budget('views.games_info', per_game(20, players=1, game=request_game))
 def games_info(request):
     """Just another json view"""
     player = request.user.player
@@ -176,12 +181,27 @@ def games_info(request):
     return json_response(data)
 
 
+@login_required
+def leaderboard(request):
+    """json view of the top players and the rank of request.user"""
+    player = request.user.player
+    data = {
+        'leaderboard': models.PlayerStats.objects.leaderboard(),
+        'rank': models.PlayerStats.objects.rank(player),
+    }
+    return json_response(data)
+
+
 @require_http_methods(['POST'])
 @login_required
 def games_create(request):
     """Create a game, or if the user is currently in a non-closed game,
     send a message saying they can't create a game(yet).  Finally, redirect
     to the games view
+
+    The game is created asynchronously by the game server.  The response
+    contains the id of the pending game as "pending_game" and the lobby is
+    sent a "game_created" message when it is ready.
     """
     user = request.user
     player = user.player
@@ -202,8 +222,12 @@ def games_create(request):
 
     games = models.Game.objects.exclude(state=models.Game.GAME_OVER)
     games = games.filter(players=player)
+    pending = models.Game.objects.filter(host=player, state=models.Game.CREATING)
     winners = models.Player.objects.winners
-    if games.exists() and not all([player in winners(i) for i in games]):
+    if pending.exists():
+        m = 'Cannot create a game since you are already creating one.'
+        models.Message.objects.send(player, m)
+    elif games.exists() and not all([player in winners(i) for i in games]):
         m = 'Cannot create a game since you are already playing an open game.'
         models.Message.objects.send(player, m)
     else:
@@ -217,14 +241,24 @@ def games_create(request):
                 else None
             )
 
-        game = models.Game.objects.create_game(
-            host=player,
-            goals=num_goals,
-            airports=num_airports,
-            ai_player=ai_player,
-            start=start_airport,
+        # The world is built in the background by the game server.  We just
+        # hand back the id of the pending game.
+        game = models.Game.objects.create_pending_game(player)
+        lib.send_message(
+            'create_game',
+            {
+                'game': game.pk,
+                'host': player.pk,
+                'goals': num_goals,
+                'airports': num_airports,
+                'ai_player': ai_player,
+                'start': start_airport.pk if start_airport else None,
+            },
         )
-        lib.send_message('game_created', game.pk)
+        data = player.game_info()
+        data['games'] = models.Game.games_info()
+        data['pending_game'] = game.pk
+        return json_response(data)
 
     return games_info(request)
 
@@ -282,25 +316,16 @@ def games_stats(request):
     """Return user stats on game"""
     player = request.user.player
     games = player.games
+    stats = models.PlayerStats.objects.for_player(player)
 
     cxt = {}
     cxt['user'] = request.user
-    cxt['game_count'] = games.count()
-    cxt['won_count'] = models.Game.objects.won_by(player).count()
-    cxt['goal_count'] = player.goals.count()
-    cxt['ticket_count'] = player.tickets.count()
-    cxt['flight_hours'] = sum((i.flight.flight_time for i in player.tickets)) / 60.0
-
-    cxt['total_time'] = datetime.timedelta(seconds=0)
-    for game in games.distinct():
-        last_goal = game.last_goal()
-        my_time = models.Achievement.objects.get(
-            game=game, goal=last_goal, player=player
-        ).timestamp
-        if not my_time:
-            continue
-        cxt['total_time'] = cxt['total_time'] + (my_time - game.creation_time)
-    cxt['total_time'] = cxt['total_time']
+    cxt['game_count'] = stats.game_count
+    cxt['won_count'] = stats.won_count
+    cxt['goal_count'] = stats.goal_count
+    cxt['ticket_count'] = stats.ticket_count
+    cxt['flight_hours'] = stats.flight_time / 60.0
+    cxt['total_time'] = datetime.timedelta(seconds=stats.total_time)
 
     if cxt['game_count']:
         cxt['avg_time'] = cxt['total_time'].total_seconds() / cxt['game_count']
@@ -353,36 +378,33 @@ def game_summary(request):
     if not player.is_playing(game):
         return redirect(main)
 
-    goals = list(models.Goal.objects.filter(game=game).order_by('order'))
-    tickets = models.Purchase.objects.filter(player=player, game=game).order_by(
-        'creation_time'
-    )
-
-    current_goal = 0
-    for ticket in tickets:
-        ticket.goal = False
-        try:
-            if ticket.flight.destination.city == goals[current_goal].city:
-                ticket.goal = True
-                current_goal = current_goal + 1
-        except IndexError:
-            pass
+    # A finished game's summary page never changes
+    finished = game.state == game.GAME_OVER
+    cache_key = game_summary_cache_key(game, player, request.user)
+    if finished:
+        html = cache.get(cache_key)
+        if html is not None:
+            return HttpResponse(html)
 
-    placed = game.place(player)
-
-    context = {}
+    context = models.GameSummary.objects.for_game(game, player)
     context['player'] = player
-    context['tickets'] = tickets
-    context['placed'] = placed
     context['game'] = game
-    context['goals'] = goals
-    context['num_airports'] = game.airports.distinct().count()
-    context['players'] = game.players.exclude(id=player.id).distinct()
     context['map_latitude'] = settings.MAP_INITIAL_LATITUDE
     context['map_longitude'] = settings.MAP_INITIAL_LONGITUDE
     context['map_zoom'] = settings.MAP_INITIAL_ZOOM
 
-    return render(request, 'airport/game_summary.html', context)
+    response = render(request, 'airport/game_summary.html', context)
+    if finished:
+        cache.set(cache_key, response.content, settings.GAME_SUMMARY_CACHE_TTL)
+
+    return response
+
+
+def game_summary_cache_key(game, player, user):
+    # the page changes with the templates so the key includes the version
+    return 'airport.game_summary.{0}.{1}.{2}.{3}'.format(
+        VERSION, game.pk, player.pk, user.pk
+    )
 
 
 def crash(_request):
@@ -0,0 +1,5 @@
+# Settings for running the tests: python manage.py test --settings=...
+from .settings import *  # noqa
+
+# every test checks the query budgets of the code it runs
+AIRPORT = dict(globals().get('AIRPORT', {}), QUERY_BUDGETS='enforce')